@@ -5,72 +5,26 @@ import asyncio
 import os
 import re
 import json
-import requests
-from bs4 import BeautifulSoup
-import subprocess
-import shutil
-import edge_tts
 import time
+import hashlib
+import argparse
 from datetime import datetime
-HISTORY_FILE = "processed_urls.json"
-GITHUB_REPO = "danielnguyen241/tatinta-audio-tool"
-GITHUB_API_URL = f"https://api.github.com/repos/{GITHUB_REPO}/contents/{HISTORY_FILE}"
-def _get_github_token():
-    try:
-        return st.secrets.get("GITHUB_TOKEN", "")
-    except:
-        return os.environ.get("GITHUB_TOKEN", "")
-def load_history():
-    gh_token = _get_github_token()
-    try:
-        headers = {"Accept": "application/vnd.github.v3+json"}
-        if gh_token:
-            headers["Authorization"] = f"token {gh_token}"
-        resp = requests.get(GITHUB_API_URL, headers=headers, timeout=5)
-        if resp.status_code == 200:
-            import base64
-            content = base64.b64decode(resp.json()["content"]).decode("utf-8")
-            return json.loads(content)
-    except:
-        pass
-    if os.path.exists(HISTORY_FILE):
-        try:
-            with open(HISTORY_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
-def save_to_history(dest_id, title, audio_vi=None, audio_en=None):
-    history = load_history()
-    history[dest_id] = {
-        "title": title,
-        "ran_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "audio_vi": audio_vi,
-        "audio_en": audio_en
-    }
-    json_str = json.dumps(history, ensure_ascii=False, indent=2)
-    with open(HISTORY_FILE, "w", encoding="utf-8") as f:
-        f.write(json_str)
-    gh_token = _get_github_token()
-    if gh_token:
-        try:
-            import base64
-            headers = {
-                "Authorization": f"token {gh_token}",
-                "Accept": "application/vnd.github.v3+json"
-            }
-            get_resp = requests.get(GITHUB_API_URL, headers=headers, timeout=5)
-            sha = get_resp.json().get("sha") if get_resp.status_code == 200 else None
-            payload = {
-                "message": f"Update history: {dest_id} - {title[:30]}",
-                "content": base64.b64encode(json_str.encode("utf-8")).decode("utf-8"),
-                "branch": "main"
-            }
-            if sha:
-                payload["sha"] = sha
-            requests.put(GITHUB_API_URL, headers=headers, json=payload, timeout=10)
-        except:
-            pass
+from tatinta.pipeline import STAGES, DEFAULT_WORKERS
+from tatinta.cms import CmsClient
+from tatinta.history import get_store, save_to_history, flush_history
+from tatinta.tts import synthesize, get_tts_cache, CHUNK_CHARS, CHUNK_CONCURRENCY
+from tatinta.text import fix_plain_text_for_tts, fix_plain_preview_for_tts
+from tatinta.audio import mix_audio, mix_bytes, prepare_bgm
+from tatinta.batch import BatchConfig, run_batch, stale_report, stale_urls, adopt_fingerprints, STAGE_LABEL, TOKEN_EXPIRED
+from tatinta.jobs import get_job_queue
+from tatinta.metrics import RunMetrics, METRICS_LOG
+from tatinta.limits import limiter_stats, DEPENDENCY_LABEL
+from tatinta.uploads import upload_once
+from tatinta.discover import discover, cms_url
+from tatinta.workers import spawn_workers, running_workers
+from tatinta.cli import child_args
+from tatinta.progress import BatchProgress
+from tatinta.encoding import PROFILES, RAW, get_profile, default_profiles
 st.set_page_config(page_title="Tatinta Audio Automator", page_icon="🎙️", layout="wide")
 st.title("🎙️ Hệ Thống Tự Động Thu Âm & Ghép Nhạc Tatinta CMS")
 # ================= TABS =================
@@ -78,15 +32,20 @@ tab_auto, tab_manual = st.tabs(["🚀 Tự Động Theo URL (Batch)", "✍️ T
 # ================= STATS =================
 @st.fragment(run_every=30)
 def show_stats():
-    _hist = load_history()
-    _total = len(_hist)
-    _has_vi = sum(1 for v in _hist.values() if v.get("audio_vi"))
-    _has_en = sum(1 for v in _hist.values() if v.get("audio_en"))
+    _stats = get_store().stats()
+    _total = _stats["total"]
+    _has_vi = _stats["has_vi"]
+    _has_en = _stats["has_en"]
     col_s1, col_s2, col_s3, col_s4 = st.columns(4)
     col_s1.metric("🎤 Tổng URL đã có Audio", _total)
     col_s2.metric("🇻🇳 Có Audio Tiếng Việt", _has_vi)
     col_s3.metric("🇺🇸 Có Audio Tiếng Anh", _has_en)
-    col_s4.metric("📋 Chưa xử lý", "?", help="Dán URL vào để xem")
+    _cat = get_store().catalog_stats()
+    if _cat:
+        col_s4.metric("📋 Chưa xử lý", _cat["pending"],
+                      help=f"Trong {_cat['total']} bài trên CMS (tìm lúc {_cat['at']}): thiếu VI {_cat['missing_vi']}, thiếu EN {_cat['missing_en']}")
+    else:
+        col_s4.metric("📋 Chưa xử lý", "?", help="Bấm 🔭 Tìm bài thiếu audio ở tab Batch để đếm")
 show_stats()
 st.markdown("---")
 # ================= XÁC THỰC (dùng chung 2 tab) =================
@@ -120,11 +79,17 @@ with col1:
     voice_vi = st.selectbox("Giọng Tiếng Việt", ["vi-VN-NamMinhNeural", "vi-VN-HoaiMyNeural"])
     rate_vi = st.slider("Tốc độ VI (%)", -50, 50, 5)
     pitch_vi = st.slider("Độ trầm (Hz)", -20, 20, -10)
+    profile_vi = st.selectbox("Mã hóa file VI", list(PROFILES), index=list(PROFILES).index(default_profiles()["vi"]),
+                              format_func=lambda n: PROFILES[n].label, key="profile_vi",
+                              help="Giọng đọc trên nền nhạc nhỏ: mono bitrate thấp là đủ, file nhỏ hơn → upload / lưu trữ nhẹ hơn. "
+                                   "AAC / Opus chỉ chọn khi trình phát của app đọc được.")
 with col2:
     run_en = st.checkbox("✅ Tạo Tiếng Anh", value=True)
     voice_en = st.selectbox("Giọng Tiếng Anh", ["en-US-GuyNeural", "en-US-ChristopherNeural", "en-US-AriaNeural"])
     rate_en = st.slider("Tốc độ EN (%)", -50, 50, 0)
     pitch_en = st.slider("Độ trầm EN (Hz)", -20, 20, -2)
+    profile_en = st.selectbox("Mã hóa file EN", list(PROFILES), index=list(PROFILES).index(default_profiles()["en"]),
+                              format_func=lambda n: PROFILES[n].label, key="profile_en")
 # ================= CẤU HÌNH NHẠC NỀN (dùng chung) =================
 st.subheader("🎵 3. Cấu hình Nhạc Nền (BGM)")
 bgm_upload = st.file_uploader("Upload file nhạc nền (.mp3) - Không bắt buộc", type=["mp3"])
@@ -132,8 +97,14 @@ bgm_volume_db = st.slider("Giảm Volume Nhạc Nền (dB)", -50, 0, -20)
 use_bgm = True
 bgm_path = "bgm_default.mp3"
 if bgm_upload:
-    with open("temp_bgm.mp3", "wb") as f:
-        f.write(bgm_upload.getbuffer())
+    # Chỉ ghi lại khi file upload khác file cũ (so hash lưu trong session, không đọc lại file mỗi lần rerun) —
+    # giữ nguyên mtime để cache BGM không phải băm lại
+    _bgm_bytes = bgm_upload.getbuffer()
+    _bgm_sha = hashlib.sha256(_bgm_bytes).hexdigest()
+    if st.session_state.get("bgm_upload_sha") != _bgm_sha or not os.path.exists("temp_bgm.mp3"):
+        with open("temp_bgm.mp3", "wb") as f:
+            f.write(_bgm_bytes)
+        st.session_state.bgm_upload_sha = _bgm_sha
     bgm_path = "temp_bgm.mp3"
 else:
     if not os.path.exists("bgm_default.mp3") and not os.path.exists("Hovering Thoughts - Spence.mp3"):
@@ -142,132 +113,9 @@ else:
     elif os.path.exists("Hovering Thoughts - Spence.mp3"):
         bgm_path = "Hovering Thoughts - Spence.mp3"
 st.markdown("---")
-# ================= HÀM TIỆN ÍCH =================
-def fix_text_for_tts(title, raw_html):
-    if not title and not raw_html: return ""
-    soup = BeautifulSoup(raw_html, "html.parser")
-    for tag in soup.find_all(['strong', 'b', 'em', 'i', 'u', 'span', 'a', 'mark', 'small', 'sub', 'sup']):
-        tag.unwrap()
-    clean_content = soup.get_text(separator="\n").strip()
-    text = f"{title}...\n\n{clean_content}"
-    text = re.sub(r'(\d{1,2}:\d{2})\s*[–—-]\s*(\d{1,2}:\d{2})', r'\1 đến \2', text)
-    ROMAN_CENTURY = {
-        'XXI': 21, 'XXII': 22, 'XX': 20, 'XIX': 19, 'XVIII': 18,
-        'XVII': 17, 'XVI': 16, 'XV': 15, 'XIV': 14, 'XIII': 13,
-        'XII': 12, 'XI': 11, 'X': 10, 'IX': 9, 'VIII': 8,
-        'VII': 7, 'VI': 6, 'V': 5, 'IV': 4, 'III': 3, 'II': 2, 'I': 1
-    }
-    def replace_roman_century(m):
-        roman = m.group(1)
-        return f"thế kỷ {ROMAN_CENTURY.get(roman, roman)}"
-    text = re.sub(
-        r'(?:thế kỷ\s+)?(X{0,3}(?:IX|IV|V?I{0,3}))\b',
-        lambda m: replace_roman_century(m) if m.group(1) in ROMAN_CENTURY else m.group(0),
-        text
-    )
-    text = re.sub(r'\$\s*(\d[\d\.]*)', r'\1 đô la', text)
-    text = re.sub(r'€\s*(\d[\d\.]*)', r'\1 euro', text)
-    text = re.sub(r'(\d[\d\.]*)\s*€', r'\1 euro', text)
-    text = re.sub(r'(\d[\d\.]*)\s*\$', r'\1 đô la', text)
-    text = re.sub(r'(\d+)\s*%', r'\1 phần trăm', text)
-    for _ in range(3):
-        text = re.sub(r'(?<=\d)\.(?=\d{3}(?:\D|$))', '', text)
-    text = re.sub(r'(?<=\d)\s*km\b',    ' ki-lô-mét', text)
-    text = re.sub(r'(?<=\d)\s*m²\b',    ' mét vuông', text)
-    text = re.sub(r'(?<=\d)\s*m\b',     ' mét', text)
-    text = re.sub(r'(?<=\d)\s*kg\b',    ' ki-lô-gam', text)
-    text = re.sub(r'(?<=\d)\s*ha\b',    ' héc-ta', text)
-    text = re.sub(r'(?<=\d)\s*cm\b',    ' xen-ti-mét', text)
-    text = re.sub(r'(?m)^\s*\d+(?:\.\d+)*\.?\s+', '', text)
-    text = re.sub(r'\s*[\u2013\u2014]\s*', ', ', text)
-    text = re.sub(r'(?m)^\s*[-•·]\s+', '', text)
-    text = re.sub(r' - ', ', ', text)
-    for q in ['"', '\u201c', '\u201d', '\u201e', '\u201b', '\u201a',
-              '«', '»', '‹', '›', "'", '\u2018', '\u2019', '`']:
-        text = text.replace(q, '')
-    text = re.sub(r'[*#_~`<>{}|\\\\]', '', text)
-    text = re.sub(r'[ \t]+', ' ', text)
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    text = re.sub(r'\b[A-Z]{2,}\b', lambda m: m.group(0).capitalize(), text)
-    text = text.replace('<', '').replace('>', '').replace('&', ' và ')
-    return text.strip()
-def fix_plain_text_for_tts(title, plain_text):
-    """Dùng cho tab Tạo Audio Tay — input là plain text, không có HTML"""
-    if not title and not plain_text: return ""
-    text = f"{title}...\n\n{plain_text.strip()}"
-    text = re.sub(r'(\d{1,2}:\d{2})\s*[–—-]\s*(\d{1,2}:\d{2})', r'\1 đến \2', text)
-    text = re.sub(r'\$\s*(\d[\d\.]*)', r'\1 đô la', text)
-    text = re.sub(r'(\d+)\s*%', r'\1 phần trăm', text)
-    for _ in range(3):
-        text = re.sub(r'(?<=\d)\.(?=\d{3}(?:\D|$))', '', text)
-    text = re.sub(r'(?<=\d)\s*km\b', ' ki-lô-mét', text)
-    text = re.sub(r'(?<=\d)\s*m²\b', ' mét vuông', text)
-    text = re.sub(r'(?<=\d)\s*m\b',  ' mét', text)
-    text = re.sub(r'(?<=\d)\s*kg\b', ' ki-lô-gam', text)
-    text = re.sub(r'(?<=\d)\s*ha\b', ' héc-ta', text)
-    text = re.sub(r'(?<=\d)\s*cm\b', ' xen-ti-mét', text)
-    text = re.sub(r'\s*[\u2013\u2014]\s*', ', ', text)
-    text = re.sub(r'(?m)^\s*[-•·]\s+', '', text)
-    text = re.sub(r' - ', ', ', text)
-    for q in ['"', '\u201c', '\u201d', "'", '\u2018', '\u2019', '`', '«', '»']:
-        text = text.replace(q, '')
-    text = re.sub(r'[*#_~`<>{}|\\\\]', '', text)
-    text = re.sub(r'[ \t]+', ' ', text)
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    text = text.replace('<', '').replace('>', '').replace('&', ' và ')
-    return text.strip()
-def upload_audio_to_storage(file_path, tok):
-    url = 'https://api.tatinta.com/v1/extra/upload/audio'
-    tok_clean = tok.strip().strip('"').strip("'")
-    tok_clean = tok_clean.encode('ascii', 'ignore').decode('ascii')
-    headers = {
-        'Origin': 'https://cms.tatinta.com',
-        'Referer': 'https://cms.tatinta.com/',
-        'Accept': 'application/json, text/plain, */*',
-        'Authorization': f'Bearer {tok_clean}',
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-    }
-    with open(file_path, 'rb') as f:
-        resp = requests.post(url, headers=headers, files={'faudio': (os.path.basename(file_path), f, 'audio/mpeg')})
-    if resp.status_code in [200, 201]:
-        return resp.json().get('data', {}).get('filename')
-    raise Exception(f"Upload API lỗi HTTP {resp.status_code}: {resp.text[:200]}")
-def save_file_to_permanent(tmp_filename, tok):
-    url = 'https://api.tatinta.com/v1/extra/upload/save-file'
-    tok_clean = tok.strip().strip('"').strip("'")
-    tok_clean = tok_clean.encode('ascii', 'ignore').decode('ascii')
-    headers = {
-        'Origin': 'https://cms.tatinta.com',
-        'Referer': 'https://cms.tatinta.com/',
-        'Accept': 'application/json, text/plain, */*',
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {tok_clean}',
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-    }
-    payload = {"filename": tmp_filename, "type": "audio"}
-    resp = requests.post(url, headers=headers, json=payload)
-    if resp.status_code in [200, 201]:
-        return resp.json().get('data', {}).get('url')
-    return tmp_filename
-def mix_audio(tts_file, bgm_file, output_file, db_reduce):
-    if bgm_file and os.path.exists(bgm_file):
-        try:
-            cmd = [
-                "ffmpeg", "-y",
-                "-i", tts_file,
-                "-stream_loop", "-1", "-i", bgm_file,
-                "-filter_complex", f"[1:a]volume={-abs(db_reduce)}dB[bgm];[0:a][bgm]amix=inputs=2:duration=first:dropout_transition=2",
-                "-c:a", "libmp3lame", "-b:a", "128k",
-                output_file
-            ]
-            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            return
-        except Exception:
-            pass
-    shutil.copy2(tts_file, output_file)
 # ================= SESSION STATE =================
-if "app_state" not in st.session_state:
-    st.session_state.app_state = {"waiting": [], "ok": [], "fail": []}
+if "batch_progress" not in st.session_state:
+    st.session_state.batch_progress = BatchProgress()
 if "_fail_btn_counter" not in st.session_state:
     st.session_state._fail_btn_counter = 0
 if "popup_visible" not in st.session_state:
@@ -282,25 +130,76 @@ with st.sidebar:
     sidebar_ok_count = st.empty()
     sidebar_fail_count = st.empty()
     sidebar_status.info("🗣️ Chưa chạy - Nhấn nút bên phải!")
+    sidebar_tts_cache = st.empty()
+    def render_tts_cache_stats():
+        _c = get_tts_cache().stats()
+        sidebar_tts_cache.caption(f"🗃️ Cache TTS: {_c['hits']} hit / {_c['misses']} miss · {_c['entries']} file · {_c['bytes']//(1024*1024)}MB")
+    render_tts_cache_stats()
+    sidebar_metrics = st.empty()
+    STEP_LABEL = {"cms_get": "CMS GET", "normalize": "Chuẩn hóa", "tts": "EdgeTTS", "ffmpeg": "ffmpeg",
+                  "dedup": "Tra trùng", "cms_upload": "Upload", "cms_save": "Save-file", "cms_patch": "PATCH"}
+    def render_run_metrics(summary):
+        if not summary or not summary["steps"]:
+            sidebar_metrics.empty()
+            return
+        rows = [f"⏱️ **{summary['per_min']:.1f} bài/phút** · {summary['elapsed']:.0f}s · run `{summary['run']}`",
+                "", "| Bước | n | p50 | p95 | MB |", "|---|---:|---:|---:|---:|"]
+        for step, v in summary["steps"].items():
+            fail = f" ❌{v['fail']}" if v["fail"] else ""
+            rows.append(f"| {STEP_LABEL.get(step, step)}{fail} | {v['n']} | {v['p50']:.2f}s | {v['p95']:.2f}s | {v['bytes'] / 1e6:.1f} |")
+        sidebar_metrics.markdown("\n".join(rows))
+    render_run_metrics(st.session_state.get("last_run_metrics"))
+    sidebar_limits = st.empty()
+    def render_limits():
+        _rows = ["🚦 **Giới hạn song song (tự điều chỉnh)**", "", "| Dịch vụ | đang chạy / giới hạn | bị chặn |", "|---|---:|---:|"]
+        for _name, _v in limiter_stats().items():
+            _rows.append(f"| {DEPENDENCY_LABEL[_name]} | {_v['in_flight']} / {_v['limit']} (≤{_v['max']}) | {_v['throttled']} |")
+        sidebar_limits.markdown("\n".join(_rows))
+    render_limits()
     st.markdown("---")
     st.markdown("## 📋 Lịch Sử Đã Xử Lý")
-    _h = load_history()
-    if _h:
-        st.markdown(f"✅ **{len(_h)} URL** đã có audio")
-        preview = list(_h.keys())[:5]
-        for did in preview:
-            title_h = _h[did].get('title','?')[:20]
-            st.caption(f"• {title_h}... `{did[-8:]}`")
-        if len(_h) > 5:
-            st.caption(f"_...và {len(_h)-5} URL khác_")
-        with st.expander("📋 Xem tất cả & copy"):
-            url_lines = "\n".join(
-                f"https://cms.tatinta.com/destination/action/{did}"
-                for did in _h.keys()
-            )
-            st.code(url_lines, language=None)
-    else:
-        st.info("Chưa có lịch sử nào!")
+    HISTORY_PAGE_SIZE = 20
+    @st.fragment
+    def history_browser():
+        # Fragment: gõ tìm / lọc / lật trang chỉ chạy lại phần này; chỉ render 1 trang, danh sách URL chỉ dựng khi bấm xuất
+        _store = get_store()
+        _stats = _store.stats()
+        if not _stats["total"]:
+            st.info("Chưa có lịch sử nào!")
+            return
+        st.markdown(f"✅ **{_stats['total']} URL** đã có audio · 🇻🇳 {_stats['has_vi']} · 🇺🇸 {_stats['has_en']}")
+        _q = st.text_input("🔎 Tìm theo tên / dest_id", key="hist_q", placeholder="vd: da lat, 65f1a2...")
+        _c1, _c2 = st.columns(2)
+        _miss_vi = _c1.checkbox("Thiếu VI", key="hist_miss_vi")
+        _miss_en = _c2.checkbox("Thiếu EN", key="hist_miss_en")
+        _dates = st.date_input("📅 Ngày chạy (từ – đến)", value=[], key="hist_dates")
+        _from = _dates[0].isoformat() if len(_dates) > 0 else None
+        _to = _dates[-1].isoformat() if len(_dates) > 0 else None
+        _filters = (_q, _miss_vi, _miss_en, _from, _to)
+        if st.session_state.get("hist_filters") != _filters:
+            st.session_state.hist_filters = _filters
+            st.session_state.hist_page = 1
+        _index = _store.search_index()
+        _offset = (st.session_state.get("hist_page", 1) - 1) * HISTORY_PAGE_SIZE
+        _total, _rows = _index.search(_q, _miss_vi, _miss_en, _from, _to, offset=_offset, limit=HISTORY_PAGE_SIZE)
+        _pages = max(1, -(-_total // HISTORY_PAGE_SIZE))
+        if st.session_state.get("hist_page", 1) > _pages:
+            st.session_state.hist_page = _pages
+            _total, _rows = _index.search(_q, _miss_vi, _miss_en, _from, _to, offset=(_pages - 1) * HISTORY_PAGE_SIZE, limit=HISTORY_PAGE_SIZE)
+        st.caption(f"{_total} bài khớp")
+        for did, title_h, ran_at, has_vi, has_en in _rows:
+            st.caption(f"• {(title_h or '?')[:30]} `{did[-8:]}` {'🇻🇳' if has_vi else '—'}{'🇺🇸' if has_en else '—'} · {ran_at[:10]}")
+        if _pages > 1:
+            st.number_input(f"Trang (/{_pages})", min_value=1, max_value=_pages, step=1, key="hist_page")
+        if _total:
+            if st.button(f"📦 Xuất {_total} URL", key="hist_export_btn", use_container_width=True):
+                st.session_state.hist_export = (_filters, "\n".join(
+                    f"https://cms.tatinta.com/destination/action/{did}" for did in _index.ids(_q, _miss_vi, _miss_en, _from, _to)))
+            _export = st.session_state.get("hist_export")
+            if _export and _export[0] == _filters:
+                st.download_button("⬇️ Tải danh sách URL (.txt)", data=_export[1], file_name="tatinta_urls.txt",
+                                   mime="text/plain", key="hist_export_dl", use_container_width=True)
+    history_browser()
 # ================= HÀM CLIPBOARD =================
 def clipboard_copy_button(text: str, label: str, btn_id: str):
     safe_text = html_lib.escape(text)
@@ -330,6 +229,25 @@ def clipboard_copy_button(text: str, label: str, btn_id: str):
         }}
     " style="background:#ff4b4b;color:white;border:none;border-radius:8px;padding:9px 16px;cursor:pointer;font-size:14px;font-weight:600;width:100%;transition:background 0.3s;font-family:sans-serif;">{label_escaped}</button>
     """, height=48)
+@st.fragment(run_every=2)
+def worker_progress(batch_id):
+    """Tiến độ gộp của batch chạy bằng nhiều process trên máy này — đọc thẳng từ hàng đợi chung."""
+    _q = get_job_queue()
+    _c = _q.counts(batch_id)
+    _tot = sum(_c.values())
+    _done = _c["patched"] + _c["failed"]
+    _alive = running_workers(batch_id)
+    st.progress(_done / _tot if _tot else 1.0,
+                text=f"🖥️ `{batch_id}`: {_done}/{_tot} · ✅ {_c['patched']} · ❌ {_c['failed']} · "
+                     f"{_alive} process đang chạy" if _alive else f"🖥️ `{batch_id}`: xong {_done}/{_tot} · ✅ {_c['patched']} · ❌ {_c['failed']}")
+    if not _alive and st.session_state.get("worker_flushed") != batch_id:
+        # Worker chạy với --no-flush: đẩy lịch sử 1 lần cho cả batch, không để N process cùng commit lên GitHub
+        st.session_state.worker_flushed = batch_id
+        flush_history(f"Update history: {_c['patched']} URL", force=True)
+    _w = _q.worker_counts(batch_id)
+    if _w:
+        st.dataframe([{"Worker": w, "✅": v["patched"], "❌": v["failed"], "⏳ Đang chạy": v["active"]} for w, v in _w.items()],
+                     hide_index=True, use_container_width=True)
 # ==========================================
 # TAB 1: TỰ ĐỘNG BATCH
 # ==========================================
@@ -338,10 +256,27 @@ with tab_auto:
     if "urls_input" not in st.session_state:
         st.session_state.urls_input = ""
     col_url_btn1, col_url_btn2 = st.columns([4, 1])
+    with col_url_btn1:
+        if st.button("🔭 Tìm bài thiếu audio trên CMS", help="Lật toàn bộ danh sách điểm đến của CMS, so với lịch sử rồi điền URL các bài còn thiếu audio VI/EN đang chọn vào ô bên dưới"):
+            if not token:
+                st.error("🚨 Chưa nhập Bearer Token ở trên!")
+            else:
+                _disc_status = st.empty()
+                _disc_langs = [l for l, on in (("vi", run_vi), ("en", run_en)) if on] or ["vi", "en"]
+                try:
+                    _pending = asyncio.run(discover(token, _disc_langs, on_progress=lambda d, n: _disc_status.caption(
+                        f"📄 Đã đọc {d}{f'/{n}' if n else ''} trang...")))
+                    st.session_state.urls_input = "\n".join(cms_url(d) for d, _, _ in _pending)
+                    st.session_state.discover_note = f"🔭 Tìm thấy {len(_pending)} bài còn thiếu audio ({', '.join(l.upper() for l in _disc_langs)})."
+                    st.rerun()
+                except Exception as e:
+                    _disc_status.error(f"❌ Không lấy được danh sách điểm đến: {e}")
+    if st.session_state.get("discover_note"):
+        st.info(st.session_state.pop("discover_note"))
     with col_url_btn2:
         if st.button("🧹 Xóa URL đã xong", use_container_width=True, help="Xóa khỏi ô nhập những URL đã chạy thành công"):
-            _hist_now = load_history()
             raw_lines = st.session_state.urls_input.strip().split("\n")
+            _hist_now = get_store().get_many(re.findall(r'([a-f0-9]{24})', st.session_state.urls_input))
             filtered = []
             for line in raw_lines:
                 line = line.strip()
@@ -355,8 +290,30 @@ with tab_auto:
     urls_text = st.text_area("Mỗi dòng 1 URL:", height=200,
         placeholder="https://cms.tatinta.com/destination/action/698afc6c1b29cd1e8cc1b826",
         key="urls_input")
+    with st.expander("⚡ Cấu hình chạy song song (worker mỗi tầng)"):
+        st.caption("Nhiều bài chạy cùng lúc: fetch → chuẩn hóa → TTS → mix → upload → PATCH. Queue giữa các tầng có giới hạn để không tràn RAM / ổ đĩa tạm. "
+                   "Số worker là trần — số request thật sự gửi tới EdgeTTS / CMS do limiter tự điều chỉnh (xem sidebar).")
+        _wcols = st.columns(len(STAGES) + 1)
+        stage_workers = {}
+        for _col, _name in zip(_wcols, STAGES):
+            stage_workers[_name] = _col.number_input(_name, min_value=1, max_value=32, value=DEFAULT_WORKERS[_name], key=f"workers_{_name}")
+        queue_size = _wcols[-1].number_input("queue", min_value=1, max_value=64, value=4, key="pipeline_queue_size")
+        streaming = st.checkbox("🌊 Streaming: đẩy TTS thẳng vào ffmpeg, không ghi file tạm", value=True, key="pipeline_streaming",
+                                help="Bật: tầng TTS mix luôn trong lúc EdgeTTS đang trả audio, file MP3 giữ trong RAM tới lúc upload (tầng mix để trống).")
+        _ccols = st.columns(3)
+        chunk_on = _ccols[0].checkbox("✂️ Chia theo đoạn: TTS song song + cache từng đoạn", value=False, key="tts_chunk_on",
+                                    help="Chạy lại bài đã sửa vài câu chỉ tạo lại giọng cho đoạn đã đổi, các đoạn khác lấy từ cache.")
+        chunk_chars = _ccols[1].number_input("Số ký tự tối đa / chunk", min_value=300, max_value=5000, value=CHUNK_CHARS, step=100, key="tts_chunk_chars")
+        chunk_concurrency = _ccols[2].number_input("Số chunk chạy cùng lúc / bài", min_value=1, max_value=16, value=CHUNK_CONCURRENCY, key="tts_chunk_concurrency")
+        if not chunk_on:
+            chunk_chars = 0
+        worker_procs = st.number_input("🖥️ Số process worker", min_value=1, max_value=2 * (os.cpu_count() or 2), value=1, key="worker_procs",
+                                       help="> 1: chia batch theo hash dest_id cho nhiều process chạy nền (mỗi process 1 event loop + ffmpeg riêng), "
+                                            "tiến độ gộp lại bên dưới.")
     # Bảng theo dõi
     st.markdown("---")
+    show_full_lists = st.checkbox("📋 Hiện đủ danh sách URL để copy", key="progress_full_lists",
+                                  help="Trong lúc chạy bảng chỉ hiện số đếm + vài dòng mới nhất; danh sách đầy đủ dựng khi chạy xong.")
     c1, c2, c3 = st.columns(3)
     with c1:
         title_run = st.empty(); area_run = st.empty(); copy_run = st.empty()
@@ -368,15 +325,11 @@ with tab_auto:
     progress_text = st.empty()
     progress_bar = st.progress(0)
     status_text = st.empty()
-    def render_fail_copy():
-        lfail = st.session_state.app_state.get("fail", [])
-        fail_urls = []
-        for item in lfail:
-            raw = item.get("URL", "")
-            if raw.startswith("http"):
-                fail_urls.append(raw)
-            elif re.match(r'^[a-f0-9]{24}$', raw):
-                fail_urls.append(f"https://cms.tatinta.com/destination/action/{raw}")
+    def full_url(raw):
+        if raw.startswith("http"): return raw
+        return cms_url(raw) if re.match(r'^[a-f0-9]{24}$', raw) else None
+    def render_fail_copy(prog):
+        fail_urls = [u for u in (full_url(item.get("URL", "")) for item in prog.fail) if u]
         st.session_state._fail_btn_counter += 1
         _btn_key = f"fail_rerun_btn_{st.session_state._fail_btn_counter}"
         with fail_copy_area.container():
@@ -388,187 +341,135 @@ with tab_auto:
                     st.rerun()
             else:
                 st.info("✅ Chưa có link thất bại nào!")
-    def refresh_tables():
-        lw = st.session_state.app_state["waiting"]
-        lok = st.session_state.app_state["ok"]
-        lfail = st.session_state.app_state["fail"]
-        title_run.markdown(f"🏃 **ĐANG CHẠY ({len(lw)})**")
-        title_ok.markdown(f"✅ **THÀNH CÔNG ({len(lok)})**")
-        title_fail.markdown(f"❌ **THẤT BẠI ({len(lfail)})**")
+    def render_full_lists(prog):
+        """Ô copy URL của cả 3 danh sách — O(n), chỉ dựng lúc chờ / khi xong và khi đã bật xem đủ danh sách."""
+        ctr = st.session_state._fail_btn_counter
+        lists = (("running", copy_run, "🏃 URLs đang chạy", "đang chạy", "URL"), ("ok", copy_ok, "✅ URLs thành công", "thành công", "URL CMS"),
+                 ("fail", copy_fail, "❌ URLs thất bại", "thất bại", "URL"))
+        for kind, area, label, short, field in lists:
+            urls = [u for u in (full_url(item.get(field, "")) for item in prog.rows(kind)) if u] if show_full_lists else []
+            with area.container():
+                if urls:
+                    st.text_area(f"{label}:", value="\n".join(urls), height=80, key=f"ta_{kind}_{ctr}", disabled=False)
+                    clipboard_copy_button("\n".join(urls), label=f"📋 Copy {len(urls)} URL {short}", btn_id=f"btn_{kind}_{ctr}")
+        render_fail_copy(prog)
+    def refresh_tables(force=False):
+        """Gọi thoải mái sau mỗi sự kiện: chỉ thực sự vẽ theo nhịp của BatchProgress, và chỉ gửi số đếm + vài dòng mới nhất.
+        Trả về True nếu đã vẽ."""
+        prog = st.session_state.batch_progress
+        if not prog.due(force): return False
+        title_run.markdown(f"🏃 **ĐANG CHẠY ({prog.pending})**")
+        title_ok.markdown(f"✅ **THÀNH CÔNG ({len(prog.ok)})**")
+        title_fail.markdown(f"❌ **THẤT BẠI ({len(prog.fail)})**")
         col_cfg = {
             "URL": st.column_config.LinkColumn("Đường Dẫn URL Gốc"),
             "URL CMS": st.column_config.LinkColumn("Link Đi Đích CMS")
         }
-        area_run.dataframe(lw, use_container_width=True, hide_index=True, column_config=col_cfg)
-        area_ok.dataframe(lok if lok else [{"Trống": "Chưa có"}], use_container_width=True, hide_index=True, column_config=col_cfg)
-        area_fail.dataframe(lfail if lfail else [{"Trống": "Chưa có lỗi"}], use_container_width=True, hide_index=True, column_config=col_cfg)
-        ctr = st.session_state._fail_btn_counter
-        run_urls = []
-        for item in lw:
-            raw = item.get("URL", "")
-            if raw.startswith("http"): run_urls.append(raw)
-            elif re.match(r'^[a-f0-9]{24}$', raw): run_urls.append(f"https://cms.tatinta.com/destination/action/{raw}")
-        with copy_run.container():
-            if run_urls:
-                st.text_area("🏃 URLs đang chạy:", value="\n".join(run_urls), height=80, key=f"ta_run_{ctr}", disabled=False)
-                clipboard_copy_button("\n".join(run_urls), label=f"📋 Copy {len(run_urls)} URL đang chạy", btn_id=f"btn_run_{ctr}")
-        ok_urls = [item.get("URL CMS","") for item in lok if item.get("URL CMS","").startswith("http")]
-        with copy_ok.container():
-            if ok_urls:
-                st.text_area("✅ URLs thành công:", value="\n".join(ok_urls), height=80, key=f"ta_ok_{ctr}", disabled=False)
-                clipboard_copy_button("\n".join(ok_urls), label=f"📋 Copy {len(ok_urls)} URL thành công", btn_id=f"btn_ok_{ctr}")
-        fail_urls_copy = []
-        for item in lfail:
-            raw = item.get("URL","")
-            if raw.startswith("http"): fail_urls_copy.append(raw)
-            elif re.match(r'^[a-f0-9]{24}$', raw): fail_urls_copy.append(f"https://cms.tatinta.com/destination/action/{raw}")
-        with copy_fail.container():
-            if fail_urls_copy:
-                st.text_area("❌ URLs thất bại:", value="\n".join(fail_urls_copy), height=80, key=f"ta_fail_{ctr}", disabled=False)
-                clipboard_copy_button("\n".join(fail_urls_copy), label=f"📋 Copy {len(fail_urls_copy)} URL thất bại", btn_id=f"btn_fail_{ctr}")
-        render_fail_copy()
-    refresh_tables()
-    async def process_urls(urls_list):
-        valid_urls = [u.strip() for u in urls_list if u.strip()]
+        area_run.dataframe(prog.running_rows(), use_container_width=True, hide_index=True, column_config=col_cfg)
+        area_ok.dataframe(prog.recent("ok") or [{"Trống": "Chưa có"}], use_container_width=True, hide_index=True, column_config=col_cfg)
+        area_fail.dataframe(prog.recent("fail") or [{"Trống": "Chưa có lỗi"}], use_container_width=True, hide_index=True, column_config=col_cfg)
+        if force: render_full_lists(prog)
+        return True
+    refresh_tables(force=True)
+    async def process_urls(urls_list, stage_workers=None, queue_size=4, streaming=True, chunk_chars=0, chunk_concurrency=CHUNK_CONCURRENCY,
+                           batch_id=None, refresh=False, refresh_unknown=False):
+        """batch_id: chạy tiếp batch dở trong hàng đợi — dùng lại giọng / nhạc nền đã lưu của batch đó, chỉ token lấy mới.
+        refresh: chỉ tạo lại ngôn ngữ có nội dung / giọng khác lần trước (so fingerprint trong lịch sử)."""
+        job_queue = get_job_queue()
+        langs = []
+        if run_vi: langs.append(("vi", voice_vi, rate_vi, pitch_vi))
+        if run_en: langs.append(("en", voice_en, rate_en, pitch_en))
+        bgm_run, bgm_db_run = (bgm_path if use_bgm else None), bgm_volume_db
+        profiles_run = {"vi": profile_vi, "en": profile_en}
+        if batch_id:
+            stored = job_queue.config(batch_id)
+            langs = [tuple(l) for l in stored.get("langs", [])] or langs
+            bgm_run, bgm_db_run = stored.get("bgm_path", bgm_run), stored.get("bgm_volume_db", bgm_db_run)
+            refresh, refresh_unknown = stored.get("refresh", refresh), stored.get("refresh_unknown", refresh_unknown)
+            profiles_run = stored.get("profiles") or profiles_run
+            valid_urls = job_queue.remaining_urls(batch_id)
+        else:
+            valid_urls = [u.strip() for u in urls_list if u.strip()]
         if not valid_urls:
             st.warning("Danh sách link rỗng!")
             return
         sidebar_status.info("♥️ Đang khởi động...")
         sidebar_pct.markdown(""); sidebar_detail.markdown(""); sidebar_ok_count.markdown(""); sidebar_fail_count.markdown("")
         sidebar_bar.progress(0)
-        st.session_state.app_state["waiting"] = [{"URL": u, "Trạng thái": "⏳ Đang chờ"} for u in valid_urls]
-        st.session_state.app_state["ok"] = []
-        st.session_state.app_state["fail"] = []
-        refresh_tables()
-        os.makedirs("tmp_audios", exist_ok=True)
-        clean_token = token.strip().strip('"').strip("'")
-        clean_token = clean_token.encode('ascii', 'ignore').decode('ascii')
-        headers = {
-            'Origin': 'https://cms.tatinta.com', 'Referer': 'https://cms.tatinta.com/',
-            'Accept': 'application/json, text/plain, */*',
-            'Authorization': f'Bearer {clean_token}',
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-        }
-        for idx, url in enumerate(valid_urls):
-            lw = st.session_state.app_state["waiting"]
-            lok = st.session_state.app_state["ok"]
-            lfail = st.session_state.app_state["fail"]
-            if len(lw) > 0:
-                lw[0]["Trạng thái"] = "▶️ Đang xử lý..."
-                refresh_tables()
-            match = re.search(r'([a-f0-9]{24})', url)
-            if not match:
-                if lw: lw.pop(0)
-                lfail.append({"URL": url, "Lỗi": "Sai format URL CMS"})
-                refresh_tables(); continue
-            dest_id = match.group(1)
-            api_url = f'https://api.tatinta.com/v1/destination/destination/{dest_id}'
-            status_text.text(f"⏳ Đang xử lý: {dest_id} (Fetch Data)...")
-            try:
-                get_resp = requests.get(api_url, headers=headers)
-            except Exception as e:
-                if lw: lw.pop(0)
-                lfail.append({"URL": dest_id, "Lỗi": f"Lệnh Fetch đứt: {e}"})
-                refresh_tables(); continue
-            if get_resp.status_code in [401, 403]:
-                if lw: lw.pop(0)
-                lfail.append({"URL": dest_id, "Lỗi": "BỊ CHẶN: TOKEN ĐẾT HẠN!"})
-                refresh_tables()
-                st.error("🚨 TOKEN ĐÃ HẾT HẠN - SYSTEM PAUSED 🚨")
-                break
-            data = get_resp.json().get('data', {})
-            t_vi = data.get('name', '')
-            c_vi = data.get('content', '')
-            translations_dict = data.get('translations', {})
-            t_en = translations_dict.get('en', {}).get('name', t_vi)
-            c_en = translations_dict.get('en', {}).get('content', '')
-            filename_vi = None; filename_en = None
-            async def process_lang_task(lang_code, title, content, voice, rate, pitch):
-                text_tts = fix_text_for_tts(title, content)
-                if not text_tts:
-                    text_tts = f"{title}...\n\nInformation about this destination will be updated soon." if lang_code == "en" else f"{title}... Chưa có nội dung."
-                raw_f = f"tmp_audios/{dest_id}_raw_{lang_code}.mp3"
-                mix_f = f"tmp_audios/{dest_id}_mix_{lang_code}.mp3"
-                status_text.text(f"Đang sinh EdgeTTS {lang_code.upper()} cho: {title}...")
-                await edge_tts.Communicate(text_tts, voice, rate=f"{rate:+d}%", pitch=f"{pitch:+d}Hz").save(raw_f)
-                raw_size = os.path.getsize(raw_f) if os.path.exists(raw_f) else 0
-                if raw_size == 0:
-                    raise Exception(f"EdgeTTS tạo file rỗng (0 bytes) cho {lang_code.upper()}!")
-                status_text.text(f"TTS {lang_code.upper()} OK ({raw_size//1024}KB). Đang mix nhạc...")
-                await asyncio.to_thread(mix_audio, raw_f, bgm_path if use_bgm else None, mix_f, bgm_volume_db)
-                mix_size = os.path.getsize(mix_f) if os.path.exists(mix_f) else 0
-                if mix_size == 0:
-                    raise Exception(f"Mix audio thất bại - file rỗng (0 bytes) cho {lang_code.upper()}!")
-                status_text.text(f"Mix {lang_code.upper()} OK ({mix_size//1024}KB). Đang upload...")
-                fname = await asyncio.to_thread(upload_audio_to_storage, mix_f, clean_token)
-                if not fname:
-                    raise Exception(f"Upload thất bại - server không trả về filename cho {lang_code.upper()}!")
-                status_text.text(f"Lưu vĩnh viễn {lang_code.upper()}...")
-                permanent_url = await asyncio.to_thread(save_file_to_permanent, fname, clean_token)
-                status_text.text(f"{lang_code.upper()} OK → {permanent_url}")
-                if os.path.exists(raw_f): os.remove(raw_f)
-                if os.path.exists(mix_f): os.remove(mix_f)
-                return permanent_url
-            try:
-                tasks = []
-                if run_vi: tasks.append(process_lang_task("vi", t_vi, c_vi, voice_vi, rate_vi, pitch_vi))
-                if run_en: tasks.append(process_lang_task("en", t_en, c_en, voice_en, rate_en, pitch_en))
-                results = await asyncio.gather(*tasks)
-                if run_vi and run_en: filename_vi, filename_en = results
-                elif run_vi: filename_vi = results[0]
-                elif run_en: filename_en = results[0]
-            except Exception as e:
-                if lw: lw.pop(0)
-                lfail.append({"URL": dest_id, "Lỗi": f"Lỗi tạo TTS: {e}"})
-                refresh_tables(); continue
-            status_text.text("Cắm Link Audio vào Bài viết CMS (PUT)...")
-            payload = {"translations": translations_dict}
-            if filename_vi: payload["audio"] = filename_vi
-            if filename_en:
-                if 'en' not in payload["translations"]: payload["translations"]["en"] = {}
-                payload["translations"]["en"]["audio"] = filename_en
-            if filename_vi or filename_en:
-                patch_resp = requests.patch(api_url, headers=headers, json=payload)
-                if lw: lw.pop(0)
-                if patch_resp.status_code == 200:
-                    lok.append({"Tên Bài": t_vi, "URL CMS": url})
-                    save_to_history(dest_id, t_vi, audio_vi=filename_vi, audio_en=filename_en)
-                else:
-                    lfail.append({"URL": dest_id, "Lỗi": f"PATCH THẤT BẠI: {patch_resp.text}"})
-            else:
-                if lw: lw.pop(0)
-                lfail.append({"URL": dest_id, "Lỗi": "Không thể up Audio"})
-            refresh_tables()
-            curr_percent = int(((idx + 1) / len(valid_urls)) * 100)
-            lok2 = st.session_state.app_state["ok"]
-            lfail2 = st.session_state.app_state["fail"]
-            lw2 = st.session_state.app_state["waiting"]
-            sidebar_bar.progress((idx + 1) / len(valid_urls))
+        prog = st.session_state.batch_progress = BatchProgress(valid_urls)
+        refresh_tables(force=True)
+        cfg = BatchConfig(token, langs, bgm_path=bgm_run, bgm_volume_db=bgm_db_run,
+                          stage_workers=stage_workers, queue_size=queue_size, streaming=streaming,
+                          chunk_chars=chunk_chars, chunk_concurrency=chunk_concurrency, refresh=refresh, refresh_unknown=refresh_unknown,
+                          profiles=profiles_run)
+        if worker_procs > 1:
+            batch_id = batch_id or job_queue.create_batch(valid_urls, cfg.batch_config())
+            # Cùng tham số như CLI --procs (có --no-flush): lịch sử chỉ đẩy 1 lần ở đây khi mọi worker xong (worker_progress)
+            _args = child_args(argparse.Namespace(workers=[f"{k}={v}" for k, v in stage_workers.items()], queue_size=queue_size,
+                                                  no_streaming=not streaming, chunk_chars=chunk_chars,
+                                                  chunk_concurrency=chunk_concurrency, mix_batch=None))
+            spawn_workers(batch_id, worker_procs, token, _args, log_dir=os.path.join("logs", "workers"))
+            st.session_state.worker_batch = batch_id
+            sidebar_status.info(f"🖥️ Batch `{batch_id}` đang chạy trên {worker_procs} process — xem tiến độ ở tab Batch")
+            return
+        metrics = RunMetrics("batch", METRICS_LOG, meta={"langs": langs, "workers": cfg.workers, "queue_size": queue_size,
+                                                           "streaming": streaming, "chunk_chars": chunk_chars, "total": prog.total})
+        # URL trùng chỉ chạy 1 lần (hàng đợi + BatchProgress đều bỏ trùng): mẫu số là prog.total, không phải len(valid_urls)
+        total = prog.total or 1
+        def render_progress(force=False):
+            if not refresh_tables(force): return
+            curr_percent = int((prog.done / total) * 100)
+            sidebar_bar.progress(prog.done / total)
             sidebar_pct.markdown(f"<h1 style='color:#ff4b4b;margin:0;font-size:64px;'>{curr_percent}<span style='font-size:28px;'>%</span></h1>", unsafe_allow_html=True)
-            sidebar_detail.markdown(f"📌 **Bài {idx+1}** / {len(valid_urls)} đang xử lý")
-            sidebar_ok_count.markdown(f"✅ **{len(lok2)}** thành công | ❌ **{len(lfail2)}** lỗi | ⏳ {len(lw2)} chờ")
-            sidebar_status.info(f"⏳ Đang xử lý bài {idx+1}...")
-            progress_bar.progress((idx + 1) / len(valid_urls))
-            await asyncio.sleep(0.2)
+            sidebar_detail.markdown(f"📌 **Xong {prog.done}** / {total} bài")
+            sidebar_ok_count.markdown(f"✅ **{len(prog.ok)}** thành công | ❌ **{len(prog.fail)}** lỗi | ⏳ {prog.pending} chờ")
+            sidebar_status.info(f"⏳ Đang xử lý {prog.pending} bài còn lại...")
+            progress_bar.progress(prog.done / total)
+            if prog.last_event: status_text.text(prog.last_event)
+            render_run_metrics(metrics.summary())
+            render_limits()
+        def on_stage(job, stage_name):
+            prog.stage(job["url"], f"▶️ {STAGE_LABEL[stage_name]}...",
+                       f"⏳ Đang xử lý: {job.get('dest_id', job['url'])} ({STAGE_LABEL[stage_name]})...")
+            render_progress()
+        def on_fail(job, stage_name, msg):
+            prog.failed(job["url"], {"URL": job.get("dest_id", job["url"]), "Lỗi": msg})
+            render_progress()
+            if msg == TOKEN_EXPIRED:
+                st.error("🚨 TOKEN ĐÃ HẾT HẠN - SYSTEM PAUSED 🚨")
+        def on_ok(job):
+            prog.succeed(job["url"], {"Tên Bài": job["t_vi"] + (" (không đổi)" if job.get("unchanged") else ""), "URL CMS": job["url"]})
+            render_progress()
+        pipeline = await run_batch(valid_urls, cfg, on_stage=on_stage, on_ok=on_ok, on_fail=on_fail, flush=False, metrics=metrics,
+                                   queue=job_queue, batch_id=batch_id)
+        render_progress(force=True)
+        st.session_state.last_run_metrics = metrics.summary()
+        render_run_metrics(st.session_state.last_run_metrics)
+        if prog.ok:
+            status_text.text("💾 Đang đồng bộ lịch sử lên GitHub...")
+            await asyncio.to_thread(flush_history, f"Update history: {len(prog.ok)} URL")
+        if pipeline.aborted:
+            sidebar_status.error(f"🚨 Batch đã dừng vì token hết hạn! Tiến độ đã lưu (batch `{pipeline.batch_id}`) — dán token mới rồi bấm ▶️ Chạy tiếp.")
+            return
         status_text.text("🎉 HOÀN TẤT TOÀN BỘ QUÁ TRÌNH!")
-        lok_final = st.session_state.app_state["ok"]
-        lfail_final = st.session_state.app_state["fail"]
         sidebar_bar.progress(1.0)
         sidebar_pct.markdown("<h1 style='color:#00c853;margin:0;font-size:64px;'>100<span style='font-size:28px;'>%</span></h1>", unsafe_allow_html=True)
-        sidebar_detail.markdown(f"🎉 **Hoàn Tất!** {len(valid_urls)} bài viết")
-        sidebar_ok_count.markdown(f"✅ **{len(lok_final)}** thành công | ❌ **{len(lfail_final)}** thất bại")
+        sidebar_detail.markdown(f"🎉 **Hoàn Tất!** {prog.total} bài viết")
+        sidebar_ok_count.markdown(f"✅ **{len(prog.ok)}** thành công | ❌ **{len(prog.fail)}** thất bại")
         sidebar_status.success("🎉 Cày DATA XONG!")
+        render_tts_cache_stats()
         progress_text.markdown("")
     # Nhập URL & nút chạy
-    history = load_history()
     urls_list_raw = urls_text.strip().split("\n") if urls_text.strip() else []
     urls_list_raw = [u.strip() for u in urls_list_raw if len(u.strip()) > 5]
+    history = get_store().get_many(re.findall(r'([a-f0-9]{24})', "\n".join(urls_list_raw)))
     if urls_list_raw:
         already_done = []
         not_yet = []
         for u in urls_list_raw:
             m = re.search(r'([a-f0-9]{24})', u)
-            if m and m.group(1) in history:
+            # Bài đã có trong lịch sử nhưng còn thiếu audio ngôn ngữ đang chọn (VD: mới có VI) thì vẫn phải chạy
+            if m and m.group(1) in history and all(history[m.group(1)].get(f"audio_{l}") for l, on in (("vi", run_vi), ("en", run_en)) if on):
                 already_done.append((u, history[m.group(1)]))
             else:
                 not_yet.append(u)
@@ -601,7 +502,84 @@ with tab_auto:
                 st.warning("⚠️ Tất cả URL đã được xử lý rồi! Bỏ tick 'Bỏ qua' nếu muốn chạy lại.")
             else:
                 st.session_state.popup_visible = True
-                asyncio.run(process_urls(run_list))
+                if use_bgm and os.path.exists(bgm_path):
+                    try:
+                        with st.spinner("🎵 Đang chuẩn bị nhạc nền..."):
+                            prepare_bgm(bgm_path, bgm_volume_db)
+                    except Exception:
+                        pass
+                asyncio.run(process_urls(run_list, stage_workers=stage_workers, queue_size=queue_size, streaming=streaming,
+                                         chunk_chars=chunk_chars, chunk_concurrency=chunk_concurrency))
+    if st.session_state.get("worker_batch"):
+        worker_progress(st.session_state.worker_batch)
+    # Refresh: chỉ tạo lại bài có nội dung / giọng đọc đã đổi so với lúc tạo audio
+    with st.expander("♻️ Tạo lại audio cho bài đã sửa nội dung (so fingerprint)"):
+        st.caption("Fetch CMS, chuẩn hóa text rồi so với fingerprint lưu trong lịch sử. Nguồn: các URL trong ô nhập, ô trống thì lấy toàn bộ lịch sử.")
+        refresh_unknown = st.checkbox("Coi audio cũ chưa có fingerprint là đã cũ (tạo lại hết)", value=False, key="refresh_unknown",
+                                      help="Bỏ tick: audio cũ chưa có fingerprint được coi là khớp nội dung hiện tại và chỉ ghi nhận fingerprint.")
+        if st.button("🔎 Kiểm tra (dry-run)", key="stale_check_btn"):
+            if not token:
+                st.error("🚨 Sếp chưa nhập Bearer Token!")
+            else:
+                _src = urls_list_raw or [f"https://cms.tatinta.com/destination/action/{d}" for d in get_store().all_ids()]
+                _langs = ([("vi", voice_vi, rate_vi, pitch_vi)] if run_vi else []) + ([("en", voice_en, rate_en, pitch_en)] if run_en else [])
+                _bar = st.progress(0)
+                try:
+                    st.session_state.stale_rows = asyncio.run(stale_report(_src, BatchConfig(token, _langs),
+                                                              on_progress=lambda d, n: _bar.progress(d / n)))
+                except Exception as e:
+                    st.error(f"🚨 {e}")
+        _rows = st.session_state.get("stale_rows")
+        if _rows:
+            _summary = {}
+            for r in _rows:
+                _summary.setdefault(r["status"], {}).setdefault(r["lang"] or "-", 0)
+                _summary[r["status"]][r["lang"] or "-"] += 1
+            st.dataframe([{"Trạng thái": k, **v} for k, v in _summary.items()], hide_index=True)
+            _todo = stale_urls(_rows, include_unknown=refresh_unknown)
+            _chars = sum(r["chars"] for r in _rows if r["status"] in ("changed", "missing") or (refresh_unknown and r["status"] == "unknown"))
+            st.markdown(f"**{len(_todo)} bài** cần tạo lại · ~{_chars:,} ký tự TTS")
+            _stale_rows = [r for r in _rows if r["status"] not in ("unchanged",)]
+            if _stale_rows:
+                st.dataframe([{k: r.get(k) for k in ("dest_id", "title", "lang", "status", "chars", "error")} for r in _stale_rows],
+                             use_container_width=True, hide_index=True)
+            st.download_button("⬇️ Tải báo cáo (JSON)", data=json.dumps(_rows, ensure_ascii=False, indent=2),
+                               file_name=f"stale_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json", mime="application/json")
+            if st.button(f"♻️ Tạo lại {len(_todo)} bài đã đổi", type="primary", key="stale_run_btn", disabled=not (_todo or not refresh_unknown)):
+                if not token:
+                    st.error("🚨 Sếp chưa nhập Bearer Token!")
+                else:
+                    if not refresh_unknown:
+                        _n = adopt_fingerprints(_rows)
+                        if _n: st.info(f"📌 Ghi nhận fingerprint cho {_n} bài cũ")
+                    st.session_state.stale_rows = None
+                    if _todo:
+                        asyncio.run(process_urls(_todo, stage_workers=stage_workers, queue_size=queue_size, streaming=streaming,
+                                                 chunk_chars=chunk_chars, chunk_concurrency=chunk_concurrency,
+                                                 refresh=True, refresh_unknown=refresh_unknown))
+                    else:
+                        flush_history("Update history: fingerprints")
+    # Batch dở dang (refresh trình duyệt, token hết hạn, restart...) — tiến độ nằm trong hàng đợi trên đĩa
+    _unfinished = get_job_queue().batches(unfinished=True, limit=5)
+    if _unfinished:
+        with st.expander(f"⏸️ {len(_unfinished)} batch chưa xong — chạy tiếp từ chỗ đã dừng", expanded=True):
+            for _b in _unfinished:
+                _bc = st.columns([4, 1, 1, 1])
+                _bc[0].markdown(f"`{_b['batch_id']}` · {_b['created_at']} · ✅ {_b['patched']}/{_b['total']} · "
+                                f"⏳ {_b['remaining']} còn lại · ❌ {_b['failed']} lỗi")
+                _resume = _bc[1].button("▶️ Chạy tiếp", key=f"resume_{_b['batch_id']}", disabled=not _b["remaining"])
+                _retry = _bc[2].button("🔁 Chạy lại lỗi", key=f"retry_{_b['batch_id']}", disabled=not _b["failed"])
+                if _bc[3].button("🗑️ Bỏ", key=f"drop_{_b['batch_id']}"):
+                    get_job_queue().drop_batch(_b["batch_id"])
+                    st.rerun()
+                if _resume or _retry:
+                    if not token:
+                        st.error("🚨 Sếp chưa nhập Bearer Token!")
+                    else:
+                        if _retry:
+                            get_job_queue().retry_failed(_b["batch_id"])
+                        asyncio.run(process_urls(None, stage_workers=stage_workers, queue_size=queue_size, streaming=streaming,
+                                                 chunk_chars=chunk_chars, chunk_concurrency=chunk_concurrency, batch_id=_b["batch_id"]))
 # ==========================================
 # TAB 2: TẠO AUDIO TAY
 # ==========================================
@@ -637,6 +615,52 @@ with tab_manual:
         placeholder="https://cms.tatinta.com/destination/action/698afc6c1b29cd1e8cc1b826",
         key="manual_cms_url"
     )
+    manual_langs = {}
+    if manual_run_vi and manual_title_vi.strip():
+        manual_langs["vi"] = (manual_title_vi, manual_content_vi, voice_vi, rate_vi, pitch_vi)
+    if manual_run_en and manual_title_en.strip():
+        manual_langs["en"] = (manual_title_en, manual_content_en, voice_en, rate_en, pitch_en)
+    manual_bgm = bgm_path if use_bgm and os.path.exists(bgm_path) else None
+    manual_profiles = {"vi": profile_vi, "en": profile_en}
+    # --- Nghe thử nhanh: chỉ tiêu đề + đoạn đầu, 2 ngôn ngữ song song ---
+    # Giọng đọc của đoạn nghe thử giữ trong session theo (text, voice, rate, pitch): kéo slider dB / đổi nhạc nền / profile chỉ mix lại
+    if "manual_preview" not in st.session_state:
+        st.session_state.manual_preview = {}   # lang → {"key", "raw", "mix_key", "mixed": (bytes, Profile)}
+    if st.checkbox("⚡ Nghe thử nhanh (tiêu đề + đoạn đầu) — chỉnh giọng / tốc độ / nhạc nền là nghe lại ngay", key="manual_preview_on"):
+        if not manual_langs:
+            st.caption("Nhập tiêu đề để nghe thử.")
+        else:
+            async def run_preview():
+                cache = st.session_state.manual_preview
+                async def one(lang_code, title, content, voice, rate, pitch):
+                    mix_key = (manual_bgm, os.path.getmtime(manual_bgm) if manual_bgm else None, bgm_volume_db, manual_profiles[lang_code])
+                    text_tts = fix_plain_preview_for_tts(title, content) or f"{title}..."
+                    p = cache.get(lang_code, {})
+                    if p.get("key") != (text_tts, voice, rate, pitch):
+                        raw = await synthesize(text_tts, voice, rate, pitch)
+                        if not raw: raise Exception("EdgeTTS trả về rỗng")
+                        p = {"key": (text_tts, voice, rate, pitch), "raw": raw}
+                    if p.get("mix_key") != mix_key:
+                        mixed = await mix_bytes(p["raw"], manual_bgm, bgm_volume_db, manual_profiles[lang_code])
+                        # mix_bytes trả lại chính giọng gốc khi không mix được
+                        enc = get_profile(manual_profiles[lang_code]) if mixed is not p["raw"] else RAW
+                        p["mixed"], p["mix_key"] = (mixed, enc), mix_key
+                    cache[lang_code] = p
+                    return p["mixed"]
+                done = await asyncio.gather(*(one(l, *args) for l, args in manual_langs.items()), return_exceptions=True)
+                return dict(zip(manual_langs, done))
+            _t0 = time.time()
+            with st.spinner("Đang tạo đoạn nghe thử..."):
+                previews = asyncio.run(run_preview())
+            prev_cols = dict(zip(manual_langs, st.columns(len(manual_langs))))
+            for lang_code, res in previews.items():
+                with prev_cols[lang_code]:
+                    if isinstance(res, Exception):
+                        st.error(f"❌ Nghe thử {lang_code.upper()} lỗi: {res}")
+                    else:
+                        st.markdown(f"**{'🇻🇳' if lang_code == 'vi' else '🇺🇸'} Nghe thử {lang_code.upper()}** · {res[1].label}")
+                        st.audio(res[0], format=res[1].mime)
+            st.caption(f"⚡ {time.time() - _t0:.1f}s — bấm TẠO AUDIO khi đã ưng để render cả bài.")
     # --- Nút tạo audio ---
     if st.button("🎙️ TẠO AUDIO", type="primary", use_container_width=True, key="manual_gen_btn"):
         if not manual_run_vi and not manual_run_en:
@@ -650,131 +674,133 @@ with tab_manual:
             import tempfile
             _tmp_dir = tempfile.gettempdir()
             manual_status = st.empty()
+            manual_metrics = RunMetrics("manual", METRICS_LOG, meta={"voices": {"vi": voice_vi, "en": voice_en}})
             async def run_manual():
-                results = {}
                 async def gen_one(lang_code, title, content, voice, rate, pitch):
-                    text_tts = fix_plain_text_for_tts(title, content)
-                    if not text_tts:
-                        text_tts = f"{title}..."
+                    with manual_metrics.timer(lang_code, "normalize") as t:
+                        text_tts = fix_plain_text_for_tts(title, content)
+                        if not text_tts:
+                            text_tts = f"{title}..."
+                        t["bytes"] = len(text_tts.encode("utf-8"))
                     raw_f = os.path.join(_tmp_dir, f"tatinta_manual_raw_{lang_code}.mp3")
-                    mix_f = os.path.join(_tmp_dir, f"tatinta_manual_mix_{lang_code}.mp3")
-                    manual_status.info(f"⏳ Đang tạo TTS {lang_code.upper()}...")
-                    await edge_tts.Communicate(text_tts, voice, rate=f"{rate:+d}%", pitch=f"{pitch:+d}Hz").save(raw_f)
-                    raw_size = os.path.getsize(raw_f) if os.path.exists(raw_f) else 0
+                    enc = get_profile(manual_profiles[lang_code])
+                    mix_f = os.path.join(_tmp_dir, f"tatinta_manual_mix_{lang_code}.{enc.ext}")
+                    manual_status.info(f"⏳ Đang tạo TTS {' + '.join(l.upper() for l in manual_langs)}...")
+                    with manual_metrics.timer(lang_code, "tts") as t:
+                        audio_bytes = await synthesize(text_tts, voice, rate, pitch, chunk_chars=chunk_chars, chunk_concurrency=chunk_concurrency)
+                        t["bytes"] = len(audio_bytes)
+                    with open(raw_f, "wb") as f:
+                        f.write(audio_bytes)
+                    raw_size = len(audio_bytes)
                     if raw_size == 0:
                         raise Exception(f"EdgeTTS tạo file rỗng cho {lang_code.upper()}!")
                     manual_status.info(f"✅ TTS {lang_code.upper()} xong ({raw_size//1024}KB). Đang mix nhạc...")
-                    await asyncio.to_thread(mix_audio, raw_f, bgm_path if use_bgm else None, mix_f, bgm_volume_db)
-                    mix_size = os.path.getsize(mix_f) if os.path.exists(mix_f) else 0
+                    with manual_metrics.timer(lang_code, "ffmpeg") as t:
+                        mixed = await asyncio.to_thread(mix_audio, raw_f, manual_bgm, mix_f, bgm_volume_db, enc.name)
+                        mix_size = os.path.getsize(mix_f) if os.path.exists(mix_f) else 0
+                        t["bytes"] = mix_size
+                    if os.path.exists(raw_f): os.remove(raw_f)
                     if mix_size == 0:
                         raise Exception(f"Mix audio thất bại cho {lang_code.upper()}!")
-                    if os.path.exists(raw_f): os.remove(raw_f)
-                    return mix_f
-                tasks = {}
-                if manual_run_vi:
-                    tasks["vi"] = gen_one("vi", manual_title_vi, manual_content_vi, voice_vi, rate_vi, pitch_vi)
-                if manual_run_en:
-                    tasks["en"] = gen_one("en", manual_title_en, manual_content_en, voice_en, rate_en, pitch_en)
-                for lang, coro in tasks.items():
-                    try:
-                        results[lang] = await coro
-                    except Exception as e:
-                        results[lang] = None
-                        st.error(f"❌ Lỗi tạo audio {lang.upper()}: {e}")
+                    return mix_f, enc.name if mixed else RAW.name
+                # 2 ngôn ngữ chạy song song — TTS là chờ mạng, mix chạy trong thread
+                done = await asyncio.gather(*(gen_one(l, *args) for l, args in manual_langs.items()), return_exceptions=True)
+                results = {}
+                for lang, res in zip(manual_langs, done):
+                    voice = manual_langs[lang][2]
+                    if isinstance(res, Exception):
+                        manual_metrics.finish(lang, False, error=res, voice=voice)
+                        st.error(f"❌ Lỗi tạo audio {lang.upper()}: {res}")
+                    else:
+                        manual_metrics.finish(lang, True, voice=voice)
+                        results[lang] = res
                 return results
             with st.spinner("Đang tạo audio..."):
                 audio_results = asyncio.run(run_manual())
             manual_status.empty()
-            # --- Hiển thị preview & download ---
-            if audio_results:
-                st.success("🎉 Tạo audio xong!")
-                col_prev_vi, col_prev_en = st.columns(2)
-                vi_path = audio_results.get("vi")
-                en_path = audio_results.get("en")
-                with col_prev_vi:
-                    if vi_path and os.path.exists(vi_path):
-                        st.markdown("**🇻🇳 Preview Audio Tiếng Việt:**")
-                        with open(vi_path, "rb") as f:
-                            audio_bytes_vi = f.read()
-                        st.audio(audio_bytes_vi, format="audio/mp3")
-                        st.download_button(
-                            label="⬇️ Tải về (VI)",
-                            data=audio_bytes_vi,
-                            file_name=f"audio_vi_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mp3",
-                            mime="audio/mpeg",
-                            use_container_width=True,
-                            key="dl_vi"
-                        )
-                with col_prev_en:
-                    if en_path and os.path.exists(en_path):
-                        st.markdown("**🇺🇸 Preview Audio Tiếng Anh:**")
-                        with open(en_path, "rb") as f:
-                            audio_bytes_en = f.read()
-                        st.audio(audio_bytes_en, format="audio/mp3")
-                        st.download_button(
-                            label="⬇️ Tải về (EN)",
-                            data=audio_bytes_en,
-                            file_name=f"audio_en_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mp3",
-                            mime="audio/mpeg",
-                            use_container_width=True,
-                            key="dl_en"
-                        )
-                # --- Upload lên CMS nếu có URL ---
-                if manual_cms_url.strip():
-                    st.markdown("---")
-                    if st.button("🚀 Upload Audio lên CMS", type="secondary", use_container_width=True, key="manual_upload_btn"):
-                        if not token:
-                            st.error("🚨 Chưa nhập Bearer Token ở trên!")
-                        else:
-                            match_cms = re.search(r'([a-f0-9]{24})', manual_cms_url)
-                            if not match_cms:
-                                st.error("🚨 URL CMS không hợp lệ!")
-                            else:
-                                dest_id_m = match_cms.group(1)
-                                api_url_m = f'https://api.tatinta.com/v1/destination/destination/{dest_id_m}'
-                                clean_tok = token.strip().strip('"').strip("'")
-                                clean_tok = clean_tok.encode('ascii', 'ignore').decode('ascii')
-                                headers_m = {
-                                    'Origin': 'https://cms.tatinta.com',
-                                    'Referer': 'https://cms.tatinta.com/',
-                                    'Accept': 'application/json, text/plain, */*',
-                                    'Authorization': f'Bearer {clean_tok}',
-                                    'User-Agent': 'Mozilla/5.0'
-                                }
-                                with st.spinner("Đang upload lên CMS..."):
-                                    uploaded_vi = None
-                                    uploaded_en = None
-                                    if vi_path and os.path.exists(vi_path):
-                                        try:
-                                            fname_vi = upload_audio_to_storage(vi_path, clean_tok)
-                                            uploaded_vi = save_file_to_permanent(fname_vi, clean_tok)
-                                            st.success(f"✅ Upload VI xong: `{uploaded_vi}`")
-                                        except Exception as e:
-                                            st.error(f"❌ Upload VI thất bại: {e}")
-                                    if en_path and os.path.exists(en_path):
-                                        try:
-                                            fname_en = upload_audio_to_storage(en_path, clean_tok)
-                                            uploaded_en = save_file_to_permanent(fname_en, clean_tok)
-                                            st.success(f"✅ Upload EN xong: `{uploaded_en}`")
-                                        except Exception as e:
-                                            st.error(f"❌ Upload EN thất bại: {e}")
-                                    if uploaded_vi or uploaded_en:
-                                        # Lấy translations hiện tại của bài
-                                        try:
-                                            get_r = requests.get(api_url_m, headers=headers_m)
-                                            existing_trans = get_r.json().get('data', {}).get('translations', {}) if get_r.status_code == 200 else {}
-                                        except:
-                                            existing_trans = {}
-                                        payload_m = {"translations": existing_trans}
-                                        if uploaded_vi:
-                                            payload_m["audio"] = uploaded_vi
-                                        if uploaded_en:
-                                            if 'en' not in payload_m["translations"]:
-                                                payload_m["translations"]["en"] = {}
-                                            payload_m["translations"]["en"]["audio"] = uploaded_en
-                                        patch_r = requests.patch(api_url_m, headers=headers_m, json=payload_m)
-                                        if patch_r.status_code == 200:
-                                            st.success("🎉 Đã cắm audio vào bài CMS thành công!")
-                                            save_to_history(dest_id_m, manual_title_vi or manual_title_en, audio_vi=uploaded_vi, audio_en=uploaded_en)
-                                        else:
-                                            st.error(f"❌ PATCH thất bại: {patch_r.text[:200]}")
+            st.session_state.last_run_metrics = manual_metrics.close()
+            render_run_metrics(st.session_state.last_run_metrics)
+            render_tts_cache_stats()
+            # Giữ kết quả qua các lần rerun — nút Upload bên dưới bấm được ở lần rerun sau
+            # lang → (bytes, tên profile thực tế)
+            manual_results = {}
+            for lang, (path, encoded) in audio_results.items():
+                if not os.path.exists(path): continue
+                with open(path, "rb") as f:
+                    manual_results[lang] = (f.read(), encoded)
+                os.remove(path)   # bytes đã giữ trong session: không để file mix nằm lại trong thư mục tạm
+            st.session_state.manual_results = manual_results
+            st.session_state.manual_results_at = datetime.now().strftime('%Y%m%d_%H%M%S')
+    # --- Hiển thị preview & download ---
+    manual_results = st.session_state.get("manual_results") or {}
+    if manual_results:
+        st.success("🎉 Tạo audio xong!")
+        col_prev_vi, col_prev_en = st.columns(2)
+        for lang_code, col, label in (("vi", col_prev_vi, "🇻🇳 Preview Audio Tiếng Việt"), ("en", col_prev_en, "🇺🇸 Preview Audio Tiếng Anh")):
+            if lang_code not in manual_results: continue
+            audio_m, enc_m = manual_results[lang_code][0], get_profile(manual_results[lang_code][1])
+            with col:
+                st.markdown(f"**{label}:**")
+                st.caption(f"{enc_m.label} · {len(audio_m) // 1024}KB")
+                st.audio(audio_m, format=enc_m.mime)
+                st.download_button(
+                    label=f"⬇️ Tải về ({lang_code.upper()})",
+                    data=audio_m,
+                    file_name=f"audio_{lang_code}_{st.session_state.manual_results_at}.{enc_m.ext}",
+                    mime=enc_m.mime,
+                    use_container_width=True,
+                    key=f"dl_{lang_code}"
+                )
+        # --- Upload lên CMS nếu có URL ---
+        if manual_cms_url.strip():
+            st.markdown("---")
+            if st.button("🚀 Upload Audio lên CMS", type="secondary", use_container_width=True, key="manual_upload_btn"):
+                if not token:
+                    st.error("🚨 Chưa nhập Bearer Token ở trên!")
+                else:
+                    match_cms = re.search(r'([a-f0-9]{24})', manual_cms_url)
+                    if not match_cms:
+                        st.error("🚨 URL CMS không hợp lệ!")
+                    else:
+                        dest_id_m = match_cms.group(1)
+                        async def upload_manual():
+                            async with CmsClient(token) as cms:
+                                async def up_one(lang_code):
+                                    if lang_code not in manual_results: return None
+                                    audio_bytes, enc_up = manual_results[lang_code][0], get_profile(manual_results[lang_code][1])
+                                    try:
+                                        uploaded, reused = await upload_once(cms, audio_bytes, f"tatinta_manual_mix_{lang_code}.{enc_up.ext}",
+                                                                             content_type=enc_up.mime)
+                                        if not uploaded: raise Exception("server không trả về filename")
+                                        st.success(f"✅ {'Dùng lại file đã upload' if reused else 'Upload'} {lang_code.upper()} xong: `{uploaded}`")
+                                        return uploaded
+                                    except Exception as e:
+                                        st.error(f"❌ Upload {lang_code.upper()} thất bại: {e}")
+                                        return None
+                                # Lấy translations hiện tại của bài song song với upload
+                                get_task = asyncio.ensure_future(cms.get_destination(dest_id_m))
+                                uploaded_vi, uploaded_en = await asyncio.gather(up_one("vi"), up_one("en"))
+                                try:
+                                    get_r = await get_task
+                                    existing_trans = get_r.json().get('data', {}).get('translations', {}) if get_r.status_code == 200 else {}
+                                except:
+                                    existing_trans = {}
+                                if not (uploaded_vi or uploaded_en): return
+                                payload_m = {"translations": existing_trans}
+                                if uploaded_vi:
+                                    payload_m["audio"] = uploaded_vi
+                                if uploaded_en:
+                                    if 'en' not in payload_m["translations"]:
+                                        payload_m["translations"]["en"] = {}
+                                    payload_m["translations"]["en"]["audio"] = uploaded_en
+                                patch_r = await cms.patch_destination(dest_id_m, payload_m)
+                                if patch_r.status_code == 200:
+                                    st.success("🎉 Đã cắm audio vào bài CMS thành công!")
+                                    save_to_history(dest_id_m, manual_title_vi or manual_title_en, audio_vi=uploaded_vi, audio_en=uploaded_en,
+                                                    profile_vi=manual_results["vi"][1] if uploaded_vi else None,
+                                                    profile_en=manual_results["en"][1] if uploaded_en else None)
+                                    flush_history(f"Update history: {dest_id_m} - {(manual_title_vi or manual_title_en)[:30]}")
+                                else:
+                                    st.error(f"❌ PATCH thất bại: {patch_r.text[:200]}")
+                        with st.spinner("Đang upload lên CMS..."):
+                            asyncio.run(upload_manual())
@@ -0,0 +1,132 @@
+"""Benchmark offline cả pipeline batch với API Tatinta giả + EdgeTTS giả (không cần mạng, không đụng history thật).
+Báo cáo: điểm đến/phút, p50/p95 từng tầng, RSS đỉnh, dung lượng file tạm đỉnh.
+Chạy: python bench/bench_pipeline.py [--sizes 10 100 1000] [--mode streaming|files|both] [--cms-latency-ms 50] [--error-rate 0.02]"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import resource
+import tempfile
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix="tatinta_bench_")
+# Phải đặt trước khi import tatinta: cache / history riêng cho benchmark, tắt đồng bộ GitHub
+os.environ["TATINTA_GITHUB_SYNC"] = "0"
+os.environ["TATINTA_HISTORY_DB"] = os.path.join(WORK_DIR, "history.db")
+os.environ["TATINTA_TTS_CACHE"] = os.path.join(WORK_DIR, "tts")
+os.environ["TATINTA_BGM_CACHE"] = os.path.join(WORK_DIR, "bgm")
+os.environ["TATINTA_UPLOAD_INDEX"] = os.path.join(WORK_DIR, "uploads.db")
+sys.path.insert(0, ROOT)
+from tatinta.pipeline import STAGES
+from tatinta.tts import set_tts_backend
+from tatinta.batch import BatchConfig, run_batch
+from tatinta.limits import limiter_stats
+from bench.fakes import FakeCms, FakeTts
+DEFAULT_BGM = os.path.join(ROOT, "Hovering Thoughts - Spence.mp3")
+LANGS = [("vi", "vi-VN-HoaiMyNeural", 0, 0), ("en", "en-US-AriaNeural", 0, 0)]
+def percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
+def dir_size(paths):
+    total = 0
+    for root in paths:
+        for dirpath, _, names in os.walk(root):
+            for name in names:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, name))
+                except OSError:
+                    pass
+    return total
+def peak_rss_mb():
+    # Linux: ru_maxrss tính bằng KB. CHILDREN = tiến trình ffmpeg con lớn nhất đã kết thúc
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return self_kb / 1024, child_kb / 1024
+async def sample_disk(paths, state, interval=0.1):
+    while True:
+        state["peak"] = max(state["peak"], await asyncio.to_thread(dir_size, paths))
+        await asyncio.sleep(interval)
+async def run_scenario(size, mode, args, offset):
+    cms = FakeCms(latency_ms=args.cms_latency_ms, error_rate=args.error_rate, paragraphs=args.paragraphs, seed=offset,
+                  capacity=args.cms_capacity)
+    tts = FakeTts(first_byte_ms=args.tts_first_byte_ms, rtf=args.tts_rtf, empty_rate=args.tts_empty_rate, seed=offset,
+                  capacity=args.tts_capacity)
+    set_tts_backend(tts.stream)
+    base_url = await cms.start()
+    tmp_dir = os.path.join(WORK_DIR, f"tmp_{mode}_{size}")
+    cfg = BatchConfig("bench-token", LANGS, bgm_path=args.bgm, bgm_volume_db=args.db, queue_size=args.queue_size,
+                      streaming=(mode == "streaming"), chunk_chars=args.chunk_chars, tmp_dir=tmp_dir, api_base=base_url)
+    urls = [f"https://cms.tatinta.com/destination/{offset + i:024x}" for i in range(size)]
+    timings = {s: [] for s in STAGES}
+    result = {"ok": 0, "fail": 0}
+    def on_stage_done(job, stage_name, elapsed, ok):
+        timings[stage_name].append(elapsed)
+    def on_ok(job):
+        result["ok"] += 1
+    def on_fail(job, stage_name, msg):
+        result["fail"] += 1
+    disk = {"peak": 0}
+    sampler = asyncio.ensure_future(sample_disk([tmp_dir, os.environ["TATINTA_TTS_CACHE"]], disk))
+    t0 = time.perf_counter()
+    try:
+        pipeline = await run_batch(urls, cfg, on_stage_done=on_stage_done, on_ok=on_ok, on_fail=on_fail, flush=False)
+    finally:
+        elapsed = time.perf_counter() - t0
+        sampler.cancel()
+        await cms.stop()
+        set_tts_backend(None)
+    steps = pipeline.metrics.summary()["steps"]
+    rss_self, rss_child = peak_rss_mb()
+    print(f"\n== {mode} × {size} điểm đến: {elapsed:.1f}s, {size / elapsed * 60:.0f} điểm đến/phút, "
+          f"ok={result['ok']} lỗi={result['fail']}")
+    print(f"   {'tầng':<11} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for s in STAGES:
+        v = timings[s]
+        print(f"   {s:<11} {len(v):>5} {percentile(v, 50) * 1000:>9.1f} {percentile(v, 95) * 1000:>9.1f} {max(v or [0]) * 1000:>9.1f}")
+    print(f"   {'bước':<11} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'MB':>9}")
+    for step, v in steps.items():
+        print(f"   {step:<11} {v['n']:>5} {v['p50'] * 1000:>9.1f} {v['p95'] * 1000:>9.1f} {v['bytes'] / 1e6:>9.1f}")
+    print(f"   RSS đỉnh: {rss_self:.0f} MB (python), {rss_child:.0f} MB (ffmpeg lớn nhất) | "
+          f"file tạm + cache TTS đỉnh: {disk['peak'] / 1e6:.1f} MB | upload {cms.upload_bytes / 1e6:.1f} MB | "
+          f"TTS {tts.calls} lần / {tts.chars} ký tự / {tts.rejected} bị chặn | HTTP {cms.counts}")
+    mix = pipeline.metrics.meta.get("mix")
+    if mix:
+        print(f"   mix theo lô: {mix['tracks']} giọng / {mix['batches']} tiến trình ffmpeg, {mix['fallbacks']} mix lại riêng")
+    print("   limiter: " + ", ".join(f"{k}={v['limit']} (chặn {v['throttled']})" for k, v in limiter_stats().items()))
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--mode", choices=["streaming", "files", "both"], default="both")
+    parser.add_argument("--cms-latency-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="tỉ lệ request CMS trả 503 (client tự retry)")
+    parser.add_argument("--tts-first-byte-ms", type=float, default=300)
+    parser.add_argument("--tts-rtf", type=float, default=0.05, help="thời gian sinh / thời lượng audio")
+    parser.add_argument("--tts-empty-rate", type=float, default=0.0)
+    parser.add_argument("--cms-capacity", type=int, default=0, help="request CMS đồng thời tối đa trước khi trả 429 (0 = không giới hạn)")
+    parser.add_argument("--tts-capacity", type=int, default=0, help="stream TTS đồng thời tối đa trước khi trả rỗng (0 = không giới hạn)")
+    parser.add_argument("--paragraphs", type=int, default=8)
+    parser.add_argument("--chunk-chars", type=int, default=0)
+    parser.add_argument("--queue-size", type=int, default=4)
+    parser.add_argument("--bgm", default=DEFAULT_BGM)
+    parser.add_argument("--db", type=int, default=-20)
+    parser.add_argument("--keep", action="store_true", help="giữ lại thư mục làm việc tạm")
+    args = parser.parse_args()
+    if not shutil.which("ffmpeg"):
+        print("(không có ffmpeg: tầng mix chỉ copy giọng gốc, số liệu mix / RSS ffmpeg không phản ánh thực tế)")
+        args.bgm = None
+    modes = ["streaming", "files"] if args.mode == "both" else [args.mode]
+    print(f"Thư mục làm việc: {WORK_DIR}")
+    try:
+        offset = 1
+        for mode in modes:
+            for size in args.sizes:
+                await run_scenario(size, mode, args, offset)
+                offset += size
+    finally:
+        if not args.keep:
+            shutil.rmtree(WORK_DIR, ignore_errors=True)
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""So sánh các profile mã hóa (encoding.py) trên cùng 1 batch mẫu: thời gian encode (ffmpeg), dung lượng file,
+thời gian upload với băng thông giả lập. API Tatinta + EdgeTTS giả (giọng im lặng), nhạc nền thật — dung lượng Opus
+với giọng thật sẽ cao hơn một chút, so sánh tương đối giữa các profile vẫn đúng.
+Chạy: python bench/bench_profiles.py [--size 20] [--profiles mp3_128k mp3_64k_mono opus_32k_mono] [--upload-mbps 8]"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix="tatinta_bench_profiles_")
+# Phải đặt trước khi import tatinta: cache / history riêng cho benchmark, tắt đồng bộ GitHub
+os.environ["TATINTA_GITHUB_SYNC"] = "0"
+os.environ["TATINTA_HISTORY_DB"] = os.path.join(WORK_DIR, "history.db")
+os.environ["TATINTA_TTS_CACHE"] = os.path.join(WORK_DIR, "tts")
+os.environ["TATINTA_BGM_CACHE"] = os.path.join(WORK_DIR, "bgm")
+os.environ["TATINTA_UPLOAD_INDEX"] = os.path.join(WORK_DIR, "uploads.db")
+sys.path.insert(0, ROOT)
+from tatinta.tts import set_tts_backend
+from tatinta.batch import BatchConfig, run_batch
+from tatinta.encoding import PROFILES
+from bench.fakes import FakeCms, FakeTts
+DEFAULT_BGM = os.path.join(ROOT, "Hovering Thoughts - Spence.mp3")
+LANGS = [("vi", "vi-VN-HoaiMyNeural", 0, 0), ("en", "en-US-AriaNeural", 0, 0)]
+async def run_profile(profile, args):
+    # Cùng seed / cùng URL cho mọi profile: cùng nội dung, chỉ khác phần encode
+    cms = FakeCms(latency_ms=args.cms_latency_ms, paragraphs=args.paragraphs, upload_mbps=args.upload_mbps)
+    tts = FakeTts(first_byte_ms=0, rtf=0)
+    set_tts_backend(tts.stream)
+    base_url = await cms.start()
+    # Chế độ file, mix từng giọng: bước "ffmpeg" chỉ gồm mix + encode, không lẫn thời gian TTS / giọng khác cùng lô
+    cfg = BatchConfig("bench-token", LANGS, bgm_path=args.bgm, bgm_volume_db=args.db, streaming=False, mix_batch=1,
+                      tmp_dir=os.path.join(WORK_DIR, f"tmp_{profile}"), api_base=base_url,
+                      profiles={l[0]: profile for l in LANGS})
+    urls = [f"https://cms.tatinta.com/destination/{i + 1:024x}" for i in range(args.size)]
+    t0 = time.perf_counter()
+    try:
+        pipeline = await run_batch(urls, cfg, flush=False)
+    finally:
+        elapsed = time.perf_counter() - t0
+        await cms.stop()
+        set_tts_backend(None)
+    steps = pipeline.metrics.summary()["steps"]
+    enc, up = steps.get("ffmpeg", {}), steps.get("cms_upload", {})
+    return {"profile": profile, "elapsed": elapsed, "tracks": enc.get("n", 0), "encode_p50": enc.get("p50", 0),
+            "encode_total": enc.get("total", 0), "bytes": enc.get("bytes", 0), "uploads": up.get("n", 0), "upload_p50": up.get("p50", 0),
+            "upload_total": up.get("total", 0), "fail": pipeline.metrics.fail}
+def report(rows):
+    # "upload" < số file: file trùng byte (bài giả cùng độ dài) được dùng lại qua chỉ mục dedup — như nhau ở mọi profile
+    base = next((r for r in rows if r["profile"] == "mp3_128k"), rows[0])
+    print(f"\n{'profile':<15} {'file':>5} {'encode p50':>11} {'encode Σ':>9} {'KB/file':>8} {'tổng MB':>8} {'% dung lượng':>13} "
+          f"{'upload':>7} {'upload p50':>11} {'upload Σ':>9}")
+    for r in rows:
+        per_file = r["bytes"] / r["tracks"] / 1024 if r["tracks"] else 0
+        pct = r["bytes"] / base["bytes"] * 100 if base["bytes"] else 0
+        print(f"{r['profile']:<15} {r['tracks']:>5} {r['encode_p50'] * 1000:>9.0f}ms {r['encode_total']:>8.1f}s {per_file:>8.0f} "
+              f"{r['bytes'] / 1e6:>8.2f} {pct:>12.0f}% {r['uploads']:>7} {r['upload_p50'] * 1000:>9.0f}ms {r['upload_total']:>8.1f}s"
+              + (f"  ({r['fail']} bài lỗi — encoder không có trong bản ffmpeg này?)" if r["fail"] else ""))
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=20, help="số điểm đến trong batch mẫu (mỗi bài 2 file VI + EN)")
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument("--upload-mbps", type=float, default=8, help="băng thông upload giả lập (Mbit/s)")
+    parser.add_argument("--cms-latency-ms", type=float, default=50)
+    parser.add_argument("--paragraphs", type=int, default=8)
+    parser.add_argument("--bgm", default=DEFAULT_BGM)
+    parser.add_argument("--db", type=int, default=-20)
+    parser.add_argument("--keep", action="store_true", help="giữ lại thư mục làm việc tạm")
+    args = parser.parse_args()
+    if not shutil.which("ffmpeg") or not os.path.exists(args.bgm):
+        print("Cần ffmpeg và file nhạc nền: không mix thì mọi profile đều upload nguyên giọng gốc, không có gì để so.")
+        return
+    print(f"Thư mục làm việc: {WORK_DIR} · {args.size} điểm đến × {len(LANGS)} ngôn ngữ · upload {args.upload_mbps} Mbit/s")
+    try:
+        rows = []
+        for profile in args.profiles:
+            rows.append(await run_profile(profile, args))
+            print(f"  {profile}: xong trong {rows[-1]['elapsed']:.1f}s")
+        report(rows)
+    finally:
+        if not args.keep:
+            shutil.rmtree(WORK_DIR, ignore_errors=True)
+if __name__ == "__main__":
+    asyncio.run(main())
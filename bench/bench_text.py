@@ -0,0 +1,55 @@
+"""Micro-benchmark chuẩn hóa text trên tiêu đề thật trong processed_urls.json.
+Chạy: python bench/bench_text.py [--repeat 5]"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tatinta.text import HTML_STEPS, apply_rules, fix_text_for_tts, fix_plain_text_for_tts
+HISTORY_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "processed_urls.json")
+FILLER = [
+    "Mở cửa 7:30 – 17:00, vé 50.000 đ (khoảng $2), cách trung tâm 12km.",
+    "Được xây dựng vào thế kỷ XIX, diện tích 3.500 m² trên độ cao 1.200m.",
+    "- Giảm 20% cho học sinh & sinh viên; trẻ em dưới 1m miễn phí.",
+    "“Điểm đến” nổi tiếng với UNESCO — di sản * thiên nhiên * của Việt Nam.",
+]
+def build_articles(titles, paragraphs=6, seed=0):
+    rnd = random.Random(seed)
+    articles = []
+    for title in titles:
+        body = "\n\n".join(f"{i + 1}. {title} {rnd.choice(FILLER)} {rnd.choice(FILLER)}" for i in range(paragraphs))
+        articles.append((title, body))
+    return articles
+def run(label, fn, items, repeat):
+    chars = sum(len(t) + len(b) for t, b in items)
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for title, body in items:
+            fn(title, body)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<28} {len(items):>6} bài  {best * 1000:>9.1f} ms  {len(items) / best:>10.0f} bài/s  {chars / best / 1e6:>7.2f} MB/s")
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--paragraphs", type=int, default=6)
+    args = parser.parse_args()
+    with open(HISTORY_FILE, "r", encoding="utf-8") as f:
+        titles = [v.get("title") or "" for v in json.load(f).values()]
+    articles = build_articles(titles, args.paragraphs)
+    print(f"{len(titles)} tiêu đề từ {os.path.basename(HISTORY_FILE)}, repeat={args.repeat} (lấy lần nhanh nhất)")
+    run("rules HTML (chỉ tiêu đề)", lambda t, b: apply_rules(f"{t}...\n\n{b}", HTML_STEPS), [(t, t) for t in titles], args.repeat)
+    run("rules HTML (bài tổng hợp)", lambda t, b: apply_rules(f"{t}...\n\n{b}", HTML_STEPS), articles, args.repeat)
+    run("fix_plain_text_for_tts", fix_plain_text_for_tts, articles, args.repeat)
+    try:
+        import bs4  # noqa: F401
+    except ImportError:
+        print("(bỏ qua fix_text_for_tts: chưa cài beautifulsoup4)")
+        return
+    html_articles = [(t, "".join(f"<p><strong>{p}</strong></p>" for p in b.split("\n\n"))) for t, b in articles]
+    run("fix_text_for_tts (HTML)", fix_text_for_tts, html_articles, args.repeat)
+if __name__ == "__main__":
+    main()
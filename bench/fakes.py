@@ -0,0 +1,134 @@
+"""Bản giả lập offline cho benchmark: API Tatinta (GET / PATCH / upload audio / save-file) và EdgeTTS.
+Cả hai đều tất định theo dest_id / text, có độ trễ và tỉ lệ lỗi cấu hình được."""
+import random
+import asyncio
+import hashlib
+from aiohttp import web
+# 1 frame MPEG-2 Layer III, 24 kHz mono 48 kbps (cùng định dạng EdgeTTS trả về), side info = 0 → giải mã ra im lặng
+MP3_FRAME = bytes([0xFF, 0xF3, 0x64, 0xC4]) + bytes(140)
+FRAME_SECONDS = 576 / 24000
+CHARS_PER_SECOND = 14
+def fake_mp3(text):
+    seconds = max(1.0, len(text) / CHARS_PER_SECOND)
+    return MP3_FRAME * int(seconds / FRAME_SECONDS)
+def _rng(key):
+    return random.Random(int(hashlib.sha256(key.encode("utf-8")).hexdigest()[:16], 16))
+def fake_destination(dest_id, paragraphs=8):
+    rnd = _rng(dest_id)
+    n = rnd.randint(max(1, paragraphs // 2), paragraphs * 2)
+    vi = "".join(f"<p><strong>Đoạn {i + 1}.</strong> Điểm đến {dest_id[-6:]} mở cửa 7:30 – 17:00, vé 50.000 đ, "
+                 f"cách trung tâm {rnd.randint(1, 90)}km, xây dựng từ thế kỷ XIX với diện tích 3.500 m².</p>" for i in range(n))
+    en = "".join(f"<p>Paragraph {i + 1}. Destination {dest_id[-6:]} is open 7:30 – 17:00 and is "
+                 f"{rnd.randint(1, 90)}km from the centre.</p>" for i in range(n))
+    return {"data": {
+        "_id": dest_id,
+        "name": f"Điểm đến {dest_id[-6:]}",
+        "content": vi,
+        "translations": {"en": {"name": f"Destination {dest_id[-6:]}", "content": en}},
+    }}
+class FakeCms:
+    """Server aiohttp giả lập api.tatinta.com. latency_ms: độ trễ trung bình mỗi request (±50%), error_rate: tỉ lệ trả 503,
+    capacity: số request đồng thời tối đa, vượt quá thì trả 429 (0 = không giới hạn) — để thử limiter tự điều chỉnh.
+    upload_mbps: băng thông upload giả lập (0 = không giới hạn) — thời gian upload tỉ lệ với dung lượng file."""
+    def __init__(self, latency_ms=50, error_rate=0.0, paragraphs=8, seed=0, capacity=0, upload_mbps=0):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.paragraphs = paragraphs
+        self.rnd = random.Random(seed)
+        self.capacity = capacity
+        self.upload_mbps = upload_mbps
+        self.active = 0
+        self.counts = {}
+        self.upload_bytes = 0
+        self.runner = None
+        self.base_url = None
+    async def _delay(self, route):
+        self.counts[route] = self.counts.get(route, 0) + 1
+        if self.capacity and self.active >= self.capacity:
+            self.counts[f"{route}_429"] = self.counts.get(f"{route}_429", 0) + 1
+            raise web.HTTPTooManyRequests(text="fake 429")
+        self.active += 1
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency * self.rnd.uniform(0.5, 1.5))
+        finally:
+            self.active -= 1
+        if self.error_rate and self.rnd.random() < self.error_rate:
+            self.counts[f"{route}_503"] = self.counts.get(f"{route}_503", 0) + 1
+            raise web.HTTPServiceUnavailable(text="fake 503")
+    async def get_destination(self, request):
+        await self._delay("get")
+        return web.json_response(fake_destination(request.match_info["dest_id"], self.paragraphs))
+    async def patch_destination(self, request):
+        await request.json()
+        await self._delay("patch")
+        return web.json_response({"data": {"_id": request.match_info["dest_id"]}})
+    async def upload_audio(self, request):
+        form = await request.post()
+        audio = form["faudio"].file.read()
+        self.upload_bytes += len(audio)
+        if self.upload_mbps:
+            await asyncio.sleep(len(audio) * 8 / (self.upload_mbps * 1e6))
+        await self._delay("upload")
+        digest = hashlib.sha1(audio).hexdigest()[:12]
+        return web.json_response({"data": {"filename": f"tmp/faudio-{digest}.mp3"}})
+    async def save_file(self, request):
+        body = await request.json()
+        await self._delay("save")
+        return web.json_response({"data": {"url": body["filename"].replace("tmp/", "audio/fake/")}})
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/v1/destination/destination/{dest_id}", self.get_destination)
+        app.router.add_patch("/v1/destination/destination/{dest_id}", self.patch_destination)
+        app.router.add_post("/v1/extra/upload/audio", self.upload_audio)
+        app.router.add_post("/v1/extra/upload/save-file", self.save_file)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+    async def stop(self):
+        await self.runner.cleanup()
+class FakeTts:
+    """Thay EdgeTTS: trả MP3 im lặng, độ dài tỉ lệ với text. first_byte_ms: trễ trước chunk đầu,
+    rtf: thời gian sinh / thời lượng audio, empty_rate: tỉ lệ trả về rỗng (giống lỗi "EdgeTTS tạo file rỗng"),
+    capacity: số stream đồng thời tối đa, vượt quá thì trả rỗng như khi EdgeTTS chặn (0 = không giới hạn)."""
+    def __init__(self, first_byte_ms=300, rtf=0.05, empty_rate=0.0, chunk_bytes=8192, seed=0, capacity=0):
+        self.first_byte = first_byte_ms / 1000
+        self.rtf = rtf
+        self.empty_rate = empty_rate
+        self.chunk_bytes = chunk_bytes
+        self.rnd = random.Random(seed)
+        self.capacity = capacity
+        self.active = 0
+        self.rejected = 0
+        self.calls = 0
+        self.chars = 0
+    async def stream(self, text, voice, rate, pitch):
+        self.calls += 1
+        self.chars += len(text)
+        await asyncio.sleep(self.first_byte)
+        if self.capacity and self.active >= self.capacity:
+            self.rejected += 1
+            return
+        if self.empty_rate and self.rnd.random() < self.empty_rate:
+            return
+        self.active += 1
+        try:
+            async for part in self._frames(text):
+                yield part
+        finally:
+            self.active -= 1
+    async def _frames(self, text):
+        data = fake_mp3(text)
+        seconds = len(data) / len(MP3_FRAME) * FRAME_SECONDS
+        n_chunks = max(1, len(data) // self.chunk_bytes)
+        per_chunk = seconds * self.rtf / n_chunks
+        frames_per_chunk = max(1, self.chunk_bytes // len(MP3_FRAME))
+        step = frames_per_chunk * len(MP3_FRAME)
+        for i in range(0, len(data), step):
+            if per_chunk:
+                await asyncio.sleep(per_chunk)
+            yield data[i:i + step]
@@ -0,0 +1 @@
+"""Lõi xử lý audio Tatinta dùng chung cho app Streamlit và CLI (python -m tatinta). Thư viện nặng import lazy."""
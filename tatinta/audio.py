@@ -0,0 +1,244 @@
+"""Mix giọng đọc với nhạc nền bằng ffmpeg. Nhạc nền được giải mã + giảm volume sẵn 1 lần cho mỗi (file, dB)."""
+import os
+import asyncio
+import shutil
+import hashlib
+import threading
+import subprocess
+from collections import OrderedDict
+from .encoding import get_profile
+BGM_CACHE_DIR = os.environ.get("TATINTA_BGM_CACHE", os.path.join(".cache", "bgm"))
+BGM_CACHE_KEEP = 8
+# Mix theo lô (chế độ file): 1 tiến trình ffmpeg mix tối đa MIX_BATCH giọng, chạy song song tối đa MIX_PROCS tiến trình
+MIX_BATCH = int(os.environ.get("TATINTA_MIX_BATCH", "8"))
+MIX_PROCS = int(os.environ.get("TATINTA_MIX_PROCS", str(os.cpu_count() or 2)))
+MIX_FILTER = "amix=inputs=2:duration=first:dropout_transition=2"
+# Process Streamlit chạy lâu, mỗi nhạc nền upload là 1 khóa mới: memo giữ LRU cỡ bằng cache WAV, lock xóa khi dựng xong
+_hash_memo = OrderedDict()
+_key_locks = {}
+_locks_guard = threading.Lock()
+def file_hash(path):
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _locks_guard:
+        if memo_key in _hash_memo:
+            _hash_memo.move_to_end(memo_key)
+            return _hash_memo[memo_key]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    with _locks_guard:
+        _hash_memo[memo_key] = h.hexdigest()
+        while len(_hash_memo) > BGM_CACHE_KEEP:
+            _hash_memo.popitem(last=False)
+    return h.hexdigest()
+def _prune_bgm_cache(keep_path):
+    files = [os.path.join(BGM_CACHE_DIR, n) for n in os.listdir(BGM_CACHE_DIR) if n.endswith(".wav")]
+    files.sort(key=lambda p: os.path.getmtime(p), reverse=True)
+    for old in files[BGM_CACHE_KEEP:]:
+        if old != keep_path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+def prepare_bgm(bgm_file, db_reduce):
+    """Trả về WAV float32 đã giảm {db_reduce} dB của nhạc nền. Đổi file hoặc kéo slider dB → khóa mới."""
+    db = -abs(db_reduce)
+    key = f"{file_hash(bgm_file)[:20]}_{db}dB"
+    out = os.path.join(BGM_CACHE_DIR, f"bgm_{key}.wav")
+    if os.path.exists(out):
+        return out
+    with _locks_guard:
+        lock = _key_locks.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            if os.path.exists(out):
+                return out
+            os.makedirs(BGM_CACHE_DIR, exist_ok=True)
+            # pid + thread: nhiều process worker dùng chung thư mục cache
+            tmp = f"{out}.{os.getpid()}.{threading.get_ident()}.tmp.wav"
+            cmd = [
+                "ffmpeg", "-y",
+                "-i", bgm_file,
+                "-af", f"volume={db}dB",
+                "-c:a", "pcm_f32le",
+                tmp
+            ]
+            try:
+                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                os.replace(tmp, out)
+            finally:
+                if os.path.exists(tmp): os.remove(tmp)
+            _prune_bgm_cache(out)
+    finally:
+        # Dựng xong (hoặc lỗi, lần sau thử lại): lượt sau đi đường os.path.exists, không giữ lock của khóa này mãi
+        with _locks_guard:
+            if _key_locks.get(key) is lock: del _key_locks[key]
+    return out
+def mix_audio(tts_file, bgm_file, output_file, db_reduce, profile=None):
+    """Mix rồi encode theo profile (tên trong encoding.PROFILES, None = mặc định). Trả về False nếu không mix được
+    (không có nhạc nền / ffmpeg lỗi) và output là bản copy giọng gốc."""
+    enc = get_profile(profile)
+    if bgm_file and os.path.exists(bgm_file):
+        try:
+            bgm_ready = prepare_bgm(bgm_file, db_reduce)
+            cmd = [
+                "ffmpeg", "-y",
+                "-i", tts_file,
+                "-stream_loop", "-1", "-i", bgm_ready,
+                "-filter_complex", f"[0:a][1:a]{MIX_FILTER}",
+                *enc.args,
+                "-f", enc.fmt, output_file
+            ]
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            return True
+        except Exception:
+            pass
+    shutil.copy2(tts_file, output_file)
+    return False
+async def stream_mix(chunks, bgm_file, db_reduce, profile=None):
+    """Chế độ streaming: chunk MP3 từ edge-tts được đẩy thẳng vào stdin của ffmpeg, audio đã mix (encode theo profile)
+    đọc từ stdout vào RAM. Trả về (bytes giọng đọc gốc, bytes đã mix) — không ghi file tạm nào.
+    Không có BGM / ffmpeg lỗi thì trả lại chính object giọng gốc (mixed is raw)."""
+    raw_parts = []
+    if not (bgm_file and os.path.exists(bgm_file)):
+        async for chunk in chunks:
+            raw_parts.append(chunk)
+        raw = b"".join(raw_parts)
+        return raw, raw
+    bgm_ready = await asyncio.to_thread(prepare_bgm, bgm_file, db_reduce)
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-y",
+        "-f", "mp3", "-i", "pipe:0",
+        "-stream_loop", "-1", "-i", bgm_ready,
+        "-filter_complex", f"[0:a][1:a]{MIX_FILTER}",
+        *get_profile(profile).args,
+        "-f", get_profile(profile).fmt, "pipe:1",
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    async def feed():
+        try:
+            async for chunk in chunks:
+                raw_parts.append(chunk)
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg chết giữa chừng → vẫn đọc hết TTS để còn fallback về giọng gốc
+            async for chunk in chunks:
+                raw_parts.append(chunk)
+        finally:
+            if not proc.stdin.is_closing():
+                proc.stdin.close()
+    try:
+        _, mixed = await asyncio.gather(feed(), proc.stdout.read())
+        returncode = await proc.wait()
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    raw = b"".join(raw_parts)
+    if returncode != 0 or not mixed:
+        return raw, raw
+    return raw, mixed
+async def mix_bytes(raw, bgm_file, db_reduce, profile=None):
+    """Mix đoạn MP3 ngắn đã có trong RAM (nghe thử). Giảm dB ngay trong filter trên file nhạc gốc thay vì prepare_bgm:
+    kéo slider sang mức mới chỉ giải mã vài giây nhạc đầu, không dựng lại WAV cả bài. ffmpeg lỗi → trả lại giọng gốc."""
+    if not (bgm_file and os.path.exists(bgm_file)): return raw
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-y",
+        "-f", "mp3", "-i", "pipe:0",
+        "-stream_loop", "-1", "-i", bgm_file,
+        "-filter_complex", f"[1:a]volume={-abs(db_reduce)}dB[bg];[0:a][bg]{MIX_FILTER}",
+        *get_profile(profile).args,
+        "-f", get_profile(profile).fmt, "pipe:1",
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    mixed, _ = await proc.communicate(raw)
+    return mixed if proc.returncode == 0 and mixed else raw
+def batch_mix_cmd(items):
+    """1 lệnh ffmpeg cho nhiều giọng: mỗi giọng có input nhạc nền riêng (WAV đã chuẩn bị, đọc gần như miễn phí) và
+    nhánh amix + encoder riêng (profile riêng) — đồ thị lọc của từng output giống hệt mix_audio nên file ra giống từng byte."""
+    cmd, graph = ["ffmpeg", "-y"], []
+    for i, (tts_file, bgm_ready, *_) in enumerate(items):
+        cmd += ["-i", tts_file, "-stream_loop", "-1", "-i", bgm_ready]
+        graph.append(f"[{2 * i}:a][{2 * i + 1}:a]{MIX_FILTER}[m{i}]")
+    cmd += ["-filter_complex", ";".join(graph)]
+    for i, (_, _, output_file, profile) in enumerate(items):
+        cmd += ["-map", f"[m{i}]", *get_profile(profile).args, "-f", get_profile(profile).fmt, output_file]
+    return cmd
+class MixBatcher:
+    """Gom các lệnh mix đến gần như cùng lúc thành lô, mỗi lô 1 tiến trình ffmpeg — trả phí khởi động ffmpeg, nạp codec
+    1 lần cho cả lô thay vì mỗi giọng. Số lô chạy song song theo số core; lô lỗi thì mix lại từng giọng như cũ.
+    Mỗi lượt batch tạo 1 instance (gắn với event loop của lượt đó)."""
+    def __init__(self, max_batch=MIX_BATCH, procs=MIX_PROCS, window=0.02):
+        self.max_batch = max(1, max_batch)
+        self.procs = max(1, procs)
+        self.window = window
+        self.batches = 0
+        self.tracks = 0
+        self.fallbacks = 0
+        self._pending = []
+        self._running = 0
+    async def mix(self, tts_file, bgm_file, output_file, db_reduce, profile=None):
+        """Cùng kết quả với mix_audio (kể cả fallback về giọng gốc khi không có nhạc nền / ffmpeg lỗi → trả về False)."""
+        if self.max_batch == 1 or not (bgm_file and os.path.exists(bgm_file)):
+            return await asyncio.to_thread(mix_audio, tts_file, bgm_file, output_file, db_reduce, profile)
+        try:
+            bgm_ready = await asyncio.to_thread(prepare_bgm, bgm_file, db_reduce)
+        except Exception:
+            return await asyncio.to_thread(mix_audio, tts_file, None, output_file, db_reduce, profile)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append(((tts_file, bgm_ready, output_file, profile), (tts_file, bgm_file, output_file, db_reduce, profile), fut))
+        # Chờ 1 nhịp ngắn để các giọng khác (ngôn ngữ còn lại, bài bên cạnh) kịp vào cùng lô
+        await asyncio.sleep(self.window)
+        self._dispatch()
+        return await fut
+    def _dispatch(self):
+        while self._pending and self._running < self.procs:
+            # Chia đều phần đang chờ cho số tiến trình còn trống, mỗi lô không quá max_batch
+            free = self.procs - self._running
+            size = min(self.max_batch, max(1, -(-len(self._pending) // free)))
+            batch, self._pending = self._pending[:size], self._pending[size:]
+            self._running += 1
+            asyncio.ensure_future(self._run(batch))
+    async def _run(self, batch):
+        try:
+            batch = [b for b in batch if not b[2].cancelled()]
+            try:
+                ok = bool(batch) and await self._run_ffmpeg([b[0] for b in batch])
+            except Exception:
+                ok = False
+            for item, single, fut in batch:
+                output_file = item[2]
+                mixed = True
+                if not (ok and os.path.exists(output_file) and os.path.getsize(output_file) > 0):
+                    # Lô lỗi (1 input hỏng làm hỏng cả lệnh): mix riêng từng giọng như trước
+                    self.fallbacks += 1
+                    try:
+                        mixed = await asyncio.to_thread(mix_audio, *single)
+                    except Exception as e:
+                        if not fut.done(): fut.set_exception(e)
+                        continue
+                if not fut.done(): fut.set_result(mixed)
+        finally:
+            for *_, fut in batch:
+                if not fut.done(): fut.cancel()
+            self._running -= 1
+            self._dispatch()
+    async def _run_ffmpeg(self, items):
+        proc = await asyncio.create_subprocess_exec(*batch_mix_cmd(items), stdout=asyncio.subprocess.DEVNULL,
+                                                    stderr=asyncio.subprocess.DEVNULL)
+        try:
+            returncode = await proc.wait()
+        except BaseException:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+        self.batches += 1
+        self.tracks += len(items)
+        return returncode == 0
+    def stats(self):
+        return {"batches": self.batches, "tracks": self.tracks, "fallbacks": self.fallbacks}
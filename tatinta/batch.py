@@ -0,0 +1,326 @@
+"""Batch theo URL CMS: fetch → normalize → synthesize → mix → upload → patch, dùng chung cho app Streamlit và benchmark."""
+import os
+import re
+import time
+import asyncio
+from .pipeline import STAGES, DEFAULT_WORKERS, Stage, StagedPipeline, PipelineAbort
+from .cms import CmsClient
+from .history import get_store, save_to_history, flush_history, lang_status
+from .tts import synthesize, synthesize_stream, fingerprint, CHUNK_CONCURRENCY
+from .text import fix_text_for_tts
+from .audio import MixBatcher, MIX_BATCH, stream_mix
+from .metrics import RunMetrics
+from .jobs import STAGE_STATE, new_worker_id
+from .limits import limiter_stats
+from .uploads import get_upload_index, upload_once
+from .encoding import RAW, get_profile, default_profiles
+STAGE_LABEL = {"fetch": "Fetch Data", "normalize": "Chuẩn hóa text", "synthesize": "EdgeTTS",
+               "mix": "Mix nhạc", "upload": "Upload", "patch": "PATCH CMS"}
+TOKEN_EXPIRED = "BỊ CHẶN: TOKEN ĐẾT HẠN!"
+FAIL_PREFIX = {"fetch": "Lệnh Fetch đứt", "normalize": "Lỗi tạo TTS", "synthesize": "Lỗi tạo TTS",
+               "mix": "Lỗi tạo TTS", "upload": "Lỗi tạo TTS", "patch": "PATCH THẤT BẠI"}
+class BatchConfig:
+    def __init__(self, token, langs, bgm_path=None, bgm_volume_db=-20, stage_workers=None, queue_size=4,
+                 streaming=True, chunk_chars=0, chunk_concurrency=CHUNK_CONCURRENCY, tmp_dir="tmp_audios", api_base=None,
+                 refresh=False, refresh_unknown=False, mix_batch=MIX_BATCH, profiles=None):
+        self.token = token
+        self.langs = langs  # [(lang_code, voice, rate, pitch), ...]
+        self.bgm_path = bgm_path
+        self.bgm_volume_db = bgm_volume_db
+        self.workers = dict(DEFAULT_WORKERS)
+        # Mix theo lô (chế độ file) cần đủ bài ở tầng mix cùng lúc mới gom được lô
+        if not streaming and mix_batch > 1:
+            self.workers["mix"] = max(self.workers["mix"], mix_batch)
+        self.workers.update(stage_workers or {})
+        self.queue_size = queue_size
+        self.streaming = streaming
+        self.chunk_chars = chunk_chars
+        self.chunk_concurrency = chunk_concurrency
+        self.tmp_dir = tmp_dir
+        self.api_base = api_base
+        # refresh: chỉ tạo lại ngôn ngữ có fingerprint khác lịch sử. refresh_unknown: coi audio cũ chưa có fingerprint là cũ
+        self.refresh = refresh
+        self.refresh_unknown = refresh_unknown
+        self.mix_batch = mix_batch
+        # {lang_code: tên profile mã hóa} — ngôn ngữ không chỉ định lấy mặc định (TATINTA_AUDIO_PROFILE / encoding.py)
+        self.profiles = {**default_profiles(), **{k: get_profile(v).name for k, v in (profiles or {}).items()}}
+    def batch_config(self):
+        """Phần cấu hình lưu cùng batch trong hàng đợi để chạy tiếp ra audio giống hệt (không lưu token)."""
+        return {"langs": [list(l) for l in self.langs], "bgm_path": self.bgm_path, "bgm_volume_db": self.bgm_volume_db,
+                "refresh": self.refresh, "refresh_unknown": self.refresh_unknown, "profiles": self.profiles}
+DEST_ID_RE = re.compile(r'([a-f0-9]{24})')
+def dest_id_of(url):
+    m = DEST_ID_RE.search(url)
+    return m.group(1) if m else None
+def fail_message(job, stage_name, e):
+    if isinstance(e, PipelineAbort) or stage_name == "patch" or "dest_id" not in job:
+        return str(e)
+    return f"{FAIL_PREFIX[stage_name]}: {e}"
+def cleanup_job_files(job):
+    for lang in job.get("langs", {}).values():
+        for f in (lang.get("raw_f"), lang.get("mix_f")):
+            if f and os.path.exists(f): os.remove(f)
+def job_key(job):
+    return job.get("dest_id", job["url"])
+def pending_langs(job):
+    """Ngôn ngữ còn phải làm — bỏ qua ngôn ngữ đã upload xong (job chạy tiếp từ hàng đợi) và ngôn ngữ không đổi (refresh)."""
+    return [(k, v) for k, v in job["langs"].items() if not v.get("url") and not v.get("unchanged")]
+def lang_sources(data):
+    """{lang_code: (title, content)} từ dữ liệu CMS của 1 bài."""
+    t_vi = data.get('name', '')
+    en = data.get('translations', {}).get('en', {})
+    return {"vi": (t_vi, data.get('content', '')), "en": (en.get('name', t_vi), en.get('content', ''))}
+def tts_text(lang_code, title, content):
+    text_tts = fix_text_for_tts(title, content)
+    if not text_tts:
+        text_tts = f"{title}...\n\nInformation about this destination will be updated soon." if lang_code == "en" else f"{title}... Chưa có nội dung."
+    return text_tts
+def build_stages(cfg, cms, metrics):
+    bgm = cfg.bgm_path if cfg.bgm_path and os.path.exists(cfg.bgm_path) else None
+    uploads = get_upload_index()
+    mixer = MixBatcher(cfg.mix_batch)
+    async def stage_fetch(job):
+        if job.get("langs"): return  # checkpoint từ hàng đợi đã có dữ liệu fetch
+        dest_id = dest_id_of(job["url"])
+        if not dest_id:
+            raise Exception("Sai format URL CMS")
+        job["dest_id"] = dest_id
+        with metrics.timer(job["dest_id"], "cms_get") as t:
+            get_resp = await cms.get_destination(job["dest_id"])
+            t["bytes"] = len(get_resp.text)
+        if get_resp.status_code in [401, 403]:
+            raise PipelineAbort(TOKEN_EXPIRED)
+        data = get_resp.json().get('data', {})
+        job["t_vi"] = data.get('name', '')
+        job["translations"] = data.get('translations', {})
+        sources = lang_sources(data)
+        job["langs"] = {}
+        for lang_code, voice, rate, pitch in cfg.langs:
+            title, content = sources[lang_code]
+            profile = get_profile(cfg.profiles.get(lang_code))
+            job["langs"][lang_code] = {"title": title, "content": content, "voice": voice, "rate": rate, "pitch": pitch,
+                                       "profile": profile.name,
+                                       "raw_f": os.path.join(cfg.tmp_dir, f"{job['dest_id']}_raw_{lang_code}.mp3"),
+                                       "mix_f": os.path.join(cfg.tmp_dir, f"{job['dest_id']}_mix_{lang_code}.{profile.ext}")}
+    async def stage_normalize(job):
+        entry = get_store().get(job["dest_id"]) if cfg.refresh else None
+        for lang_code, lang in pending_langs(job):
+            with metrics.timer(job["dest_id"], "normalize") as t:
+                lang["text"] = await asyncio.to_thread(tts_text, lang_code, lang["title"], lang["content"])
+                t["bytes"] = len(lang["text"].encode("utf-8"))
+            lang["fp"] = fingerprint(lang["text"], lang["voice"], lang["rate"], lang["pitch"])
+            if cfg.refresh:
+                status = lang_status(entry, lang_code, lang["fp"])
+                if status == "unchanged" or (status == "unknown" and not cfg.refresh_unknown):
+                    lang["unchanged"] = True
+                    lang["adopt"] = status == "unknown"
+    async def stage_synthesize(job):
+        async def one(lang_code, lang):
+            if cfg.streaming:
+                # TTS và ffmpeg chạy chồng nhau: "tts" tính tới chunk cuối, "ffmpeg" là phần ffmpeg còn chạy sau đó
+                t0 = time.perf_counter()
+                tts_end = []
+                async def timed_chunks():
+                    async for chunk in synthesize_stream(lang["text"], lang["voice"], lang["rate"], lang["pitch"],
+                                                         chunk_chars=cfg.chunk_chars, chunk_concurrency=cfg.chunk_concurrency):
+                        yield chunk
+                    tts_end.append(time.perf_counter())
+                try:
+                    raw, mixed = await stream_mix(timed_chunks(), bgm, cfg.bgm_volume_db, lang.get("profile"))
+                except Exception:
+                    metrics.record(job["dest_id"], "tts", time.perf_counter() - t0, ok=False)
+                    raise
+                end = time.perf_counter()
+                t1 = tts_end[0] if tts_end else end
+                metrics.record(job["dest_id"], "tts", t1 - t0, len(raw), ok=bool(raw))
+                if raw:
+                    metrics.record(job["dest_id"], "ffmpeg", end - t1, len(mixed))
+                if not raw:
+                    raise Exception(f"EdgeTTS tạo file rỗng (0 bytes) cho {lang_code.upper()}!")
+                lang["raw_size"] = len(raw)
+                lang["mixed"] = mixed
+                # Profile thực tế của file sẽ upload: không mix được thì là giọng gốc
+                lang["encoded"] = lang.get("profile") if mixed is not raw else RAW.name
+                return
+            raw_f = lang["raw_f"]
+            with metrics.timer(job["dest_id"], "tts") as t:
+                audio_bytes = await synthesize(lang["text"], lang["voice"], lang["rate"], lang["pitch"],
+                                               chunk_chars=cfg.chunk_chars, chunk_concurrency=cfg.chunk_concurrency)
+                t["bytes"] = len(audio_bytes)
+            with open(raw_f, "wb") as f:
+                f.write(audio_bytes)
+            lang["raw_size"] = len(audio_bytes)
+            if lang["raw_size"] == 0:
+                raise Exception(f"EdgeTTS tạo file rỗng (0 bytes) cho {lang_code.upper()}!")
+        await asyncio.gather(*(one(k, v) for k, v in pending_langs(job)))
+    async def stage_mix(job):
+        async def one(lang_code, lang):
+            if "mixed" in lang: return
+            with metrics.timer(job["dest_id"], "ffmpeg") as t:
+                mixed = await mixer.mix(lang["raw_f"], bgm, lang["mix_f"], cfg.bgm_volume_db, lang.get("profile"))
+                lang["encoded"] = lang.get("profile") if mixed else RAW.name
+                metrics.meta["mix"] = mixer.stats()
+                mix_size = os.path.getsize(lang["mix_f"]) if os.path.exists(lang["mix_f"]) else 0
+                t["bytes"] = mix_size
+            if mix_size == 0:
+                raise Exception(f"Mix audio thất bại - file rỗng (0 bytes) cho {lang_code.upper()}!")
+            if os.path.exists(lang["raw_f"]): os.remove(lang["raw_f"])
+        await asyncio.gather(*(one(k, v) for k, v in pending_langs(job)))
+    async def stage_upload(job):
+        async def one(lang_code, lang):
+            if "mixed" in lang:
+                audio_bytes = lang.pop("mixed")
+            else:
+                with open(lang["mix_f"], "rb") as f:
+                    audio_bytes = f.read()
+            lang["mix_size"] = len(audio_bytes)
+            # File y hệt đã có trên storage (chạy lại, retry, bài placeholder giống nhau) → dùng lại URL, không upload
+            enc = get_profile(lang.get("encoded"))
+            url, hit = await upload_once(cms, audio_bytes, f"{job['dest_id']}_mix_{lang_code}.{enc.ext}", index=uploads,
+                                         content_type=enc.mime, timer=lambda step: metrics.timer(job["dest_id"], step))
+            if not url:
+                raise Exception(f"Upload thất bại - server không trả về URL cho {lang_code.upper()}!")
+            lang["url"] = url
+            if hit: lang["dedup"] = True
+            if os.path.exists(lang["mix_f"]): os.remove(lang["mix_f"])
+        await asyncio.gather(*(one(k, v) for k, v in pending_langs(job)))
+    async def stage_patch(job):
+        filename_vi = job["langs"].get("vi", {}).get("url")
+        filename_en = job["langs"].get("en", {}).get("url")
+        adopt = {f"fp_{k}": v["fp"] for k, v in job["langs"].items() if v.get("adopt")}
+        if adopt:
+            get_store().set_fingerprints(job["dest_id"], **adopt)
+        if not filename_vi and not filename_en:
+            if job["langs"] and all(v.get("unchanged") for v in job["langs"].values()):
+                job["unchanged"] = True  # refresh: nội dung không đổi, không cần PATCH
+                return
+            raise Exception("Không thể up Audio")
+        payload = {"translations": job["translations"]}
+        if filename_vi: payload["audio"] = filename_vi
+        if filename_en:
+            if 'en' not in payload["translations"]: payload["translations"]["en"] = {}
+            payload["translations"]["en"]["audio"] = filename_en
+        with metrics.timer(job["dest_id"], "cms_patch") as t:
+            patch_resp = await cms.patch_destination(job["dest_id"], payload)
+            t["bytes"] = len(patch_resp.text)
+        if patch_resp.status_code != 200:
+            raise Exception(f"PATCH THẤT BẠI: {patch_resp.text}")
+        fps = {f"fp_{k}": v.get("fp") for k, v in job["langs"].items() if v.get("url")}
+        profiles = {f"profile_{k}": v.get("encoded") for k, v in job["langs"].items() if v.get("url")}
+        save_to_history(job["dest_id"], job["t_vi"], audio_vi=filename_vi, audio_en=filename_en, **fps, **profiles)
+    handlers = {"fetch": stage_fetch, "normalize": stage_normalize, "synthesize": stage_synthesize,
+                "mix": stage_mix, "upload": stage_upload, "patch": stage_patch}
+    return [Stage(name, handlers[name], cfg.workers[name]) for name in STAGES]
+def _job_sizes(job):
+    return {k: {"raw": v.get("raw_size", 0), "mix": v.get("mix_size", 0), "profile": v.get("encoded")} for k, v in job.get("langs", {}).items()}
+async def run_batch(urls, cfg, on_stage=None, on_stage_done=None, on_ok=None, on_fail=None, flush=True, metrics=None,
+                    queue=None, batch_id=None, shard=None):
+    """Chạy cả batch. on_fail nhận (job, stage, message). metrics: RunMetrics để đo từng bước (mặc định tạo mới, không ghi log).
+    queue: JobQueue để lưu tiến độ từng bài — batch_id có sẵn thì chạy tiếp batch đó (urls bỏ qua), không thì tạo batch mới từ urls.
+    shard=(i, N): 1 trong N process worker trên cùng máy cùng chạy batch này, nhận phần bài theo hash dest_id.
+    Trả về pipeline (xem .aborted khi token hết hạn, .metrics để lấy số liệu, .batch_id)."""
+    if not cfg.streaming:
+        os.makedirs(cfg.tmp_dir, exist_ok=True)
+    metrics = metrics or RunMetrics("batch")
+    worker = new_worker_id()
+    if queue is not None and batch_id is None:
+        batch_id = queue.create_batch(urls, cfg.batch_config())
+    ok_count = [0]
+    async def _user(cb, *args):
+        res = cb(*args) if cb else None
+        if asyncio.iscoroutine(res):
+            await res
+    # Ghi hàng đợi chạy trong thread: SQLite có thể chờ busy-timeout khi process worker khác đang ghi cùng jobs.db
+    async def _on_stage_done(job, stage_name, elapsed, ok):
+        if queue is not None and ok and stage_name in STAGE_STATE:
+            await asyncio.to_thread(queue.checkpoint, job, STAGE_STATE[stage_name], worker)
+        await _user(on_stage_done, job, stage_name, elapsed, ok)
+    async def _on_ok(job):
+        ok_count[0] += 1
+        metrics.finish(job_key(job), True, title=job.get("t_vi"), sizes=_job_sizes(job))
+        await _user(on_ok, job)
+    async def _on_fail(job, stage_name, e):
+        cleanup_job_files(job)
+        msg = fail_message(job, stage_name, e)
+        if queue is not None:
+            # Token hết hạn không phải lỗi của bài: trả claim lại, lần chạy tiếp (token mới) làm tiếp từ checkpoint
+            if isinstance(e, PipelineAbort): await asyncio.to_thread(queue.release, job, worker)
+            else: await asyncio.to_thread(queue.fail, job, stage_name, msg, worker)
+        metrics.finish(job_key(job), False, error=msg, stage=stage_name)
+        await _user(on_fail, job, stage_name, msg)
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(queue.lease / 4)
+            await asyncio.to_thread(queue.heartbeat, worker)
+    jobs = queue.iter_claims(batch_id, worker, shard) if queue is not None else [{"url": u} for u in urls]
+    w = cfg.workers
+    async with CmsClient(cfg.token, limit=max(w["fetch"], w["upload"], w["patch"]) * 2, api_base=cfg.api_base) as cms:
+        pipeline = StagedPipeline(build_stages(cfg, cms, metrics), queue_size=cfg.queue_size, on_stage=on_stage,
+                                  on_stage_done=_on_stage_done, on_ok=_on_ok, on_fail=_on_fail)
+        pipeline.metrics = metrics
+        pipeline.batch_id = batch_id
+        beat = asyncio.ensure_future(heartbeat()) if queue is not None else None
+        try:
+            await pipeline.run(jobs)
+        finally:
+            metrics.meta["limits"] = limiter_stats()
+            metrics.close()
+            if beat is not None:
+                beat.cancel()
+                # Bài đã claim nhưng chưa chạy (batch dừng giữa chừng) trả lại cho lần chạy sau
+                await asyncio.to_thread(queue.release_worker, worker)
+    if flush and ok_count[0]:
+        await asyncio.to_thread(flush_history, f"Update history: {ok_count[0]} URL", force=True)
+    return pipeline
+STALE_STATUS = ("changed", "missing")
+async def stale_report(urls, cfg, concurrency=8, on_progress=None):
+    """Dry-run cho chế độ refresh: fetch CMS + chuẩn hóa + so fingerprint, không TTS / upload / ghi gì.
+    Trả về list dòng {dest_id, url, title, lang, status, chars}; status xem history.lang_status (+ "error")."""
+    store = get_store()
+    sem = asyncio.Semaphore(max(1, concurrency))
+    results = {}
+    done = [0]
+    async with CmsClient(cfg.token, limit=concurrency * 2, api_base=cfg.api_base) as cms:
+        async def one(url):
+            dest_id = dest_id_of(url)
+            rows = results[url] = []
+            try:
+                if not dest_id:
+                    raise Exception("Sai format URL CMS")
+                async with sem:
+                    resp = await cms.get_destination(dest_id)
+                if resp.status_code in [401, 403]:
+                    raise PipelineAbort(TOKEN_EXPIRED)
+                if resp.status_code != 200:
+                    raise Exception(f"HTTP {resp.status_code}")
+                data = resp.json().get('data', {})
+                sources = lang_sources(data)
+                entry = store.get(dest_id)
+                for lang_code, voice, rate, pitch in cfg.langs:
+                    title, content = sources[lang_code]
+                    text = await asyncio.to_thread(tts_text, lang_code, title, content)
+                    fp = fingerprint(text, voice, rate, pitch)
+                    rows.append({"dest_id": dest_id, "url": url, "title": data.get('name', ''), "lang": lang_code,
+                                 "status": lang_status(entry, lang_code, fp), "fp": fp, "chars": len(text)})
+            except PipelineAbort:
+                raise
+            except Exception as e:
+                rows.append({"dest_id": dest_id, "url": url, "title": "", "lang": "", "status": "error", "error": str(e), "chars": 0})
+            done[0] += 1
+            if on_progress: on_progress(done[0], len(urls))
+        await asyncio.gather(*(one(u) for u in urls))
+    return [row for u in urls for row in results.get(u, [])]
+def stale_urls(rows, include_unknown=False):
+    """URL cần chạy lại từ kết quả stale_report."""
+    wanted = STALE_STATUS + (("unknown",) if include_unknown else ())
+    return list(dict.fromkeys(r["url"] for r in rows if r["status"] in wanted))
+def adopt_fingerprints(rows):
+    """Bài cũ chưa có fingerprint: coi audio hiện tại khớp nội dung hiện tại, ghi fingerprint để lần sau so được."""
+    store = get_store()
+    by_dest = {}
+    for r in rows:
+        if r["status"] == "unknown":
+            by_dest.setdefault(r["dest_id"], {})[f"fp_{r['lang']}"] = r["fp"]
+    for dest_id, fps in by_dest.items():
+        store.set_fingerprints(dest_id, **fps)
+    return len(by_dest)
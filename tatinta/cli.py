@@ -0,0 +1,268 @@
+"""Chạy batch không cần trình duyệt (cron / server): python -m tatinta urls.txt [--langs vi,en] [--bgm nhac.mp3]
+hoặc python -m tatinta --discover (tự lấy mọi bài còn thiếu audio từ CMS).
+Exit code: 0 = tất cả thành công, 1 = có bài lỗi, 2 = dừng vì token hết hạn / thiếu cấu hình."""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+TOKEN_FILE = "saved_token.txt"
+DEFAULT_BGM = "Hovering Thoughts - Spence.mp3"
+# Cùng mặc định với giao diện Streamlit
+DEFAULT_VOICE = {"vi": ("vi-VN-NamMinhNeural", 5, -10), "en": ("en-US-GuyNeural", 0, -2)}
+def read_urls(path):
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    return [u.strip() for u in lines if len(u.strip()) > 5 and not u.strip().startswith("#")]
+def read_token(args):
+    if args.token:
+        return args.token
+    if os.environ.get("TATINTA_TOKEN"):
+        return os.environ["TATINTA_TOKEN"]
+    if os.path.exists(args.token_file):
+        with open(args.token_file, "r") as f:
+            return f.read().strip()
+    return ""
+def parse_workers(items):
+    from .pipeline import STAGES
+    workers = {}
+    for item in items or []:
+        name, _, n = item.partition("=")
+        if name not in STAGES or not n.isdigit():
+            raise SystemExit(f"--workers phải có dạng <tầng>=<số>, tầng thuộc {', '.join(STAGES)}: {item!r}")
+        workers[name] = int(n)
+    return workers
+def parse_profiles_arg(spec, langs):
+    from .encoding import parse_profiles
+    try:
+        return parse_profiles(spec, langs)
+    except ValueError as e:
+        raise SystemExit(f"--profile: {e}")
+def build_parser():
+    from .encoding import PROFILES, DEFAULT_PROFILE
+    p = argparse.ArgumentParser(prog="python -m tatinta", description="Tạo audio TTS + nhạc nền cho danh sách URL Tatinta CMS.")
+    p.add_argument("urls", nargs="?", help="file chứa URL (mỗi dòng 1 URL, '-' = đọc stdin)")
+    p.add_argument("--resume", metavar="BATCH_ID", help="chạy tiếp batch dở trong hàng đợi ('last' = batch gần nhất)")
+    p.add_argument("--retry-failed", action="store_true", help="cùng --resume: đưa các bài lỗi về trạng thái tốt gần nhất rồi chạy lại")
+    p.add_argument("--list-batches", action="store_true", help="liệt kê batch chưa xong trong hàng đợi")
+    p.add_argument("--stale-report", nargs="?", const="-", metavar="FILE",
+                   help="dry-run: so fingerprint nội dung CMS hiện tại với lịch sử, in báo cáo (FILE = ghi JSON). Không có file URL thì kiểm tra toàn bộ lịch sử")
+    p.add_argument("--refresh-stale", action="store_true", help="chỉ tạo lại ngôn ngữ có nội dung / giọng đã đổi so với lịch sử")
+    p.add_argument("--discover", action="store_true", help="lấy URL từ API list của CMS: mọi bài còn thiếu audio ngôn ngữ đang chọn")
+    p.add_argument("--refresh-unknown", action="store_true", help="cùng --refresh-stale: tạo lại cả audio cũ chưa có fingerprint")
+    p.add_argument("--token", help="Bearer token (mặc định: $TATINTA_TOKEN hoặc --token-file)")
+    p.add_argument("--token-file", default=TOKEN_FILE)
+    p.add_argument("--langs", default="vi,en", help="vi,en | vi | en")
+    for lang, (voice, rate, pitch) in DEFAULT_VOICE.items():
+        p.add_argument(f"--voice-{lang}", default=voice)
+        p.add_argument(f"--rate-{lang}", type=int, default=rate, help="tốc độ (%%)")
+        p.add_argument(f"--pitch-{lang}", type=int, default=pitch, help="độ trầm (Hz)")
+    p.add_argument("--bgm", default=DEFAULT_BGM, help="file nhạc nền MP3")
+    p.add_argument("--no-bgm", action="store_true")
+    p.add_argument("--bgm-db", type=int, default=-20, help="giảm volume nhạc nền (dB)")
+    p.add_argument("--profile", metavar="PROFILE", help=f"profile mã hóa: 1 tên cho mọi ngôn ngữ hoặc vi=...,en=... "
+                                                        f"({', '.join(PROFILES)}; mặc định {DEFAULT_PROFILE} / $TATINTA_AUDIO_PROFILE)")
+    p.add_argument("--workers", action="append", metavar="TẦNG=N", help="số worker mỗi tầng, VD: --workers synthesize=8")
+    p.add_argument("--queue-size", type=int, default=4)
+    p.add_argument("--no-streaming", action="store_true", help="ghi file tạm thay vì đẩy TTS thẳng vào ffmpeg")
+    p.add_argument("--chunk-chars", type=int, default=None, help="bật chia theo đoạn (TTS song song + cache từng đoạn), N = số ký tự tối đa / segment (VD 1500); mặc định cả bài 1 request")
+    p.add_argument("--chunk-concurrency", type=int, default=None)
+    p.add_argument("--mix-batch", type=int, default=None, help="chế độ file: số giọng mix chung 1 tiến trình ffmpeg (1 = từng giọng)")
+    p.add_argument("--procs", type=int, default=1, help="chia batch cho N process worker (theo hash dest_id), tiến độ gộp lại ở đây")
+    p.add_argument("--shard", metavar="i/N", help="chạy như worker thứ i trong N (cùng --resume, cùng máy — jobs.db không dùng chung qua ổ mạng)")
+    p.add_argument("--force", action="store_true", help="chạy cả URL đã có trong lịch sử")
+    p.add_argument("--no-flush", action="store_true", help="không đồng bộ lịch sử lên GitHub sau khi chạy")
+    p.add_argument("-v", "--verbose", action="store_true", help="in từng tầng của từng bài")
+    p.add_argument("-q", "--quiet", action="store_true")
+    return p
+def child_args(args):
+    """Tham số tinh chỉnh truyền cho process worker; giọng / nhạc nền lấy từ cấu hình đã lưu cùng batch."""
+    out = ["--no-flush"]
+    for item in args.workers or []:
+        out += ["--workers", item]
+    out += ["--queue-size", str(args.queue_size)]
+    if args.no_streaming: out.append("--no-streaming")
+    for name in ("chunk_chars", "chunk_concurrency", "mix_batch"):
+        if getattr(args, name) is not None:
+            out += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    return out
+def log(args, msg):
+    if not args.quiet:
+        print(msg, file=sys.stderr, flush=True)
+async def run(args):
+    # Import lazy: --help / lỗi tham số không phải nạp aiohttp, sqlite history...
+    from .tts import CHUNK_CONCURRENCY
+    from .history import get_store, flush_history
+    from .metrics import RunMetrics, METRICS_LOG
+    from .batch import BatchConfig, run_batch, dest_id_of, stale_report, stale_urls, adopt_fingerprints, STAGE_LABEL, TOKEN_EXPIRED
+    from .audio import prepare_bgm, MIX_BATCH
+    from .jobs import get_job_queue, parse_shard
+    from .limits import limiter_stats
+    from .uploads import get_upload_index
+    from .discover import discover, cms_url
+    queue = get_job_queue()
+    if args.list_batches:
+        for b in queue.batches(unfinished=True):
+            print(f"{b['batch_id']}  {b['created_at']}  xong {b['patched']}/{b['total']}  còn {b['remaining']}  lỗi {b['failed']}")
+        return 0
+    batch_id = None
+    if args.resume:
+        if args.resume == "last":
+            unfinished = queue.batches(unfinished=True, limit=1)
+            if not unfinished:
+                log(args, "Không có batch nào đang dở")
+                return 0
+            batch_id = unfinished[0]["batch_id"]
+        else:
+            batch_id = args.resume
+        if args.retry_failed:
+            log(args, f"Đưa {queue.retry_failed(batch_id)} bài lỗi về hàng đợi")
+    elif args.shard:
+        log(args, "--shard chỉ dùng cùng --resume BATCH_ID (mọi worker chạy chung 1 batch)")
+        return 2
+    elif not args.urls and not (args.stale_report or args.refresh_stale or args.discover):
+        log(args, "Cần file URL hoặc --resume BATCH_ID")
+        return 2
+    token = read_token(args)
+    if not token:
+        log(args, "Thiếu Bearer token (--token, $TATINTA_TOKEN hoặc saved_token.txt)")
+        return 2
+    if batch_id:
+        urls = queue.remaining_urls(batch_id)
+    elif args.discover:
+        pending = await discover(token, [l.strip() for l in args.langs.split(",") if l.strip()],
+                                 on_progress=lambda d, n: log(args, f"  đọc trang {d}{f'/{n}' if n else ''}") if args.verbose else None)
+        stats = get_store().catalog_stats()
+        log(args, f"CMS có {stats['total']} bài: thiếu VI {stats['missing_vi']}, thiếu EN {stats['missing_en']}")
+        urls = [cms_url(d) for d, _, _ in pending]
+    elif args.urls:
+        urls = read_urls(args.urls)
+    else:
+        urls = [f"https://cms.tatinta.com/destination/action/{d}" for d in get_store().all_ids()]
+    if not args.force and not batch_id and not (args.stale_report or args.refresh_stale or args.discover):
+        done = get_store().get_many([d for d in map(dest_id_of, urls) if d])
+        codes = [l.strip() for l in args.langs.split(",") if l.strip()]
+        before = len(urls)
+        # Đã có trong lịch sử nhưng còn thiếu audio ngôn ngữ đang chạy thì vẫn chạy
+        urls = [u for u in urls if not (dest_id_of(u) in done and all(done[dest_id_of(u)].get(f"audio_{l}") for l in codes))]
+        if before - len(urls):
+            log(args, f"Bỏ qua {before - len(urls)} URL đã có trong lịch sử (--force để chạy lại)")
+    if not urls:
+        log(args, "Không có URL nào cần chạy")
+        return 0
+    langs = []
+    for lang in [l.strip() for l in args.langs.split(",") if l.strip()]:
+        if lang not in DEFAULT_VOICE:
+            log(args, f"Ngôn ngữ không hỗ trợ: {lang}")
+            return 2
+        langs.append((lang, getattr(args, f"voice_{lang}"), getattr(args, f"rate_{lang}"), getattr(args, f"pitch_{lang}")))
+    profiles = parse_profiles_arg(args.profile, [l[0] for l in langs])
+    bgm = None if args.no_bgm or not os.path.exists(args.bgm) else args.bgm
+    if batch_id:
+        # Batch chạy tiếp giữ nguyên giọng / nhạc nền lúc tạo để audio đồng nhất
+        stored = queue.config(batch_id)
+        langs = [tuple(l) for l in stored.get("langs", [])] or langs
+        bgm, args.bgm_db = stored.get("bgm_path", bgm), stored.get("bgm_volume_db", args.bgm_db)
+        args.refresh_stale = stored.get("refresh", args.refresh_stale)
+        args.refresh_unknown = stored.get("refresh_unknown", args.refresh_unknown)
+        profiles = stored.get("profiles") or profiles
+    elif args.stale_report or args.refresh_stale:
+        rows = await stale_report(urls, BatchConfig(token, langs),
+                                  on_progress=lambda d, n: log(args, f"  kiểm tra {d}/{n}") if args.verbose else None)
+        counts = {}
+        for r in rows:
+            counts[(r["status"], r["lang"])] = counts.get((r["status"], r["lang"]), 0) + 1
+        for (status, lang), n in sorted(counts.items()):
+            print(f"{status:<10} {lang or '-':<3} {n}")
+        for r in rows:
+            if r["status"] in ("changed", "missing", "error") or (args.refresh_unknown and r["status"] == "unknown"):
+                print(f"  {r['status']:<8} {r['lang'] or '-':<3} {r['dest_id']} {r['title'][:60]} {r.get('error', '')}")
+        if args.stale_report and args.stale_report != "-":
+            with open(args.stale_report, "w", encoding="utf-8") as f:
+                json.dump(rows, f, ensure_ascii=False, indent=2)
+        urls = stale_urls(rows, include_unknown=args.refresh_unknown)
+        log(args, f"{len(urls)} bài cần tạo lại")
+        if args.stale_report:
+            return 0
+        if not args.refresh_unknown:
+            log(args, f"Ghi nhận fingerprint cho {adopt_fingerprints(rows)} bài cũ chưa có")
+        if not urls:
+            if not args.no_flush:
+                await asyncio.to_thread(flush_history, "Update history: fingerprints", force=True)
+            return 0
+    if bgm:
+        try:
+            await asyncio.to_thread(prepare_bgm, bgm, args.bgm_db)
+        except Exception:
+            pass
+    elif not args.no_bgm:
+        log(args, f"Không thấy nhạc nền {args.bgm!r}, chạy không có BGM")
+    cfg = BatchConfig(token, langs, bgm_path=bgm, bgm_volume_db=args.bgm_db, stage_workers=parse_workers(args.workers),
+                      queue_size=args.queue_size, streaming=not args.no_streaming,
+                      chunk_chars=args.chunk_chars or 0,
+                      chunk_concurrency=args.chunk_concurrency or CHUNK_CONCURRENCY,
+                      refresh=args.refresh_stale, refresh_unknown=args.refresh_unknown,
+                      mix_batch=MIX_BATCH if args.mix_batch is None else args.mix_batch, profiles=profiles)
+    if args.procs > 1:
+        return await run_procs(args, queue, batch_id or queue.create_batch(urls, cfg.batch_config()), len(urls), token)
+    metrics = RunMetrics("cli", METRICS_LOG, meta={"langs": langs, "workers": cfg.workers, "queue_size": cfg.queue_size,
+                                                     "streaming": cfg.streaming, "chunk_chars": cfg.chunk_chars, "total": len(urls)})
+    total = len(urls)
+    done = [0]
+    def on_stage(job, stage_name):
+        log(args, f"  … {job.get('dest_id', job['url'])}: {STAGE_LABEL[stage_name]}")
+    def on_ok(job):
+        done[0] += 1
+        log(args, f"[{done[0]}/{total}] ✅ {job['dest_id']} {job.get('t_vi', '')}")
+    def on_fail(job, stage_name, msg):
+        done[0] += 1
+        log(args, f"[{done[0]}/{total}] ❌ {job.get('dest_id', job['url'])} ({stage_name}): {msg}")
+    log(args, f"Chạy {total} URL · {', '.join(l[0] for l in langs)} · BGM: {bgm or 'không'} · "
+              f"mã hóa: {', '.join(f'{l[0]}={cfg.profiles[l[0]]}' for l in langs)}")
+    t0 = time.perf_counter()
+    pipeline = await run_batch(urls, cfg, on_stage=on_stage if args.verbose else None, on_ok=on_ok, on_fail=on_fail,
+                               flush=not args.no_flush, metrics=metrics, queue=queue, batch_id=batch_id,
+                               shard=parse_shard(args.shard) if args.shard else None)
+    summary = metrics.summary()
+    log(args, f"Xong trong {time.perf_counter() - t0:.0f}s: {summary['ok']} thành công, {summary['fail']} lỗi "
+              f"({summary['per_min']:.1f} bài/phút) · log: {METRICS_LOG}")
+    dedup = get_upload_index().stats()
+    if dedup["hits"]:
+        log(args, f"Dùng lại file đã upload: {dedup['hits']} file ({dedup['bytes_saved'] / 1e6:.1f} MB không phải upload)")
+    log(args, "Giới hạn song song: " + ", ".join(f"{k} {v['limit']} (chặn {v['throttled']})" for k, v in limiter_stats().items()))
+    if pipeline.aborted:
+        log(args, f"{TOKEN_EXPIRED} Tiến độ đã lưu: python -m tatinta --resume {pipeline.batch_id}")
+        return 2
+    if summary["fail"]:
+        log(args, f"Chạy lại bài lỗi: python -m tatinta --resume {pipeline.batch_id} --retry-failed")
+    return 1 if summary["fail"] else 0
+async def run_procs(args, queue, batch_id, total, token):
+    from .history import flush_history
+    from .workers import spawn_workers, watch, exit_code
+    log_dir = os.path.join("logs", "workers")
+    procs = spawn_workers(batch_id, args.procs, token, child_args(args), log_dir=log_dir)
+    log(args, f"Batch {batch_id}: {total} URL chia cho {args.procs} process · log từng worker: {log_dir}/")
+    t0 = time.perf_counter()
+    def progress(counts, per_worker):
+        active = sum(w["active"] for w in per_worker.values())
+        log(args, f"[{counts['patched'] + counts['failed']}/{sum(counts.values())}] ✅ {counts['patched']} ❌ {counts['failed']} · "
+                  f"{active} bài đang chạy trên {sum(1 for w in per_worker.values() if w['active'])} worker")
+    counts = await watch(queue, batch_id, procs, progress)
+    log(args, f"Xong trong {time.perf_counter() - t0:.0f}s: {counts['patched']} thành công, {counts['failed']} lỗi")
+    if not args.no_flush:
+        await asyncio.to_thread(flush_history, f"Update history: {counts['patched']} URL", force=True)
+    code = exit_code(procs, counts)
+    if code == 2:
+        log(args, f"Có worker dừng giữa chừng. Tiến độ đã lưu: python -m tatinta --resume {batch_id} --procs {args.procs}")
+    elif counts["failed"]:
+        log(args, f"Chạy lại bài lỗi: python -m tatinta --resume {batch_id} --retry-failed --procs {args.procs}")
+    return code
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return asyncio.run(run(args))
+if __name__ == "__main__":
+    sys.exit(main())
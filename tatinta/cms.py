@@ -0,0 +1,104 @@
+"""Client HTTP async dùng chung cho api.tatinta.com: 1 session keep-alive, timeout, retry có jitter."""
+import os
+import json
+import random
+import asyncio
+import aiohttp
+from .limits import get_limiter
+API_BASE = os.environ.get("TATINTA_API_BASE", "https://api.tatinta.com").rstrip("/")
+CMS_BASE = "https://cms.tatinta.com"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+def clean_token(tok):
+    tok_clean = (tok or "").strip().strip('"').strip("'")
+    return tok_clean.encode('ascii', 'ignore').decode('ascii')
+def cms_headers(tok):
+    return {
+        'Origin': CMS_BASE,
+        'Referer': f'{CMS_BASE}/',
+        'Accept': 'application/json, text/plain, */*',
+        'Authorization': f'Bearer {clean_token(tok)}',
+        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
+    }
+def destination_api_url(dest_id, api_base=None):
+    return f'{api_base or API_BASE}/v1/destination/destination/{dest_id}'
+def destination_list_url(api_base=None):
+    return f'{api_base or API_BASE}/v1/destination/destination'
+class CmsResponse:
+    """Giữ giao diện giống requests.Response (status_code / text / json()) cho code gọi cũ."""
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+    def json(self):
+        return json.loads(self.text) if self.text else {}
+class CmsClient:
+    def __init__(self, tok, limit=16, timeout=60, connect_timeout=10, retries=3, backoff=0.5, api_base=None):
+        self.headers = cms_headers(tok)
+        self.api_base = (api_base or API_BASE).rstrip("/")
+        self.limit = limit
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.session = None
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, headers=self.headers)
+        return self
+    async def __aexit__(self, *exc):
+        await self.session.close()
+        self.session = None
+    async def _sleep_backoff(self, attempt):
+        delay = self.backoff * (2 ** attempt)
+        await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+    async def request(self, method, url, data_factory=None, dependency="cms_read", cost=1.0, **kwargs):
+        """Retry khi lỗi kết nối / timeout / HTTP 429 / 5xx. data_factory dựng lại body mỗi lần (FormData chỉ gửi được 1 lần).
+        Mỗi lần gửi đi qua limiter của dependency (cms_read / cms_upload / cms_write); lúc chờ backoff thì nhả slot."""
+        limiter = get_limiter(dependency)
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                async with limiter.slot(cost) as slot:
+                    if data_factory is not None:
+                        kwargs["data"] = data_factory()
+                    async with self.session.request(method, url, **kwargs) as resp:
+                        text = await resp.text()
+                        if resp.status in RETRY_STATUS:
+                            slot.throttled()
+                        elif resp.status >= 400:
+                            slot.neutral()
+                        if resp.status in RETRY_STATUS and attempt < self.retries:
+                            retry_after = resp.headers.get("Retry-After", "")
+                        else:
+                            return CmsResponse(resp.status, text)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= self.retries: raise
+            if retry_after and retry_after.isdigit():
+                await asyncio.sleep(min(int(retry_after), 60))
+            else:
+                await self._sleep_backoff(attempt)
+    async def get_destination(self, dest_id):
+        return await self.request("GET", destination_api_url(dest_id, self.api_base))
+    async def list_destinations(self, page, limit):
+        return await self.request("GET", destination_list_url(self.api_base), params={"page": page, "limit": limit})
+    async def patch_destination(self, dest_id, payload):
+        return await self.request("PATCH", destination_api_url(dest_id, self.api_base), dependency="cms_write", json=payload)
+    async def upload_audio(self, audio_bytes, filename, content_type="audio/mpeg"):
+        def form():
+            fd = aiohttp.FormData()
+            fd.add_field('faudio', audio_bytes, filename=filename, content_type=content_type)
+            return fd
+        resp = await self.request("POST", f'{self.api_base}/v1/extra/upload/audio', data_factory=form,
+                                  dependency="cms_upload", cost=max(len(audio_bytes) / 1e6, 0.05))
+        if resp.status_code in [200, 201]:
+            return resp.json().get('data', {}).get('filename')
+        raise Exception(f"Upload API lỗi HTTP {resp.status_code}: {resp.text[:200]}")
+    async def save_file(self, tmp_filename):
+        resp = await self.request("POST", f'{self.api_base}/v1/extra/upload/save-file', dependency="cms_write",
+                                  json={"filename": tmp_filename, "type": "audio"})
+        if resp.status_code in [200, 201]:
+            return resp.json().get('data', {}).get('url')
+        return tmp_filename
+    async def upload_and_save(self, audio_bytes, filename, content_type="audio/mpeg"):
+        fname = await self.upload_audio(audio_bytes, filename, content_type)
+        if not fname:
+            return None
+        return await self.save_file(fname)
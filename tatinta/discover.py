@@ -0,0 +1,67 @@
+"""Tự tìm bài còn thiếu audio: lật hết API list điểm đến của CMS (nhiều trang song song), lưu thành catalog trong
+history.db rồi so với lịch sử — thay cho việc dán URL bằng tay."""
+import os
+import asyncio
+from .cms import CmsClient, CMS_BASE
+from .history import get_store
+from .batch import DEST_ID_RE
+LIST_PAGE_SIZE = int(os.environ.get("TATINTA_LIST_PAGE_SIZE", "100"))
+# Số trang gọi cùng lúc tối đa — limiter cms_read vẫn quyết định số request thực sự bay cùng lúc
+LIST_CONCURRENCY = 8
+TOTAL_KEYS = ("total", "totalDocs", "totalItems", "totalRecords", "count")
+ITEM_KEYS = ("items", "docs", "results", "rows", "data", "list")
+def cms_url(dest_id):
+    return f"{CMS_BASE}/destination/action/{dest_id}"
+def parse_page(body):
+    """([(dest_id, title), ...], tổng số bài hoặc None). Chịu được data là list, hoặc {items|docs|results|rows: [...]}
+    với tổng nằm trong data / body / meta / pagination."""
+    data = body.get("data", body) if isinstance(body, dict) else body
+    items = data if isinstance(data, list) else []
+    total = None
+    holders = [h for h in (data, body, *(body.get(k) for k in ("meta", "pagination") if isinstance(body, dict))) if isinstance(h, dict)]
+    if isinstance(data, dict):
+        items = next((data[k] for k in ITEM_KEYS if isinstance(data.get(k), list)), [])
+        holders += [data[k] for k in ("meta", "pagination") if isinstance(data.get(k), dict)]
+    for h in holders:
+        total = next((h[k] for k in TOTAL_KEYS if isinstance(h.get(k), int)), None)
+        if total is not None: break
+    out = []
+    for item in items:
+        if not isinstance(item, dict): continue
+        dest_id = str(item.get("_id") or item.get("id") or "")
+        if DEST_ID_RE.fullmatch(dest_id):
+            out.append((dest_id, item.get("name") or ""))
+    return out, total
+async def list_all(cms, page_size=LIST_PAGE_SIZE, concurrency=LIST_CONCURRENCY, on_progress=None):
+    """Trang 1 cho biết tổng → các trang còn lại gọi song song. API không trả tổng thì lật theo đợt đến khi gặp trang thiếu."""
+    sem = asyncio.Semaphore(concurrency)
+    done = [0]
+    async def fetch(page, pages=None):
+        async with sem:
+            resp = await cms.list_destinations(page, page_size)
+        if resp.status_code != 200:
+            raise Exception(f"API list điểm đến lỗi {resp.status_code} (trang {page}): {resp.text[:200]}")
+        done[0] += 1
+        if on_progress: on_progress(done[0], pages)
+        return parse_page(resp.json())
+    items, total = await fetch(1)
+    pages = [items]
+    if total is not None:
+        n_pages = -(-total // page_size)
+        pages += [p for p, _ in await asyncio.gather(*(fetch(p, n_pages) for p in range(2, n_pages + 1)))]
+    elif len(items) >= page_size:
+        page = 2
+        while True:
+            wave = await asyncio.gather(*(fetch(p) for p in range(page, page + concurrency)))
+            pages += [p for p, _ in wave]
+            if any(len(p) < page_size for p, _ in wave): break
+            page += concurrency
+    # Bài có thể trượt giữa 2 trang khi CMS thêm bài lúc đang lật: bỏ trùng, giữ thứ tự
+    return list(dict((d, t) for page in pages for d, t in page).items())
+async def discover(token, langs=("vi", "en"), api_base=None, page_size=LIST_PAGE_SIZE, on_progress=None):
+    """Cập nhật catalog, trả về bài còn thiếu audio ở ít nhất 1 ngôn ngữ trong langs: [(dest_id, title, [thiếu]), ...]."""
+    async with CmsClient(token, api_base=api_base) as cms:
+        items = await list_all(cms, page_size, on_progress=on_progress)
+    store = get_store()
+    await asyncio.to_thread(store.set_catalog, items)
+    return store.catalog_pending(langs)
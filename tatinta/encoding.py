@@ -0,0 +1,42 @@
+"""Profile mã hóa audio đầu ra (sau khi mix nhạc nền). Giọng đọc trên nền nhạc nhỏ không cần MP3 128 kbps stereo:
+mono bitrate thấp / AAC / Opus giảm dung lượng upload + lưu trữ và thời gian encode. Mặc định vẫn MP3 128 kbps
+stereo như trước; chọn profile khác cho từng ngôn ngữ qua TATINTA_AUDIO_PROFILE / --profile / giao diện. Profile thực tế
+của từng file được ghi vào lịch sử."""
+import os
+class Profile:
+    def __init__(self, name, args, ext, fmt, mime, label):
+        self.name = name
+        self.args = args     # tham số encoder ffmpeg
+        self.ext = ext       # đuôi file upload lên CMS
+        self.fmt = fmt       # muxer khi ghi ra pipe (chế độ streaming)
+        self.mime = mime
+        self.label = label
+PROFILES = {p.name: p for p in (
+    Profile("mp3_128k", ["-c:a", "libmp3lame", "-b:a", "128k"], "mp3", "mp3", "audio/mpeg", "MP3 128 kbps stereo (mặc định)"),
+    Profile("mp3_64k_mono", ["-c:a", "libmp3lame", "-b:a", "64k", "-ac", "1"], "mp3", "mp3", "audio/mpeg", "MP3 64 kbps mono"),
+    Profile("mp3_48k_mono", ["-c:a", "libmp3lame", "-b:a", "48k", "-ac", "1", "-ar", "24000"], "mp3", "mp3", "audio/mpeg",
+            "MP3 48 kbps mono 24 kHz (như giọng gốc EdgeTTS)"),
+    # Không có MP3 VBR: streaming ghi ra pipe, ffmpeg không quay lại ghi header Xing → sai thời lượng, tua lỗi trên trình duyệt
+    # AAC / Opus: chỉ chọn khi trình phát của CMS / app đọc được định dạng này
+    Profile("aac_48k_mono", ["-c:a", "aac", "-b:a", "48k", "-ac", "1"], "aac", "adts", "audio/aac", "AAC-LC 48 kbps mono"),
+    Profile("opus_32k_mono", ["-c:a", "libopus", "-b:a", "32k", "-ac", "1"], "opus", "ogg", "audio/ogg", "Opus 32 kbps mono"),
+)}
+# Không có nhạc nền / mix lỗi: upload nguyên giọng gốc EdgeTTS (MP3 24 kHz mono 48 kbps), không encode lại
+RAW = Profile("tts", [], "mp3", "mp3", "audio/mpeg", "Giọng gốc EdgeTTS (không mix)")
+DEFAULT_PROFILE = "mp3_128k"
+def get_profile(name):
+    if not name: return PROFILES[DEFAULT_PROFILE]
+    if name == RAW.name: return RAW
+    if name not in PROFILES:
+        raise ValueError(f"Profile mã hóa không tồn tại: {name} (có: {', '.join(PROFILES)})")
+    return PROFILES[name]
+def parse_profiles(spec, langs=("vi", "en")):
+    """"mp3_64k_mono" (mọi ngôn ngữ) hoặc "vi=mp3_64k_mono,en=opus_32k_mono" → {lang: tên profile}."""
+    out = {}
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        lang, _, name = part.rpartition("=")
+        for code in ([lang] if lang else langs):
+            out[code] = get_profile(name).name
+    return out
+def default_profiles(langs=("vi", "en")):
+    return {**{l: DEFAULT_PROFILE for l in langs}, **parse_profiles(os.environ.get("TATINTA_AUDIO_PROFILE", ""), langs)}
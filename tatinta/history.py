@@ -0,0 +1,360 @@
+"""Lịch sử URL đã xử lý: SQLite cục bộ (upsert O(1) mỗi bài) + đồng bộ lên GitHub theo shard (xem remote.py), gộp thành
+1 commit mỗi khoảng flush. processed_urls.json chỉ còn là bản export cục bộ / định dạng cũ để migrate."""
+import os
+import sys
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from .search import HistoryIndex
+from .remote import GitHubShards, shard_of
+HISTORY_FILE = "processed_urls.json"
+HISTORY_DB = os.environ.get("TATINTA_HISTORY_DB", "history.db")
+GITHUB_REPO = "danielnguyen241/tatinta-audio-tool"
+FIELDS = ("title", "ran_at", "audio_vi", "audio_en", "fp_vi", "fp_en", "profile_vi", "profile_en")
+# fp_<lang>: fingerprint text đã chuẩn hóa + giọng đọc của audio hiện tại (xem tts.fingerprint). Bài cũ chưa có thì bỏ trống.
+# profile_<lang>: profile mã hóa của file audio đó (xem encoding.py), "tts" = giọng gốc không mix.
+OPTIONAL_FIELDS = ("fp_vi", "fp_en", "profile_vi", "profile_en")
+COLUMNS = ", ".join(FIELDS)
+REMOTE_TTL = float(os.environ.get("TATINTA_HISTORY_TTL", "60"))
+# Gộp các lần flush gần nhau thành 1 commit GitHub mỗi khoảng này (giây)
+FLUSH_INTERVAL = float(os.environ.get("TATINTA_HISTORY_FLUSH_INTERVAL", "30"))
+# TATINTA_GITHUB_SYNC=0: chỉ dùng store cục bộ, không đọc / ghi GitHub (chạy offline, benchmark)
+GITHUB_SYNC = os.environ.get("TATINTA_GITHUB_SYNC", "1") != "0"
+def _get_github_token():
+    # Chỉ đọc st.secrets khi đang chạy trong app Streamlit — CLI không phải import streamlit chỉ để lấy token
+    if "streamlit" in sys.modules:
+        try:
+            import streamlit as st
+            return st.secrets.get("GITHUB_TOKEN", "")
+        except:
+            pass
+    return os.environ.get("GITHUB_TOKEN", "")
+def _github_headers(gh_token):
+    headers = {"Accept": "application/vnd.github.v3+json"}
+    if gh_token:
+        headers["Authorization"] = f"token {gh_token}"
+    return headers
+class HistoryStore:
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS history (
+            dest_id TEXT PRIMARY KEY, title TEXT, ran_at TEXT, audio_vi TEXT, audio_en TEXT, fp_vi TEXT, fp_en TEXT,
+            profile_vi TEXT, profile_en TEXT)""")
+        existing = {r[1] for r in self._conn.execute("PRAGMA table_info(history)")}
+        for col in OPTIONAL_FIELDS:
+            if col not in existing:
+                self._conn.execute(f"ALTER TABLE history ADD COLUMN {col} TEXT")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._init_counts()
+        # Danh sách bài lấy từ API list của CMS (xem discover.py) — so với history ra số bài còn thiếu audio
+        self._conn.execute("CREATE TABLE IF NOT EXISTS catalog (dest_id TEXT PRIMARY KEY, title TEXT)")
+        # Shard có thay đổi chưa đẩy lên GitHub (ver tăng mỗi lần ghi) + sha blob của từng shard đã gộp từ GitHub
+        self._conn.execute("CREATE TABLE IF NOT EXISTS dirty_shards (shard TEXT PRIMARY KEY, ver INTEGER)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS remote_shards (shard TEXT PRIMARY KEY, sha TEXT)")
+        self._index = None
+        self._pending_cache = (None, None)
+    def _init_counts(self):
+        # Số liệu tổng cập nhật bằng trigger theo từng dòng ghi — stats() không phải quét cả bảng
+        has = lambda col: f"(COALESCE({col}, '') != '')"
+        self._conn.execute("CREATE TABLE IF NOT EXISTS history_counts (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER, has_vi INTEGER, has_en INTEGER)")
+        self._conn.execute(f"""CREATE TRIGGER IF NOT EXISTS history_count_ins AFTER INSERT ON history BEGIN
+            UPDATE history_counts SET total=total+1, has_vi=has_vi+{has('NEW.audio_vi')}, has_en=has_en+{has('NEW.audio_en')}; END""")
+        self._conn.execute(f"""CREATE TRIGGER IF NOT EXISTS history_count_del AFTER DELETE ON history BEGIN
+            UPDATE history_counts SET total=total-1, has_vi=has_vi-{has('OLD.audio_vi')}, has_en=has_en-{has('OLD.audio_en')}; END""")
+        self._conn.execute(f"""CREATE TRIGGER IF NOT EXISTS history_count_upd AFTER UPDATE OF audio_vi, audio_en ON history BEGIN
+            UPDATE history_counts SET has_vi=has_vi+{has('NEW.audio_vi')}-{has('OLD.audio_vi')},
+            has_en=has_en+{has('NEW.audio_en')}-{has('OLD.audio_en')}; END""")
+        # DB cũ (chưa có bảng đếm): đếm 1 lần
+        self._conn.execute(f"""INSERT OR IGNORE INTO history_counts(id, total, has_vi, has_en)
+            SELECT 0, COUNT(*), COUNT(NULLIF(audio_vi, '')), COUNT(NULLIF(audio_en, '')) FROM history""")
+    def _mark_dirty(self, dest_ids):
+        self._conn.executemany("INSERT INTO dirty_shards(shard, ver) VALUES(?, 1) ON CONFLICT(shard) DO UPDATE SET ver=ver+1",
+                               [(shard_of(d),) for d in dest_ids])
+    @property
+    def dirty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM dirty_shards LIMIT 1").fetchone() is not None
+    def dirty_shards(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT shard, ver FROM dirty_shards ORDER BY shard"))
+    def clear_dirty(self, shards):
+        """Chỉ xóa shard không bị ghi thêm kể từ lúc đọc {shard: ver} — bài ghi trong lúc đang đẩy sẽ đi lần sau."""
+        with self._lock:
+            self._conn.executemany("DELETE FROM dirty_shards WHERE shard=? AND ver=?", list(shards.items()))
+    def mark_all_dirty(self):
+        with self._lock:
+            self._conn.execute("""INSERT INTO dirty_shards(shard, ver) SELECT DISTINCT lower(substr(dest_id, -2)), 1 FROM history WHERE true
+                ON CONFLICT(shard) DO UPDATE SET ver=ver+1""")
+    def remote_shards(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT shard, sha FROM remote_shards"))
+    def set_remote_shards(self, shas):
+        with self._lock:
+            self._conn.executemany("INSERT INTO remote_shards(shard, sha) VALUES(?, ?) ON CONFLICT(shard) DO UPDATE SET sha=excluded.sha",
+                                   list(shas.items()))
+    def shard_entries(self, shard):
+        with self._lock:
+            rows = self._conn.execute(f"SELECT dest_id, {COLUMNS} FROM history WHERE lower(substr(dest_id, -2))=? ORDER BY dest_id",
+                                      (shard,)).fetchall()
+        return {r[0]: self._row(r[1:]) for r in rows}
+    def _touch(self, dest_ids):
+        if self._index is not None: self._index.touch(dest_ids)
+    def _row(self, row):
+        entry = dict(zip(FIELDS, row))
+        for col in OPTIONAL_FIELDS:
+            if entry[col] is None: del entry[col]
+        return entry
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else default
+    def set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT INTO meta(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, value))
+    def upsert(self, dest_id, title, audio_vi=None, audio_en=None, ran_at=None, fp_vi=None, fp_en=None, profile_vi=None, profile_en=None):
+        """Ngôn ngữ không truyền audio (chỉ chạy lại 1 thứ tiếng) thì giữ nguyên audio + fingerprint + profile cũ — bài CMS vẫn còn audio đó."""
+        ran_at = ran_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            # 1 transaction: process chết giữa chừng thì không có chuyện dòng đã đổi mà shard không được đánh dấu cần đồng bộ
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(f"""INSERT INTO history(dest_id, title, ran_at, audio_vi, audio_en, fp_vi, fp_en, profile_vi, profile_en)
+                    VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(dest_id) DO UPDATE SET title=excluded.title, ran_at=excluded.ran_at,
+                    audio_vi=COALESCE(excluded.audio_vi, history.audio_vi), audio_en=COALESCE(excluded.audio_en, history.audio_en),
+                    fp_vi=CASE WHEN excluded.audio_vi IS NULL THEN history.fp_vi ELSE excluded.fp_vi END,
+                    fp_en=CASE WHEN excluded.audio_en IS NULL THEN history.fp_en ELSE excluded.fp_en END,
+                    profile_vi=CASE WHEN excluded.audio_vi IS NULL THEN history.profile_vi ELSE excluded.profile_vi END,
+                    profile_en=CASE WHEN excluded.audio_en IS NULL THEN history.profile_en ELSE excluded.profile_en END""",
+                                   (dest_id, title, ran_at, audio_vi, audio_en, fp_vi, fp_en, profile_vi, profile_en))
+                self._mark_dirty([dest_id])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._touch([dest_id])
+    def set_fingerprints(self, dest_id, fp_vi=None, fp_en=None):
+        """Ghi nhận fingerprint cho audio đang có (bài cũ chưa có fingerprint) — không đổi ran_at / audio."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                changed = self._conn.execute("UPDATE history SET fp_vi=COALESCE(?, fp_vi), fp_en=COALESCE(?, fp_en) WHERE dest_id=?",
+                                             (fp_vi, fp_en, dest_id)).rowcount
+                if changed: self._mark_dirty([dest_id])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return changed
+    def merge(self, entries):
+        """Gộp dict {dest_id: entry} từ nguồn khác — chỉ ghi đè khi bên kia mới hơn (theo ran_at)."""
+        rows = [(did, e.get("title"), e.get("ran_at") or "", e.get("audio_vi"), e.get("audio_en"), e.get("fp_vi"), e.get("fp_en"),
+                 e.get("profile_vi"), e.get("profile_en")) for did, e in entries.items()]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            # rowcount chứ không phải total_changes: total_changes tính cả dòng history_counts do trigger cập nhật
+            changed = self._conn.executemany("""INSERT INTO history(dest_id, title, ran_at, audio_vi, audio_en, fp_vi, fp_en, profile_vi, profile_en)
+                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(dest_id) DO UPDATE SET title=excluded.title, ran_at=excluded.ran_at,
+                audio_vi=excluded.audio_vi, audio_en=excluded.audio_en, fp_vi=excluded.fp_vi, fp_en=excluded.fp_en,
+                profile_vi=excluded.profile_vi, profile_en=excluded.profile_en
+                WHERE excluded.ran_at > history.ran_at""", rows).rowcount
+            # Cùng ran_at: chỉ bổ sung fingerprint còn thiếu (set_fingerprints không đổi ran_at)
+            changed += self._conn.executemany("""UPDATE history SET fp_vi=COALESCE(fp_vi, ?), fp_en=COALESCE(fp_en, ?)
+                WHERE dest_id=? AND ran_at=? AND ((fp_vi IS NULL AND ? IS NOT NULL) OR (fp_en IS NULL AND ? IS NOT NULL))""",
+                                              [(r[5], r[6], r[0], r[2], r[5], r[6]) for r in rows if r[5] or r[6]]).rowcount
+            self._conn.execute("COMMIT")
+        # Ngoài lock của store: chỉ mục giữ lock riêng rồi đọc lại store (tránh khóa chéo)
+        if changed: self._touch([r[0] for r in rows])
+        return changed
+    def get(self, dest_id):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {COLUMNS} FROM history WHERE dest_id=?", (dest_id,)).fetchone()
+        return self._row(row) if row else None
+    def get_many(self, dest_ids):
+        dest_ids = list(dict.fromkeys(dest_ids))
+        found = {}
+        with self._lock:
+            for i in range(0, len(dest_ids), 500):
+                part = dest_ids[i:i + 500]
+                q = f"SELECT dest_id, {COLUMNS} FROM history WHERE dest_id IN ({','.join('?' * len(part))})"
+                for row in self._conn.execute(q, part):
+                    found[row[0]] = self._row(row[1:])
+        return found
+    def __contains__(self, dest_id):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM history WHERE dest_id=?", (dest_id,)).fetchone() is not None
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+    def stats(self):
+        with self._lock:
+            total, has_vi, has_en = self._conn.execute("SELECT total, has_vi, has_en FROM history_counts").fetchone()
+        return {"total": total, "has_vi": has_vi, "has_en": has_en}
+    def index_rows(self, dest_ids=None):
+        """(dest_id, (title, ran_at, có VI, có EN)) cho chỉ mục tìm kiếm — cả bảng hoặc chỉ các bài vừa ghi."""
+        q = "SELECT dest_id, title, ran_at, COALESCE(audio_vi, '') != '', COALESCE(audio_en, '') != '' FROM history"
+        with self._lock:
+            if dest_ids is None:
+                rows = self._conn.execute(q).fetchall()
+            else:
+                dest_ids, rows = list(dest_ids), []
+                for i in range(0, len(dest_ids), 500):
+                    part = dest_ids[i:i + 500]
+                    rows += self._conn.execute(f"{q} WHERE dest_id IN ({','.join('?' * len(part))})", part).fetchall()
+        return [(r[0], (r[1] or "", r[2] or "", bool(r[3]), bool(r[4]))) for r in rows]
+    def set_catalog(self, items, discovered_at=None):
+        """Thay toàn bộ catalog bằng kết quả discovery mới nhất: [(dest_id, title), ...]."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM catalog")
+            self._conn.executemany("INSERT OR REPLACE INTO catalog(dest_id, title) VALUES(?, ?)", items)
+            self._conn.execute("COMMIT")
+            self.set_meta("catalog_at", discovered_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            self._pending_cache = (None, None)
+    def catalog_pending(self, langs=("vi", "en")):
+        """Bài trong catalog còn thiếu audio ở ít nhất 1 ngôn ngữ: [(dest_id, title, [ngôn ngữ thiếu]), ...]."""
+        with self._lock:
+            rows = self._conn.execute("""SELECT c.dest_id, COALESCE(NULLIF(c.title, ''), h.title), COALESCE(h.audio_vi, '') = '', COALESCE(h.audio_en, '') = ''
+                FROM catalog c LEFT JOIN history h ON h.dest_id = c.dest_id ORDER BY c.rowid""").fetchall()
+        out = []
+        for dest_id, title, miss_vi, miss_en in rows:
+            missing = [l for l, miss in (("vi", miss_vi), ("en", miss_en)) if miss and l in langs]
+            if missing: out.append((dest_id, title or "", missing))
+        return out
+    def catalog_stats(self):
+        """{"total", "pending", "missing_vi", "missing_en", "at"} hoặc None nếu chưa discovery lần nào.
+        Chỉ đếm lại khi history / catalog đổi (khóa = dòng history_counts + thời điểm discovery)."""
+        at = self.get_meta("catalog_at")
+        if not at: return None
+        key = (tuple(self.stats().values()), at)
+        with self._lock:
+            if self._pending_cache[0] == key: return self._pending_cache[1]
+            total, pending, miss_vi, miss_en = self._conn.execute("""SELECT COUNT(*),
+                COALESCE(SUM(COALESCE(h.audio_vi, '') = '' OR COALESCE(h.audio_en, '') = ''), 0),
+                COALESCE(SUM(COALESCE(h.audio_vi, '') = ''), 0), COALESCE(SUM(COALESCE(h.audio_en, '') = ''), 0)
+                FROM catalog c LEFT JOIN history h ON h.dest_id = c.dest_id""").fetchone()
+            result = {"total": total, "pending": pending, "missing_vi": miss_vi, "missing_en": miss_en, "at": at}
+            self._pending_cache = (key, result)
+        return result
+    def search_index(self):
+        with self._lock:
+            if self._index is None:
+                self._index = HistoryIndex(self)
+            return self._index
+    def page(self, offset=0, limit=5):
+        with self._lock:
+            rows = self._conn.execute(f"SELECT dest_id, {COLUMNS} FROM history ORDER BY rowid LIMIT ? OFFSET ?", (limit, offset)).fetchall()
+        return [(r[0], self._row(r[1:])) for r in rows]
+    def all_ids(self):
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT dest_id FROM history ORDER BY rowid")]
+    def to_dict(self):
+        with self._lock:
+            rows = self._conn.execute(f"SELECT dest_id, {COLUMNS} FROM history ORDER BY rowid").fetchall()
+        return {r[0]: self._row(r[1:]) for r in rows}
+    def import_json(self, path=HISTORY_FILE):
+        if not os.path.exists(path): return 0
+        with open(path, "r", encoding="utf-8") as f:
+            return self.merge(json.load(f))
+    def export_json(self, path=HISTORY_FILE):
+        json_str = json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json_str)
+        return json_str
+def _remote_headers():
+    return _github_headers(_get_github_token())
+_remote = GitHubShards(GITHUB_REPO, legacy_file=HISTORY_FILE, ttl=REMOTE_TTL, headers=_remote_headers)
+_store = None
+_store_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_flush_state = {"last": 0.0, "timer": None, "message": None}
+def refresh_remote(force=False):
+    """Gộp các shard trên GitHub đã đổi vào store nếu đã hết TTL và nhánh có commit mới."""
+    if not GITHUB_SYNC: return False
+    return bool(_remote.pull(get_store(), force=force))
+def refresh_remote_in_background():
+    """Không bắt trang phải chờ GitHub: hết TTL thì làm mới ở thread nền, lần render sau sẽ thấy."""
+    if not GITHUB_SYNC or _remote.is_fresh() or _remote._refreshing: return
+    _remote._refreshing = True
+    def _run():
+        try:
+            refresh_remote()
+        finally:
+            _remote._refreshing = False
+    threading.Thread(target=_run, daemon=True).start()
+def get_store():
+    """Store dùng chung cả process. Lần đầu: import processed_urls.json một lần, rồi gộp bản trên GitHub."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = HistoryStore()
+                if not store.get_meta("json_imported"):
+                    try:
+                        store.import_json()
+                    except:
+                        pass
+                    store.set_meta("json_imported", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                if GITHUB_SYNC:
+                    _remote.pull(store, force=True)
+                _store = store
+    else:
+        refresh_remote_in_background()
+    return _store
+def load_history():
+    """Export toàn bộ lịch sử thành dict (giống định dạng processed_urls.json)."""
+    return get_store().to_dict()
+def save_to_history(dest_id, title, audio_vi=None, audio_en=None, fp_vi=None, fp_en=None, profile_vi=None, profile_en=None):
+    get_store().upsert(dest_id, title, audio_vi=audio_vi, audio_en=audio_en, fp_vi=fp_vi, fp_en=fp_en,
+                       profile_vi=profile_vi, profile_en=profile_en)
+def lang_status(entry, lang_code, fp):
+    """So fingerprint hiện tại với audio đã có: missing (chưa có audio) | unknown (audio cũ chưa lưu fingerprint)
+    | changed (nội dung / giọng đã đổi) | unchanged."""
+    if not entry or not entry.get(f"audio_{lang_code}"): return "missing"
+    old = entry.get(f"fp_{lang_code}")
+    if not old: return "unknown"
+    return "unchanged" if old == fp else "changed"
+def flush_history(message="Update history", force=False):
+    """Đẩy các shard đã đổi lên GitHub (1 commit). Gọi dày (mỗi bài upload tay, mỗi batch) cũng chỉ ra tối đa
+    1 commit mỗi FLUSH_INTERVAL: gọi trong khoảng đó thì hẹn 1 lần đẩy ở thread nền. force=True: đẩy ngay (CLI sắp thoát)."""
+    store = get_store()
+    if not store.dirty: return False
+    with _flush_lock:
+        _flush_state["message"] = message
+        wait = FLUSH_INTERVAL - (time.time() - _flush_state["last"])
+        if not force and wait > 0:
+            if _flush_state["timer"] is None:
+                timer = threading.Timer(wait, _flush_deferred)
+                timer.daemon = True
+                _flush_state["timer"] = timer
+                timer.start()
+            return False
+    return _flush_now()
+def _flush_deferred():
+    with _flush_lock:
+        _flush_state["timer"] = None
+    _flush_now()
+def _flush_now():
+    store = get_store()
+    gh_token = _get_github_token() if GITHUB_SYNC else ""
+    with _flush_lock:
+        _flush_state["last"] = time.time()
+        message = _flush_state["message"] or "Update history"
+    if not gh_token:
+        dirty = store.dirty_shards()
+        store.export_json()
+        store.clear_dirty(dirty)
+        return True
+    try:
+        return _remote.push(store, message)
+    except Exception:
+        # Lỗi mạng / API: shard vẫn dirty, lần flush sau đẩy tiếp
+        _remote.invalidate()
+        return False
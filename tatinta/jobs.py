@@ -0,0 +1,191 @@
+"""Hàng đợi batch bền trên đĩa (SQLite): mỗi bài đi qua pending → fetched → synthesized → uploaded → patched (hoặc failed).
+Refresh trình duyệt, token hết hạn, container restart... đều chạy tiếp được từ tầng đã xong gần nhất, không upload lại.
+Audio đã mix không lưu trong queue: chạy lại từ "fetched"/"synthesized" chỉ tốn đọc cache TTS + mix lại."""
+import os
+import re
+import json
+import zlib
+import time
+import uuid
+import socket
+import asyncio
+import sqlite3
+import threading
+from datetime import datetime
+JOBS_DB = os.environ.get("TATINTA_JOBS_DB", "jobs.db")
+STATES = ["pending", "fetched", "synthesized", "uploaded", "patched", "failed"]
+STATE_RANK = {s: i for i, s in enumerate(STATES)}
+# Tầng pipeline xong → trạng thái checkpoint (normalize rẻ, chạy lại luôn)
+STAGE_STATE = {"fetch": "fetched", "mix": "synthesized", "upload": "uploaded", "patch": "patched"}
+# Claim hết hạn nếu worker không heartbeat / checkpoint trong khoảng này (worker chết, tab bị đóng...)
+LEASE_SECONDS = float(os.environ.get("TATINTA_JOB_LEASE", "120"))
+# Không lưu vào checkpoint: bytes audio trong RAM và text chuẩn hóa (tính lại được)
+VOLATILE_LANG_KEYS = ("mixed", "text")
+PARTITIONS = 1024
+DEST_ID_RE = re.compile(r'([a-f0-9]{24})')
+def partition_of(url):
+    """Phân vùng cố định theo hash dest_id: worker i/N nhận các bài có partition % N == i."""
+    m = DEST_ID_RE.search(url)
+    return zlib.crc32((m.group(1) if m else url).encode()) % PARTITIONS
+def parse_shard(text):
+    """'2/4' → (2, 4)."""
+    i, n = (int(x) for x in text.split("/"))
+    if not 0 <= i < n: raise ValueError(f"shard {text!r}: cần 0 <= i < N")
+    return i, n
+def new_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+def _job_data(job):
+    data = {k: v for k, v in job.items() if k not in ("url", "batch_id", "state")}
+    if "langs" in data:
+        data["langs"] = {code: {k: v for k, v in lang.items() if k not in VOLATILE_LANG_KEYS} for code, lang in data["langs"].items()}
+    return json.dumps(data, ensure_ascii=False)
+class JobQueue:
+    def __init__(self, path=JOBS_DB, lease=LEASE_SECONDS):
+        self.path = path
+        self.lease = lease
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        # Chỉ dùng chung giữa các process trên cùng 1 máy: khóa SQLite trên ổ mạng (NFS / SMB) không tin được, claim có thể trùng
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS batches (
+            batch_id TEXT PRIMARY KEY, created_at TEXT, config TEXT, total INTEGER)""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            batch_id TEXT, url TEXT, seq INTEGER, state TEXT, resume_state TEXT, stage TEXT, error TEXT, data TEXT,
+            claimed_by TEXT, claimed_at REAL, attempts INTEGER DEFAULT 0, updated_at TEXT,
+            PRIMARY KEY (batch_id, url))""")
+        existing = {r[1] for r in self._conn.execute("PRAGMA table_info(jobs)")}
+        # part: phân vùng theo hash dest_id; worker: process worker (cùng máy) ghi trạng thái gần nhất (gộp tiến độ theo worker)
+        for col, typ in (("part", "INTEGER"), ("worker", "TEXT")):
+            if col not in existing:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {col} {typ}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs(batch_id, state, seq)")
+    def _now(self):
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    def create_batch(self, urls, config=None, batch_id=None):
+        batch_id = batch_id or f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        urls = list(dict.fromkeys(u.strip() for u in urls if u.strip()))
+        now = self._now()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("INSERT OR IGNORE INTO batches(batch_id, created_at, config, total) VALUES(?, ?, ?, ?)",
+                               (batch_id, now, json.dumps(config or {}, ensure_ascii=False), len(urls)))
+            self._conn.executemany("INSERT OR IGNORE INTO jobs(batch_id, url, seq, state, data, updated_at, part) VALUES(?, ?, ?, 'pending', '{}', ?, ?)",
+                                   [(batch_id, u, i, now, partition_of(u)) for i, u in enumerate(urls)])
+            self._conn.execute("COMMIT")
+        return batch_id
+    def claim(self, batch_id, worker, shard=None):
+        """Lấy bài tiếp theo chưa xong và chưa ai giữ (hoặc claim cũ đã hết hạn). Trả về job dict hoặc None.
+        shard=(i, N): ưu tiên bài thuộc phân vùng của mình; hết phần mình thì giúp phần còn lại (worker chậm / chết)."""
+        now = time.time()
+        free = """SELECT url, state, data FROM jobs WHERE batch_id=? AND state NOT IN ('patched', 'failed')
+            AND (claimed_by IS NULL OR claimed_at < ?)"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = None
+                if shard and shard[1] > 1:
+                    row = self._conn.execute(f"{free} AND (part IS NULL OR part % ? = ?) ORDER BY seq LIMIT 1",
+                                             (batch_id, now - self.lease, shard[1], shard[0])).fetchone()
+                if not row:
+                    row = self._conn.execute(f"{free} ORDER BY seq LIMIT 1", (batch_id, now - self.lease)).fetchone()
+                if row:
+                    self._conn.execute("UPDATE jobs SET claimed_by=?, claimed_at=?, attempts=attempts+1 WHERE batch_id=? AND url=?",
+                                       (worker, now, batch_id, row[0]))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if not row: return None
+        job = json.loads(row[2] or "{}")
+        job.update({"url": row[0], "batch_id": batch_id, "state": row[1]})
+        return job
+    async def iter_claims(self, batch_id, worker, shard=None):
+        """Async generator cho StagedPipeline: claim từng bài ngay lúc pipeline còn chỗ nhận (không giữ trước cả batch).
+        claim chạy trong thread: BEGIN IMMEDIATE có thể chờ busy-timeout khi worker khác đang ghi, không được chặn event loop."""
+        while True:
+            job = await asyncio.to_thread(self.claim, batch_id, worker, shard)
+            if job is None: return
+            yield job
+    def _update(self, job, worker, sql, params):
+        # Chỉ ghi khi mình vẫn đang giữ claim — worker mất lease (bị coi là chết) không ghi đè kết quả của worker khác
+        with self._lock:
+            cur = self._conn.execute(f"UPDATE jobs SET {sql}, updated_at=?, worker=? WHERE batch_id=? AND url=? AND claimed_by=?",
+                                     (*params, self._now(), worker, job["batch_id"], job["url"], worker))
+            return cur.rowcount > 0
+    def checkpoint(self, job, state, worker):
+        """Ghi trạng thái + dữ liệu (translations, URL audio đã upload...) sau mỗi tầng xong. Chỉ đi tiến, không lùi."""
+        if STATE_RANK[state] < STATE_RANK.get(job.get("state", "pending"), 0): return False
+        job["state"] = state
+        release = state == "patched"
+        return self._update(job, worker, "state=?, data=?, claimed_at=?, claimed_by=CASE WHEN ? THEN NULL ELSE claimed_by END",
+                            (state, _job_data(job), time.time(), release))
+    def fail(self, job, stage, error, worker):
+        """Đánh dấu failed nhưng giữ dữ liệu + trạng thái tốt gần nhất để retry chạy tiếp từ đó."""
+        resume = job.get("state", "pending")
+        job["state"] = "failed"
+        return self._update(job, worker, "state='failed', resume_state=?, stage=?, error=?, data=?, claimed_by=NULL",
+                            (resume, stage, str(error), _job_data(job)))
+    def release(self, job, worker):
+        return self._update(job, worker, "claimed_by=NULL, data=?", (_job_data(job),))
+    def release_worker(self, worker):
+        with self._lock:
+            return self._conn.execute("UPDATE jobs SET claimed_by=NULL WHERE claimed_by=?", (worker,)).rowcount
+    def heartbeat(self, worker):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET claimed_at=? WHERE claimed_by=?", (time.time(), worker))
+    def retry_failed(self, batch_id):
+        with self._lock:
+            return self._conn.execute("""UPDATE jobs SET state=COALESCE(resume_state, 'pending'), resume_state=NULL, error=NULL, stage=NULL
+                WHERE batch_id=? AND state='failed'""", (batch_id,)).rowcount
+    def counts(self, batch_id):
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM jobs WHERE batch_id=? GROUP BY state", (batch_id,)).fetchall()
+        counts = {s: 0 for s in STATES}
+        counts.update(dict(rows))
+        return counts
+    def worker_counts(self, batch_id):
+        """Tiến độ gộp theo worker (nhiều process cùng 1 batch): {worker: {"patched", "failed", "active"}}.
+        active = số bài worker đó đang giữ với lease còn hạn."""
+        alive = time.time() - self.lease
+        with self._lock:
+            rows = self._conn.execute("""SELECT COALESCE(claimed_by, worker), SUM(state='patched'), SUM(state='failed'),
+                SUM(claimed_by IS NOT NULL AND claimed_at >= ?) FROM jobs WHERE batch_id=? AND COALESCE(claimed_by, worker) IS NOT NULL
+                GROUP BY 1 ORDER BY 1""", (alive, batch_id)).fetchall()
+        return {w: {"patched": p, "failed": f, "active": a} for w, p, f, a in rows}
+    def remaining_urls(self, batch_id):
+        with self._lock:
+            return [r[0] for r in self._conn.execute(
+                "SELECT url FROM jobs WHERE batch_id=? AND state NOT IN ('patched', 'failed') ORDER BY seq", (batch_id,))]
+    def failures(self, batch_id):
+        with self._lock:
+            rows = self._conn.execute("SELECT url, stage, error FROM jobs WHERE batch_id=? AND state='failed' ORDER BY seq", (batch_id,)).fetchall()
+        return [{"url": u, "stage": s, "error": e} for u, s, e in rows]
+    def config(self, batch_id):
+        with self._lock:
+            row = self._conn.execute("SELECT config FROM batches WHERE batch_id=?", (batch_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+    def batches(self, unfinished=True, limit=20):
+        """Batch mới nhất trước. unfinished=True: chỉ batch còn bài chưa patched (kể cả bài lỗi)."""
+        with self._lock:
+            rows = self._conn.execute("""SELECT b.batch_id, b.created_at, b.total,
+                SUM(j.state='patched'), SUM(j.state='failed'), SUM(j.state NOT IN ('patched', 'failed'))
+                FROM batches b JOIN jobs j ON j.batch_id=b.batch_id GROUP BY b.batch_id
+                HAVING ? = 0 OR SUM(j.state!='patched') > 0 ORDER BY b.created_at DESC, b.batch_id DESC LIMIT ?""",
+                                     (1 if unfinished else 0, limit)).fetchall()
+        return [{"batch_id": r[0], "created_at": r[1], "total": r[2], "patched": r[3], "failed": r[4], "remaining": r[5]} for r in rows]
+    def drop_batch(self, batch_id):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("DELETE FROM jobs WHERE batch_id=?", (batch_id,))
+            self._conn.execute("DELETE FROM batches WHERE batch_id=?", (batch_id,))
+            self._conn.execute("COMMIT")
+_queue = None
+_queue_lock = threading.Lock()
+def get_job_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
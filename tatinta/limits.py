@@ -0,0 +1,139 @@
+"""Giới hạn song song tự điều chỉnh (AIMD) cho từng dịch vụ ngoài: EdgeTTS, CMS đọc, CMS upload, CMS ghi.
+Khỏe (thành công, latency không tăng vọt) → tăng dần +1; bị throttle (429 / 5xx / timeout / EdgeTTS trả rỗng) → giảm một nửa.
+Worker của pipeline là trần, limiter quyết định thực tế được bao nhiêu request chạy cùng lúc. Giá trị học được giữ suốt process
+và dùng chung cho mọi event loop (mỗi phiên Streamlit chạy asyncio.run trong thread riêng) — cùng 1 dịch vụ ngoài thì chung 1 cửa sổ."""
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+DEPENDENCIES = {
+    # tên: (khởi đầu, tối thiểu, tối đa)
+    "tts": (4, 1, int(os.environ.get("TATINTA_TTS_MAX_CONCURRENCY", "32"))),
+    "cms_read": (8, 1, 32),
+    "cms_upload": (4, 1, 16),
+    "cms_write": (4, 1, 16),
+}
+DEPENDENCY_LABEL = {"tts": "EdgeTTS", "cms_read": "CMS đọc", "cms_upload": "CMS upload", "cms_write": "CMS ghi"}
+class Slot:
+    def __init__(self, cost):
+        self.cost = max(cost, 1e-3)
+        self.signal = None
+    def throttled(self):
+        """Dịch vụ đang quá tải (429 / 5xx / timeout / kết quả rỗng) → limiter giảm."""
+        self.signal = "throttled"
+    def neutral(self):
+        """Lỗi không liên quan tải (4xx, dữ liệu sai...) → không tính vào điều chỉnh."""
+        self.signal = "neutral"
+class AdaptiveLimiter:
+    def __init__(self, name, initial=4, min_limit=1, max_limit=32, backoff=0.5, slow_factor=2.0, cooldown=2.0):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.slow_factor = slow_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.baseline = None   # latency / cost thấp nhất gần đây (trôi lên chậm để theo kịp thay đổi thật)
+        self.ewma = None
+        self.ok = 0
+        self.throttled = 0
+        self.increases = 0
+        self.decreases = 0
+        self._healthy_streak = 0
+        self._last_decrease = 0.0
+        self._waiters = deque()   # (loop, future) — waiter có thể thuộc event loop của thread khác
+        self._lock = threading.Lock()
+    def _wake(self):
+        # Gọi khi đang giữ _lock. Future chỉ được set trong loop của nó → call_soon_threadsafe
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            loop, fut = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(_resolve, fut)
+            except RuntimeError:
+                continue   # loop đã đóng: không còn ai chờ
+            free -= 1
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self._waiters.append(waiter)
+            try:
+                await waiter[1]
+            except asyncio.CancelledError:
+                with self._lock:
+                    if waiter in self._waiters: self._waiters.remove(waiter)
+                    self._wake()   # có thể đã được đánh thức: nhường lượt cho waiter kế tiếp
+                raise
+    def release(self, latency=None, cost=1.0, signal=None):
+        with self._lock:
+            self._release(latency, cost, signal)
+    def _release(self, latency, cost, signal):
+        self.in_flight = max(0, self.in_flight - 1)
+        if signal == "throttled":
+            self.throttled += 1
+            self._healthy_streak = 0
+            now = time.monotonic()
+            # Nhiều request đang bay cùng lỗi 1 lúc chỉ tính là 1 lần quá tải
+            if now - self._last_decrease >= self.cooldown:
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.decreases += 1
+        elif signal is None and latency is not None:
+            self.ok += 1
+            unit = latency / cost
+            self.ewma = unit if self.ewma is None else 0.8 * self.ewma + 0.2 * unit
+            self.baseline = unit if self.baseline is None else min(unit, self.baseline * 1.02)
+            if unit <= self.slow_factor * self.baseline:
+                self._healthy_streak += 1
+                # Tăng +1 sau khoảng 1 "vòng" thành công (≈ limit request), giống congestion avoidance của TCP
+                if self._healthy_streak >= int(self.limit) and self.limit < self.max_limit:
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    self._healthy_streak = 0
+                    self.increases += 1
+            else:
+                self._healthy_streak = 0
+        self._wake()
+    @asynccontextmanager
+    async def slot(self, cost=1.0):
+        """async with limiter.slot(cost=số_nghìn_ký_tự) as s: ...; s.throttled() khi bị chặn. Exception = throttled."""
+        await self.acquire()
+        s = Slot(cost)
+        t0 = time.perf_counter()
+        try:
+            yield s
+        except Exception:
+            if s.signal is None: s.throttled()
+            raise
+        except BaseException:
+            # Bị hủy (Streamlit dừng, consumer bỏ stream giữa chừng): không phải tín hiệu tải
+            if s.signal is None: s.neutral()
+            raise
+        finally:
+            self.release(time.perf_counter() - t0, s.cost, s.signal)
+    def stats(self):
+        with self._lock:
+            return {"limit": int(self.limit), "in_flight": self.in_flight, "max": self.max_limit, "ok": self.ok,
+                    "throttled": self.throttled, "increases": self.increases, "decreases": self.decreases,
+                    "ewma": round(self.ewma, 4) if self.ewma is not None else None}
+def _resolve(fut):
+    if not fut.done():
+        fut.set_result(None)
+_limiters = {}
+_limiters_lock = threading.Lock()
+def get_limiter(name):
+    if name not in _limiters:
+        with _limiters_lock:
+            if name not in _limiters:
+                initial, lo, hi = DEPENDENCIES[name]
+                _limiters[name] = AdaptiveLimiter(name, initial, lo, hi)
+    return _limiters[name]
+def limiter_stats():
+    return {name: get_limiter(name).stats() for name in DEPENDENCIES}
@@ -0,0 +1,96 @@
+"""Đo thời gian + số byte từng bước (CMS GET, TTS, ffmpeg, upload, save-file, PATCH) theo bài và theo lượt chạy.
+Mỗi bài xong ghi 1 dòng JSON vào run log, hết lượt ghi thêm 1 dòng tổng kết (p50/p95, throughput)."""
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+METRICS_LOG = os.environ.get("TATINTA_METRICS_LOG", os.path.join("logs", "runs.jsonl"))
+STEPS = ["cms_get", "normalize", "tts", "ffmpeg", "dedup", "cms_upload", "cms_save", "cms_patch"]
+def percentile(values, p):
+    """values đã sort. Nearest-rank, đủ dùng cho hiển thị."""
+    if not values: return 0.0
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
+class RunMetrics:
+    def __init__(self, kind="batch", log_path=None, meta=None):
+        self.run_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.kind = kind
+        self.log_path = log_path
+        self.meta = meta or {}
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._samples = {}   # step → [giây, ...]
+        self._bytes = {}     # step → tổng byte
+        self._fails = {}     # step → số lần lỗi
+        self._jobs = {}      # key → {step: {"s": giây, "bytes": n}}
+        self.ok = 0
+        self.fail = 0
+        self.closed = False
+    def record(self, key, step, seconds, nbytes=0, ok=True):
+        with self._lock:
+            self._samples.setdefault(step, []).append(seconds)
+            self._bytes[step] = self._bytes.get(step, 0) + nbytes
+            if not ok:
+                self._fails[step] = self._fails.get(step, 0) + 1
+            entry = self._jobs.setdefault(key, {}).setdefault(step, {"s": 0.0, "bytes": 0})
+            entry["s"] += seconds
+            entry["bytes"] += nbytes
+    @contextmanager
+    def timer(self, key, step):
+        """with metrics.timer(dest_id, "tts") as t: ...; t["bytes"] = len(data). Lỗi vẫn được ghi (ok=False)."""
+        t = {"bytes": 0}
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            yield t
+            ok = True
+        finally:
+            self.record(key, step, time.perf_counter() - t0, t["bytes"], ok)
+    def finish(self, key, ok, error=None, **extra):
+        """Kết thúc 1 bài: ghi 1 dòng {"type": "dest"} vào run log."""
+        with self._lock:
+            if ok: self.ok += 1
+            else: self.fail += 1
+            steps = self._jobs.pop(key, {})
+        row = {"type": "dest", "run": self.run_id, "key": key, "ok": ok, "at": datetime.now().isoformat(timespec="seconds"),
+               "steps": {k: {"s": round(v["s"], 4), "bytes": v["bytes"]} for k, v in steps.items()}}
+        if error: row["error"] = str(error)
+        row.update(extra)
+        self._write(row)
+    def summary(self):
+        with self._lock:
+            samples = {k: sorted(v) for k, v in self._samples.items()}
+            total_bytes = dict(self._bytes)
+            fails = dict(self._fails)
+            ok, fail = self.ok, self.fail
+        elapsed = time.perf_counter() - self._t0
+        done = ok + fail
+        steps = {}
+        for step in STEPS + sorted(set(samples) - set(STEPS)):
+            v = samples.get(step)
+            if not v: continue
+            steps[step] = {"n": len(v), "fail": fails.get(step, 0), "p50": round(percentile(v, 50), 4),
+                           "p95": round(percentile(v, 95), 4), "total": round(sum(v), 3), "bytes": total_bytes.get(step, 0)}
+        return {"run": self.run_id, "kind": self.kind, "started_at": self.started_at, "elapsed": round(elapsed, 2),
+                "ok": ok, "fail": fail, "per_min": round(done / elapsed * 60, 2) if elapsed > 0 else 0.0, "steps": steps}
+    def close(self):
+        """Ghi dòng tổng kết {"type": "run"}. Gọi nhiều lần cũng chỉ ghi 1 lần."""
+        if self.closed: return self.summary()
+        self.closed = True
+        summary = self.summary()
+        self._write({"type": "run", **summary, "meta": self.meta})
+        return summary
+    def _write(self, row):
+        if not self.log_path: return
+        try:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            line = json.dumps(row, ensure_ascii=False) + "\n"
+            with self._lock:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        except OSError:
+            pass
@@ -0,0 +1,94 @@
+"""Pipeline nhiều tầng: mỗi tầng có pool worker riêng, nối với nhau bằng queue có giới hạn.
+Queue đầy thì tầng trước phải chờ (backpressure), nên số bài đang xử lý dở — và dung lượng
+RAM / file tạm — luôn bị chặn trên bởi tổng worker + tổng sức chứa queue."""
+import time
+import asyncio
+STAGES = ["fetch", "normalize", "synthesize", "mix", "upload", "patch"]
+DEFAULT_WORKERS = {"fetch": 4, "normalize": 2, "synthesize": 4, "mix": 2, "upload": 4, "patch": 2}
+class PipelineAbort(Exception):
+    """Raise trong handler để dừng cả batch (VD: token hết hạn). Job đang chờ sẽ không được xử lý — mỗi job bị bỏ
+    vẫn nhận on_fail(job, stage, lỗi abort) để không job nào kẹt ở trạng thái "đang chạy"."""
+class Stage:
+    def __init__(self, name, handler, workers=1):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, int(workers))
+class StagedPipeline:
+    def __init__(self, stages, queue_size=4, on_start=None, on_stage=None, on_stage_done=None, on_ok=None, on_fail=None):
+        self.stages = stages
+        self.queue_size = max(1, int(queue_size))
+        self.on_start = on_start
+        self.on_stage = on_stage
+        self.on_stage_done = on_stage_done
+        self.on_ok = on_ok
+        self.on_fail = on_fail
+        self.aborted = False
+        self.abort_error = None
+    async def _call(self, cb, *args):
+        if cb is None: return
+        res = cb(*args)
+        if asyncio.iscoroutine(res):
+            await res
+    async def run(self, jobs):
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        async def feeder():
+            # jobs: list / generator, hoặc async generator (VD claim từ hàng đợi SQLite trong thread)
+            if hasattr(jobs, "__aiter__"):
+                async for job in jobs:
+                    if self.aborted:
+                        await drop(job, self.stages[0].name)
+                        break
+                    await queues[0].put(job)
+                return
+            for job in jobs:
+                if self.aborted: break
+                await queues[0].put(job)
+        async def drop(job, stage_name):
+            # Bài còn nằm trong queue khi batch dừng: vẫn báo on_fail để giao diện / hàng đợi thấy kết thúc (trả claim...)
+            await self._call(self.on_fail, job, stage_name, self.abort_error)
+        async def worker(i):
+            stage = self.stages[i]
+            q_in = queues[i]
+            q_out = queues[i + 1] if i + 1 < len(self.stages) else None
+            while True:
+                job = await q_in.get()
+                if job is None: return
+                if self.aborted:
+                    await drop(job, stage.name)
+                    continue
+                if i == 0:
+                    await self._call(self.on_start, job)
+                await self._call(self.on_stage, job, stage.name)
+                t0 = time.perf_counter()
+                try:
+                    await stage.handler(job)
+                except PipelineAbort as e:
+                    if not self.aborted: self.abort_error = e
+                    self.aborted = True
+                    await self._call(self.on_stage_done, job, stage.name, time.perf_counter() - t0, False)
+                    await self._call(self.on_fail, job, stage.name, e)
+                    continue
+                except Exception as e:
+                    await self._call(self.on_stage_done, job, stage.name, time.perf_counter() - t0, False)
+                    await self._call(self.on_fail, job, stage.name, e)
+                    continue
+                await self._call(self.on_stage_done, job, stage.name, time.perf_counter() - t0, True)
+                if q_out is not None:
+                    await q_out.put(job)
+                else:
+                    await self._call(self.on_ok, job)
+        async def run_stage(i, upstream):
+            await upstream
+            for _ in range(self.stages[i].workers):
+                await queues[i].put(None)
+        # Mỗi tầng kết thúc khi tầng trước xong hẳn → gửi sentinel cho từng worker của tầng đó
+        tasks = []
+        upstream = asyncio.ensure_future(feeder())
+        for i, stage in enumerate(self.stages):
+            workers = [asyncio.ensure_future(worker(i)) for _ in range(stage.workers)]
+            closer = asyncio.ensure_future(run_stage(i, upstream))
+            tasks.append(closer)
+            tasks.extend(workers)
+            upstream = asyncio.gather(*workers)
+        tasks.append(upstream)
+        await asyncio.gather(*tasks)
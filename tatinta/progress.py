@@ -0,0 +1,60 @@
+"""Tiến độ batch cho giao diện: mỗi sự kiện (vào bước / xong / lỗi) cập nhật O(1) — dict theo URL thay cho list + remove,
+còn việc vẽ lại thì gom theo nhịp cố định (vài lần / giây) và chỉ gửi số đếm + vài dòng mới nhất. 1.000 bài không còn
+dựng lại cả 4 bảng và mọi ô text sau mỗi bài; danh sách đầy đủ chỉ dựng khi người dùng mở xem."""
+import os
+import time
+from itertools import islice
+RENDER_INTERVAL = float(os.environ.get("TATINTA_UI_INTERVAL", "0.3"))
+RECENT_ROWS = 20
+class BatchProgress:
+    def __init__(self, urls=(), interval=RENDER_INTERVAL):
+        # dict giữ thứ tự chèn: hàng chờ đúng thứ tự, lấy bài ra khỏi bất kỳ vị trí nào O(1)
+        self.queued = {u: {"URL": u, "Trạng thái": "⏳ Đang chờ"} for u in urls}
+        self.active = {}
+        self.ok = []
+        self.fail = []
+        self.total = len(self.queued)
+        self.last_event = ""
+        self.interval = interval
+        self._rendered_at = 0.0
+        self._changed = True
+    @property
+    def done(self):
+        return len(self.ok) + len(self.fail)
+    @property
+    def pending(self):
+        return len(self.queued) + len(self.active)
+    def stage(self, url, label, note=""):
+        row = self.queued.pop(url, None) or self.active.get(url)
+        if row is None: return
+        row["Trạng thái"] = label
+        self.active[url] = row
+        self.last_event = note
+        self._changed = True
+    def _finish(self, url):
+        if self.active.pop(url, None) is None: self.queued.pop(url, None)
+        self._changed = True
+    def succeed(self, url, row):
+        self._finish(url)
+        self.ok.append(row)
+    def failed(self, url, row):
+        self._finish(url)
+        self.fail.append(row)
+    def running_rows(self, limit=RECENT_ROWS):
+        """Bài đang chạy trước rồi tới đầu hàng chờ — không duyệt cả hàng chờ."""
+        rows = list(islice(self.active.values(), limit))
+        return rows + list(islice(self.queued.values(), limit - len(rows)))
+    def recent(self, kind, limit=RECENT_ROWS):
+        """limit dòng ok / fail mới nhất, mới nhất lên đầu."""
+        rows = self.ok if kind == "ok" else self.fail
+        return rows[:-limit - 1:-1]
+    def rows(self, kind):
+        """Danh sách đầy đủ — chỉ gọi khi người dùng mở xem / copy."""
+        if kind == "running": return [*self.active.values(), *self.queued.values()]
+        return list(self.ok if kind == "ok" else self.fail)
+    def due(self, force=False):
+        """True nếu nên vẽ lại lúc này: có thay đổi và đã qua interval từ lần vẽ trước. force: vẽ ngay (lúc chờ / khi xong)."""
+        now = time.monotonic()
+        if not force and not (self._changed and now - self._rendered_at >= self.interval): return False
+        self._rendered_at, self._changed = now, False
+        return True
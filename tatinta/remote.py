@@ -0,0 +1,147 @@
+"""Lịch sử trên GitHub chia shard: history/<2 ký tự cuối dest_id>.json (tối đa 256 file nhỏ). Mỗi lần đồng bộ là 1 commit
+qua Git Data API (tree + commit + ref) chỉ chứa các shard vừa đổi. Ref đã bị máy khác đẩy trước (không fast-forward)
+→ đọc các shard họ vừa sửa, gộp vào store rồi dựng lại commit — nhiều người / nhiều máy cùng chạy không mất lịch sử."""
+import json
+import time
+import base64
+import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+SHARD_DIR = "history"
+PUSH_RETRIES = 5
+def shard_of(dest_id):
+    # dest_id là ObjectId: 8 ký tự đầu là timestamp (dồn cục), 2 ký tự cuối là bộ đếm → chia đều
+    return dest_id[-2:].lower()
+def shard_path(shard):
+    return f"{SHARD_DIR}/{shard}.json"
+def git_blob_sha(data):
+    """sha1 git của blob — tính tại chỗ để biết shard trên GitHub chính là bản mình vừa đẩy, khỏi tải lại."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+def shard_json(entries):
+    return json.dumps(entries, ensure_ascii=False, indent=1, sort_keys=True)
+class RemoteConflict(Exception):
+    """Ref trên GitHub đã đi tiếp trong lúc mình dựng commit."""
+class GitHubShards:
+    def __init__(self, repo, branch="main", legacy_file=None, ttl=60, headers=None):
+        self.api = f"https://api.github.com/repos/{repo}"
+        self.branch = branch
+        self.legacy_file = legacy_file
+        self.ttl = ttl
+        self.headers = headers     # hàm () → headers có token
+        self.etag = None
+        self.head = None
+        self.checked_at = 0.0
+        self.not_modified = 0
+        self.downloads = 0
+        self.commits = 0
+        self.conflicts = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+    def is_fresh(self):
+        return time.time() - self.checked_at < self.ttl
+    def invalidate(self):
+        self.checked_at = 0.0
+        self.etag = None
+    def _call(self, method, path, **kw):
+        import requests
+        return requests.request(method, f"{self.api}{path}", headers={**self.headers(), **kw.pop("headers", {})}, timeout=10, **kw)
+    def _head(self, conditional):
+        """sha commit đầu nhánh, None nếu không đổi từ lần trước (304) hoặc lỗi."""
+        headers = {"If-None-Match": self.etag} if conditional and self.etag else {}
+        resp = self._call("GET", f"/git/ref/heads/{self.branch}", headers=headers)
+        if resp.status_code == 304:
+            self.not_modified += 1
+            return None
+        if resp.status_code != 200: return None
+        self.etag = resp.headers.get("ETag")
+        return resp.json()["object"]["sha"]
+    def _tree(self, commit_sha):
+        """(sha tree gốc, {shard: sha blob}, sha blob file cũ processed_urls.json hoặc None)."""
+        root = self._call("GET", f"/git/commits/{commit_sha}").json()["tree"]["sha"]
+        entries = self._call("GET", f"/git/trees/{root}").json().get("tree", [])
+        shards, legacy = {}, None
+        for e in entries:
+            if e["path"] == SHARD_DIR and e["type"] == "tree":
+                for s in self._call("GET", f"/git/trees/{e['sha']}").json().get("tree", []):
+                    if s["path"].endswith(".json"): shards[s["path"][:-5]] = s["sha"]
+            elif e["path"] == self.legacy_file and e["type"] == "blob":
+                legacy = e["sha"]
+        return root, shards, legacy
+    def _blob(self, sha):
+        resp = self._call("GET", f"/git/blobs/{sha}")
+        resp.raise_for_status()
+        self.downloads += 1
+        return json.loads(base64.b64decode(resp.json()["content"]).decode("utf-8"))
+    def _merge_changed(self, store, shards, legacy):
+        """Tải các shard có sha khác lần gộp trước (song song) rồi gộp vào store. Trả về số dòng đổi."""
+        known = store.remote_shards()
+        todo = {s: sha for s, sha in shards.items() if known.get(s) != sha}
+        changed = 0
+        if todo:
+            with ThreadPoolExecutor(max_workers=8) as ex:
+                blobs = dict(zip(todo, ex.map(self._blob, todo.values())))
+            for shard, entries in blobs.items():
+                changed += store.merge(entries)
+            store.set_remote_shards(todo)
+        if not shards and legacy and known.get("_legacy") != legacy:
+            # Repo còn định dạng cũ (1 file JSON): gộp 1 lần, lần đẩy tới sẽ ghi ra đủ shard
+            changed += store.merge(self._blob(legacy))
+            store.set_remote_shards({"_legacy": legacy})
+            store.mark_all_dirty()
+        return changed
+    def pull(self, store, force=False):
+        """Gộp thay đổi trên GitHub vào store. None nếu còn trong TTL / nhánh không đổi / lỗi mạng."""
+        with self._lock:
+            if not force and self.is_fresh(): return None
+            try:
+                head = self._head(conditional=True)
+                self.checked_at = time.time()
+                if head is None or head == self.head: return None
+                _, shards, legacy = self._tree(head)
+                changed = self._merge_changed(store, shards, legacy)
+                self.head = head
+                return changed
+            except Exception:
+                return None
+    def push(self, store, message):
+        """1 commit cho mọi shard đang dirty. Xung đột (máy khác đẩy trước) → gộp bản của họ, dựng lại, thử lại."""
+        with self._lock:
+            for attempt in range(PUSH_RETRIES):
+                dirty = store.dirty_shards()
+                if not dirty: return True
+                try:
+                    self._push_once(store, dirty, message)
+                    return True
+                except RemoteConflict:
+                    self.conflicts += 1
+                    time.sleep(random.uniform(0.5, 1.5) * (attempt + 1))
+            return False
+    def _push_once(self, store, dirty, message):
+        head = self._head(conditional=False)
+        if head is None: raise Exception("Không đọc được nhánh trên GitHub")
+        root, shards, legacy = self._tree(head)
+        self._merge_changed(store, shards, legacy)
+        dirty = store.dirty_shards()   # gộp xong có thể thêm shard dirty (migrate từ file cũ)
+        tree, written = [], {}
+        for shard in dirty:
+            data = shard_json(store.shard_entries(shard)).encode("utf-8")
+            written[shard] = git_blob_sha(data)
+            if shards.get(shard) != written[shard]:
+                tree.append({"path": shard_path(shard), "mode": "100644", "type": "blob", "content": data.decode("utf-8")})
+        if tree:
+            resp = self._call("POST", "/git/trees", json={"base_tree": root, "tree": tree})
+            resp.raise_for_status()
+            resp = self._call("POST", "/git/commits", json={"message": message, "tree": resp.json()["sha"], "parents": [head]})
+            resp.raise_for_status()
+            commit = resp.json()["sha"]
+            resp = self._call("PATCH", f"/git/refs/heads/{self.branch}", json={"sha": commit, "force": False})
+            if resp.status_code in (409, 422): raise RemoteConflict(resp.text[:200])
+            resp.raise_for_status()
+            self.commits += 1
+            head = commit
+        store.set_remote_shards(written)
+        store.clear_dirty(dirty)
+        self.head = head
+        self.etag = None
+        self.checked_at = time.time()
@@ -0,0 +1,86 @@
+"""Chỉ mục tìm kiếm lịch sử trong RAM: tìm theo tên bài (không dấu, khớp tiền tố từng từ) hoặc dest_id, lọc thiếu VI / EN,
+khoảng ngày, phân trang. Dựng 1 lần từ SQLite, sau đó chỉ đọc lại các bài vừa ghi (store báo dest_id thay đổi)."""
+import re
+import threading
+import unicodedata
+HEX_RE = re.compile(r'^[a-f0-9]{4,24}$')
+def fold(text):
+    """'Đà Lạt mộng mơ' → 'da lat mong mo'."""
+    text = (text or "").lower().replace("đ", "d")
+    return "".join(c for c in unicodedata.normalize("NFD", text) if not unicodedata.combining(c))
+def tokens(text):
+    return re.findall(r'\w+', fold(text))
+class HistoryIndex:
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._entries = {}     # dest_id → (title, ran_at, has_vi, has_en)
+        self._postings = {}    # từ → {dest_id}
+        self._order = None     # dest_id mới nhất trước, None = cần sort lại
+        self._stale = set()
+        self._built = False
+    def touch(self, dest_ids):
+        """Store gọi sau mỗi lần ghi — lần query sau mới đọc lại các bài này."""
+        with self._lock:
+            self._stale.update(dest_ids)
+    def _put(self, dest_id, entry):
+        old = self._entries.get(dest_id)
+        if old:
+            for tok in tokens(old[0]):
+                ids = self._postings.get(tok)
+                if ids:
+                    ids.discard(dest_id)
+                    if not ids: del self._postings[tok]
+        self._entries[dest_id] = entry
+        for tok in tokens(entry[0]):
+            self._postings.setdefault(tok, set()).add(dest_id)
+        self._order = None
+    def _sync(self):
+        if not self._built:
+            for dest_id, entry in self.store.index_rows():
+                self._put(dest_id, entry)
+            self._built = True
+            self._stale.clear()
+        elif self._stale:
+            stale, self._stale = self._stale, set()
+            for dest_id, entry in self.store.index_rows(stale):
+                self._put(dest_id, entry)
+        if self._order is None:
+            self._order = sorted(self._entries, key=lambda d: self._entries[d][1] or "", reverse=True)
+    def _match(self, query):
+        """Tập dest_id khớp query, None = không lọc theo chữ."""
+        words = tokens(query)
+        if not words: return None
+        result = None
+        for word in words:
+            ids = set()
+            for tok, posting in self._postings.items():
+                if tok.startswith(word): ids |= posting
+            result = ids if result is None else result & ids
+            if not result: break
+        # Dán cả / một đoạn dest_id (hoặc URL): khớp thêm theo id — "cafe" vừa là từ vừa là hex nên lấy hợp cả hai
+        q = query.strip().lower().rstrip("/").rsplit("/", 1)[-1]
+        if HEX_RE.match(q):
+            result |= {d for d in self._entries if q in d}
+        return result
+    def search(self, query="", missing_vi=False, missing_en=False, date_from=None, date_to=None, offset=0, limit=20):
+        """Trả về (tổng số bài khớp, [(dest_id, title, ran_at, has_vi, has_en), ...] của trang). date_*: 'YYYY-MM-DD'."""
+        ids = self.ids(query, missing_vi, missing_en, date_from, date_to)
+        with self._lock:
+            page = [(d, *self._entries[d]) for d in ids[offset:offset + limit]]
+        return len(ids), page
+    def ids(self, query="", missing_vi=False, missing_en=False, date_from=None, date_to=None):
+        with self._lock:
+            self._sync()
+            matched = self._match(query)
+            out = []
+            for dest_id in self._order:
+                if matched is not None and dest_id not in matched: continue
+                title, ran_at, has_vi, has_en = self._entries[dest_id]
+                if missing_vi and has_vi: continue
+                if missing_en and has_en: continue
+                day = (ran_at or "")[:10]
+                if date_from and day < date_from: continue
+                if date_to and day > date_to: continue
+                out.append(dest_id)
+            return out
@@ -0,0 +1,95 @@
+"""Chuẩn hóa text trước khi đưa vào EdgeTTS. Luật khai báo thành bảng, compile 1 lần lúc import.
+Thứ tự luật trong bảng chính là thứ tự áp dụng — chỉ gộp những luật không ảnh hưởng lẫn nhau."""
+import re
+ROMAN_CENTURY = {
+    'XXI': 21, 'XXII': 22, 'XX': 20, 'XIX': 19, 'XVIII': 18,
+    'XVII': 17, 'XVI': 16, 'XV': 15, 'XIV': 14, 'XIII': 13,
+    'XII': 12, 'XI': 11, 'X': 10, 'IX': 9, 'VIII': 8,
+    'VII': 7, 'VI': 6, 'V': 5, 'IV': 4, 'III': 3, 'II': 2, 'I': 1
+}
+UNITS = {'km': ' ki-lô-mét', 'm²': ' mét vuông', 'm': ' mét', 'kg': ' ki-lô-gam', 'ha': ' héc-ta', 'cm': ' xen-ti-mét'}
+QUOTES_HTML = '"“”„‛‚«»‹›\'‘’`'
+QUOTES_PLAIN = '"“”\'‘’`«»'
+SYMBOLS = '*#_~`<>{}|\\'
+INLINE_TAGS = ['strong', 'b', 'em', 'i', 'u', 'span', 'a', 'mark', 'small', 'sub', 'sup']
+def _roman_century(m):
+    roman = m.group(1)
+    if roman in ROMAN_CENTURY:
+        return f"thế kỷ {ROMAN_CENTURY[roman]}"
+    return m.group(0)
+# Mỗi luật: ("sub", pattern, thay_thế) | ("strip", các_ký_tự_cần_xóa — gộp 1 lượt) | ("replace", chuỗi_cũ, chuỗi_mới)
+TIME_RANGE = ("sub", r'(\d{1,2}:\d{2})\s*[–—-]\s*(\d{1,2}:\d{2})', r'\1 đến \2')
+# (?=[XVI]) bỏ qua các vị trí chỉ khớp chuỗi rỗng (kết quả giữ nguyên) thay vì gọi hàm thay thế ở mọi ký tự
+ROMAN = ("sub", r'(?:thế kỷ\s+)?(?=[XVI])(X{0,3}(?:IX|IV|V?I{0,3}))\b', _roman_century)
+USD_PREFIX = ("sub", r'\$\s*(\d[\d\.]*)', r'\1 đô la')
+EUR_PREFIX = ("sub", r'€\s*(\d[\d\.]*)', r'\1 euro')
+EUR_SUFFIX = ("sub", r'(\d[\d\.]*)\s*€', r'\1 euro')
+USD_SUFFIX = ("sub", r'(\d[\d\.]*)\s*\$', r'\1 đô la')
+PERCENT = ("sub", r'(\d+)\s*%', r'\1 phần trăm')
+# 1 lượt là đủ: bỏ 1 dấu chấm không bao giờ làm dấu chấm khác khớp thêm (vòng lặp 3 lần cũ không đổi kết quả)
+THOUSANDS = ("sub", r'(?<=\d)\.(?=\d{3}(?:\D|$))', '')
+# 6 đơn vị gộp 1 lượt: text thay vào luôn bắt đầu bằng khoảng trắng + chữ nên không tạo khớp mới cho đơn vị khác
+UNIT = ("sub", r'(?<=\d)\s*(km|m²|m|kg|ha|cm)\b', lambda m: UNITS[m.group(1)])
+LIST_NUMBER = ("sub", r'(?m)^\s*\d+(?:\.\d+)*\.?\s+', '')
+DASH = ("sub", r'\s*[–—]\s*', ', ')
+BULLET = ("sub", r'(?m)^\s*[-•·]\s+', '')
+SPACED_HYPHEN = ("replace", ' - ', ', ')
+# Tương đương [ \t]+ → ' ' nhưng không đụng tới khoảng trắng đơn (thay ' ' bằng ' ' là thừa)
+SPACES = ("sub", r'[ \t]{2,}|\t', ' ')
+BLANK_LINES = ("sub", r'\n{3,}', '\n\n')
+ACRONYM = ("sub", r'\b[A-Z]{2,}\b', lambda m: m.group(0).capitalize())
+AMPERSAND = ("replace", '&', ' và ')
+HTML_RULES = [
+    TIME_RANGE, ROMAN, USD_PREFIX, EUR_PREFIX, EUR_SUFFIX, USD_SUFFIX, PERCENT, THOUSANDS, UNIT,
+    LIST_NUMBER, DASH, BULLET, SPACED_HYPHEN, ("strip", QUOTES_HTML + SYMBOLS),
+    SPACES, BLANK_LINES, ACRONYM, AMPERSAND,
+]
+PLAIN_RULES = [
+    TIME_RANGE, USD_PREFIX, PERCENT, THOUSANDS, UNIT,
+    DASH, BULLET, SPACED_HYPHEN, ("strip", QUOTES_PLAIN + SYMBOLS),
+    SPACES, BLANK_LINES, AMPERSAND,
+]
+def compile_rules(rules):
+    steps = []
+    for rule in rules:
+        kind = rule[0]
+        if kind == "sub":
+            steps.append(lambda text, _p=re.compile(rule[1]), _r=rule[2]: _p.sub(_r, text))
+        elif kind == "strip":
+            # Lớp ký tự regex nhanh hơn str.translate nhiều lần với text tiếng Việt (chuỗi non-ASCII)
+            steps.append(lambda text, _p=re.compile(f"[{re.escape(rule[1])}]"): _p.sub('', text))
+        elif kind == "replace":
+            steps.append(lambda text, _old=rule[1], _new=rule[2]: text.replace(_old, _new))
+        else:
+            raise ValueError(f"Luật không hợp lệ: {rule!r}")
+    return steps
+HTML_STEPS = compile_rules(HTML_RULES)
+PLAIN_STEPS = compile_rules(PLAIN_RULES)
+def apply_rules(text, steps):
+    for step in steps:
+        text = step(text)
+    return text.strip()
+def html_to_text(raw_html):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(raw_html, "html.parser")
+    for tag in soup.find_all(INLINE_TAGS):
+        tag.unwrap()
+    return soup.get_text(separator="\n").strip()
+def fix_text_for_tts(title, raw_html):
+    if not title and not raw_html: return ""
+    text = f"{title}...\n\n{html_to_text(raw_html)}"
+    return apply_rules(text, HTML_STEPS)
+def fix_plain_text_for_tts(title, plain_text):
+    """Dùng cho tab Tạo Audio Tay — input là plain text, không có HTML"""
+    if not title and not plain_text: return ""
+    text = f"{title}...\n\n{plain_text.strip()}"
+    return apply_rules(text, PLAIN_STEPS)
+PREVIEW_CHARS = 300
+def preview_excerpt(plain_text, max_chars=PREVIEW_CHARS):
+    """Đoạn đầu tiên (cắt ở cuối câu gần max_chars nhất) — đủ nghe thử giọng / tốc độ mà TTS chỉ mất 1-2 giây."""
+    para = next((p.strip() for p in re.split(r'\n\s*\n|\n', plain_text or "") if p.strip()), "")
+    if len(para) <= max_chars: return para
+    cut = max(para.rfind(sep, 0, max_chars) for sep in (". ", "! ", "? ", "; "))
+    return para[:cut + 1] if cut > max_chars // 3 else para[:max_chars].rsplit(" ", 1)[0] + "..."
+def fix_plain_preview_for_tts(title, plain_text):
+    return fix_plain_text_for_tts(title, preview_excerpt(plain_text))
@@ -0,0 +1,217 @@
+"""Sinh giọng đọc EdgeTTS có cache trên đĩa: khóa = hash(text đã chuẩn hóa hoặc 1 đoạn của nó, voice, rate, pitch), dọn theo LRU."""
+import os
+import re
+import json
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from .limits import get_limiter
+TTS_CACHE_DIR = os.environ.get("TATINTA_TTS_CACHE", os.path.join(".cache", "tts"))
+TTS_CACHE_MAX_MB = int(os.environ.get("TATINTA_TTS_CACHE_MB", "1024"))
+CHUNK_CHARS = 1500
+CHUNK_CONCURRENCY = 4
+CHUNK_RETRIES = 2
+SEGMENT_MIN_CHARS = 40
+SENTENCE_END = re.compile(r'(?<=[.!?…;:])\s+')
+def tts_key(text, voice, rate, pitch):
+    raw = json.dumps([text, voice, int(rate), int(pitch)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+def fingerprint(text, voice, rate, pitch):
+    """Dấu vân tay nội dung 1 ngôn ngữ lưu trong lịch sử: đổi text đã chuẩn hóa hoặc giọng / tốc độ / độ trầm là đổi."""
+    return tts_key(text, voice, rate, pitch)[:16]
+class TtsCache:
+    def __init__(self, root=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._index = OrderedDict()
+        self._total = 0
+        os.makedirs(root, exist_ok=True)
+        # Dựng lại thứ tự LRU từ atime/mtime của file đang có trên đĩa
+        entries = []
+        for name in os.listdir(root):
+            if not name.endswith(".mp3"): continue
+            st = os.stat(os.path.join(root, name))
+            entries.append((max(st.st_atime, st.st_mtime), name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total += size
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.mp3")
+    def get(self, key):
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._path(key))
+        except OSError:
+            with self._lock:
+                self._total -= self._index.pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+    def put(self, key, data):
+        if not data: return
+        # pid + thread: nhiều process worker dùng chung thư mục cache
+        tmp = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(key))
+        with self._lock:
+            self._total += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            while self._total > self.max_bytes and len(self._index) > 1:
+                old_key, old_size = self._index.popitem(last=False)
+                self._total -= old_size
+                self.evictions += 1
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._index), "bytes": self._total}
+_cache = None
+_cache_lock = threading.Lock()
+def get_tts_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TtsCache()
+    return _cache
+async def edge_tts_stream(text, voice, rate, pitch):
+    import edge_tts
+    async for chunk in edge_tts.Communicate(text, voice, rate=f"{rate:+d}%", pitch=f"{pitch:+d}Hz").stream():
+        if chunk["type"] == "audio":
+            yield chunk["data"]
+# Nguồn audio: async generator (text, voice, rate, pitch) → chunk MP3. Benchmark thay bằng bản giả lập offline.
+tts_backend = edge_tts_stream
+def set_tts_backend(backend):
+    global tts_backend
+    tts_backend = backend or edge_tts_stream
+async def limited_stream(text, voice, rate, pitch):
+    """Gọi backend qua limiter "tts" (giữ slot suốt stream). Stream rỗng hoặc lỗi = EdgeTTS đang chặn → limiter giảm.
+    cost = nghìn ký tự để latency các bài dài / ngắn so sánh được với nhau."""
+    async with get_limiter("tts").slot(cost=max(len(text) / 1000, 0.1)) as slot:
+        size = 0
+        async for chunk in tts_backend(text, voice, rate, pitch):
+            size += len(chunk)
+            yield chunk
+        if not size:
+            slot.throttled()
+async def edge_tts_bytes(text, voice, rate, pitch):
+    chunks = []
+    async for chunk in limited_stream(text, voice, rate, pitch):
+        chunks.append(chunk)
+    return b"".join(chunks)
+def _split_long(text, max_chars):
+    """Cắt 1 đoạn quá dài theo ranh giới câu, câu nào vẫn quá dài thì cắt ở khoảng trắng."""
+    pieces = []
+    for sentence in SENTENCE_END.split(text):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            if cut <= 0: cut = max_chars
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            pieces.append(sentence)
+    return pieces
+def _pack(pieces, max_chars):
+    """Gộp các câu liên tiếp thành chunk <= max_chars."""
+    chunks = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) + 1 + len(piece) <= max_chars:
+            chunks[-1] = f"{chunks[-1]} {piece}"
+        else:
+            chunks.append(piece)
+    return chunks
+def split_segments(text, max_chars=CHUNK_CHARS):
+    """Chia text đã chuẩn hóa thành segment theo đoạn (dòng trống): mỗi đoạn 1 segment, đoạn dài hơn max_chars cắt theo câu.
+    Dòng ngắn hơn SEGMENT_MIN_CHARS (tiêu đề, heading) đi chung với đoạn ngay sau. Không gộp các đoạn lại với nhau để đủ
+    max_chars: ranh giới segment chỉ phụ thuộc chính đoạn đó, sửa 1 đoạn thì các segment khác vẫn trùng cache."""
+    segments = []
+    pending = ""
+    for para in re.split(r'\n\s*\n', text):
+        para = para.strip()
+        if not para: continue
+        if pending:
+            para, pending = f"{pending}\n\n{para}", ""
+        if len(para) < SEGMENT_MIN_CHARS:
+            pending = para
+            continue
+        segments += [para] if len(para) <= max_chars else _pack(_split_long(para, max_chars), max_chars)
+    if pending:
+        segments.append(pending)
+    return segments
+async def _synthesize_chunk(text, voice, rate, pitch, sem, label):
+    err = None
+    for attempt in range(CHUNK_RETRIES + 1):
+        try:
+            async with sem:
+                data = await edge_tts_bytes(text, voice, rate, pitch)
+            if data:
+                return data
+            err = "0 bytes"
+        except Exception as e:
+            err = e
+        if attempt < CHUNK_RETRIES:
+            await asyncio.sleep(0.5 * (attempt + 1))
+    raise Exception(f"EdgeTTS lỗi ở chunk {label}: {err}")
+async def _segment_parts(text, voice, rate, pitch, cache, max_chars, concurrency):
+    """Mỗi segment có cache riêng (hash segment + voice + rate + pitch): chỉ segment mới / đã sửa mới gọi EdgeTTS, song song
+    tối đa {concurrency} request, segment lỗi retry riêng. Yield đúng thứ tự ngay khi segment đầu hàng đợi có audio."""
+    segments = split_segments(text, max_chars)
+    sem = asyncio.Semaphore(max(1, concurrency))
+    async def one(i, segment):
+        key = tts_key(segment, voice, rate, pitch)
+        data = cache.get(key)
+        if data is None:
+            data = await _synthesize_chunk(segment, voice, rate, pitch, sem, f"{i + 1}/{len(segments)}")
+            cache.put(key, data)
+        return data
+    tasks = [asyncio.ensure_future(one(i, seg)) for i, seg in enumerate(segments)]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+async def synthesize_stream(text, voice, rate, pitch, cache=None, chunk_chars=0, chunk_concurrency=CHUNK_CONCURRENCY):
+    """Yield từng chunk MP3 ngay khi có, để ffmpeg mix song song. chunk_chars > 0: chia theo đoạn (split_segments), cache
+    và sinh song song từng segment — chạy lại bài đã sửa vài câu chỉ gọi EdgeTTS cho đoạn đã đổi. MP3 của edge-tts nối
+    frame liền nhau nên ghép lại theo thứ tự không phải encode lại. chunk_chars = 0: cả bài 1 request, 1 mục cache.
+    Mỗi mục cache chỉ ghi khi audio của nó đã đủ (stream đứt giữa chừng không làm bẩn cache)."""
+    cache = cache or get_tts_cache()
+    if chunk_chars:
+        async for chunk in _segment_parts(text, voice, rate, pitch, cache, chunk_chars, chunk_concurrency):
+            yield chunk
+        return
+    key = tts_key(text, voice, rate, pitch)
+    data = cache.get(key)
+    if data is not None:
+        yield data
+        return
+    parts = []
+    async for chunk in limited_stream(text, voice, rate, pitch):
+        parts.append(chunk)
+        yield chunk
+    if parts:
+        cache.put(key, b"".join(parts))
+async def synthesize(text, voice, rate, pitch, cache=None, chunk_chars=0, chunk_concurrency=CHUNK_CONCURRENCY):
+    """Trả về bytes MP3. Trùng text (hoặc từng đoạn, khi chunk_chars > 0) + voice + rate + pitch với lần trước thì chỉ đọc file cache."""
+    parts = []
+    async for chunk in synthesize_stream(text, voice, rate, pitch, cache=cache, chunk_chars=chunk_chars, chunk_concurrency=chunk_concurrency):
+        parts.append(chunk)
+    return b"".join(parts)
@@ -0,0 +1,76 @@
+"""Chống upload trùng: sha256 của MP3 đã mix → URL lưu trữ vĩnh viễn. File y hệt đã upload trước đó (chạy lại, retry,
+các bài "Chưa có nội dung." cùng giọng + nhạc nền...) thì bỏ qua cả upload/audio lẫn upload/save-file, PATCH luôn URL cũ."""
+import os
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from contextlib import nullcontext
+from datetime import datetime
+UPLOAD_INDEX_DB = os.environ.get("TATINTA_UPLOAD_INDEX", os.path.join(".cache", "uploads.db"))
+def audio_digest(audio_bytes):
+    return hashlib.sha256(audio_bytes).hexdigest()
+class UploadIndex:
+    def __init__(self, path=UPLOAD_INDEX_DB):
+        self.path = path
+        self._lock = threading.RLock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS uploads (
+            sha256 TEXT PRIMARY KEY, url TEXT, size INTEGER, uploaded_at TEXT, hits INTEGER DEFAULT 0)""")
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+    def get(self, digest, size=0):
+        with self._lock:
+            row = self._conn.execute("SELECT url FROM uploads WHERE sha256=?", (digest,)).fetchone()
+            if not row:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE uploads SET hits=hits+1 WHERE sha256=?", (digest,))
+            self.hits += 1
+            self.bytes_saved += size
+        return row[0]
+    def put(self, digest, url, size):
+        with self._lock:
+            self._conn.execute("""INSERT INTO uploads(sha256, url, size, uploaded_at) VALUES(?, ?, ?, ?)
+                ON CONFLICT(sha256) DO UPDATE SET url=excluded.url, uploaded_at=excluded.uploaded_at""",
+                               (digest, url, size, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    def stats(self):
+        with self._lock:
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM uploads").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "bytes_saved": self.bytes_saved, "entries": entries, "bytes": total}
+_index = None
+_index_lock = threading.Lock()
+def get_upload_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = UploadIndex()
+    return _index
+def _no_timer(step):
+    return nullcontext({})
+async def upload_once(cms, audio_bytes, filename, index=None, content_type="audio/mpeg", timer=None):
+    """Trả về (url, hit). Chỉ ghi vào index khi save-file trả URL vĩnh viễn (save_file lỗi thì nó trả lại tên file tạm).
+    timer(step) → context manager đo từng bước "dedup" / "cms_upload" / "cms_save" (VD RunMetrics.timer của batch)."""
+    index = index or get_upload_index()
+    timer = timer or _no_timer
+    with timer("dedup") as t:
+        digest = await asyncio.to_thread(audio_digest, audio_bytes)
+        url = index.get(digest, len(audio_bytes))
+        if url: t["bytes"] = len(audio_bytes)
+    if url:
+        return url, True
+    with timer("cms_upload") as t:
+        t["bytes"] = len(audio_bytes)
+        fname = await cms.upload_audio(audio_bytes, filename, content_type)
+    if not fname:
+        return None, False
+    with timer("cms_save"):
+        url = await cms.save_file(fname)
+    if url and url != fname:
+        index.put(digest, url, len(audio_bytes))
+    return url, False
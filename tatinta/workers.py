@@ -0,0 +1,45 @@
+"""Chạy 1 batch bằng nhiều process trên cùng máy (tận dụng nhiều core: parse HTML, chuẩn hóa text, mix đều tốn CPU).
+Mọi worker dùng chung hàng đợi jobs.db trên ổ cục bộ, mỗi worker nhận phần bài theo hash dest_id (--shard i/N) và chạy đủ
+fetch → TTS → mix → upload → PATCH. Tiến độ gộp lại từ hàng đợi, lịch sử gộp qua history.db chung rồi đẩy 1 lần."""
+import os
+import sys
+import asyncio
+import subprocess
+_running = {}   # batch_id → [Popen, ...] do process này khởi động (app Streamlit xem lại được sau khi rerun)
+def worker_argv(batch_id, index, count, extra_args=()):
+    return [sys.executable, "-m", "tatinta", "--resume", batch_id, "--shard", f"{index}/{count}", *extra_args]
+def spawn_workers(batch_id, count, token, extra_args=(), log_dir=None):
+    """Khởi động count process worker cho batch. Token truyền qua biến môi trường (không lộ trên dòng lệnh / ps).
+    Số tiến trình ffmpeg mỗi worker được chia theo số core để N worker không giành nhau."""
+    env = dict(os.environ, TATINTA_TOKEN=token,
+               TATINTA_MIX_PROCS=str(max(1, (os.cpu_count() or 2) // count)))
+    procs = []
+    for i in range(count):
+        out = subprocess.DEVNULL
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+            out = open(os.path.join(log_dir, f"{batch_id}.worker{i}.log"), "ab")
+        procs.append(subprocess.Popen(worker_argv(batch_id, i, count, extra_args), env=env, stdout=out, stderr=out,
+                                      stdin=subprocess.DEVNULL))
+        if out is not subprocess.DEVNULL: out.close()
+    _running[batch_id] = procs
+    return procs
+def running_workers(batch_id):
+    """Số worker còn sống do process này khởi động cho batch."""
+    return sum(p.poll() is None for p in _running.get(batch_id, []))
+def exit_code(procs, counts):
+    """Gộp exit code: 2 nếu có worker dừng vì token hết hạn / lỗi cấu hình, 1 nếu có bài lỗi, 0 nếu xong hết."""
+    if any(p.returncode == 2 for p in procs): return 2
+    if counts.get("failed") or any(p.returncode not in (0, 1) for p in procs): return 1
+    return 0
+async def watch(queue, batch_id, procs, on_progress=None, interval=2.0):
+    """Chờ mọi worker xong, gọi on_progress(counts, worker_counts) mỗi khi tiến độ đổi."""
+    last = None
+    while True:
+        alive = any(p.poll() is None for p in procs)
+        counts = queue.counts(batch_id)
+        if on_progress and counts != last:
+            on_progress(counts, queue.worker_counts(batch_id))
+            last = counts
+        if not alive: return counts
+        await asyncio.sleep(interval)
@@ -0,0 +1,58 @@
+"""HistoryStore: bảng đếm cập nhật bằng trigger khớp với đếm lại cả bảng, merge chỉ nhận bản mới hơn."""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tatinta.history import HistoryStore
+A, B, C = ("a" * 24, "b" * 24, "c" * 24)
+def recount(store):
+    rows = store.to_dict().values()
+    return {"total": len(rows), "has_vi": sum(bool(r.get("audio_vi")) for r in rows), "has_en": sum(bool(r.get("audio_en")) for r in rows)}
+def test_trigger_counts_follow_inserts_and_updates(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.upsert(A, "A", audio_vi="vi.mp3")
+    store.upsert(B, "B", audio_en="en.mp3")
+    assert store.stats() == {"total": 2, "has_vi": 1, "has_en": 1}
+    # Chạy lại chỉ tiếng Anh: audio VI cũ giữ nguyên, không đếm trùng
+    store.upsert(A, "A", audio_en="en2.mp3")
+    assert store.stats() == {"total": 2, "has_vi": 1, "has_en": 2}
+    store.merge({C: {"title": "C", "ran_at": "2026-01-01 00:00:00", "audio_vi": "c.mp3", "audio_en": ""}})
+    assert store.stats() == recount(store) == {"total": 3, "has_vi": 2, "has_en": 2}
+def test_counts_survive_reopen_of_old_db(tmp_path):
+    path = str(tmp_path / "history.db")
+    store = HistoryStore(path)
+    store.upsert(A, "A", audio_vi="vi.mp3", audio_en="en.mp3")
+    store._conn.execute("DROP TABLE history_counts")
+    assert HistoryStore(path).stats() == {"total": 1, "has_vi": 1, "has_en": 1}
+def test_upsert_keeps_other_language_fingerprint_and_profile(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.upsert(A, "A", audio_vi="vi.mp3", fp_vi="f1", profile_vi="mp3_128k")
+    store.upsert(A, "A2", audio_en="en.mp3", fp_en="f2", profile_en="opus_32k_mono")
+    entry = store.get(A)
+    assert entry["title"] == "A2" and entry["audio_vi"] == "vi.mp3" and entry["fp_vi"] == "f1" and entry["profile_vi"] == "mp3_128k"
+    assert entry["fp_en"] == "f2" and entry["profile_en"] == "opus_32k_mono"
+def test_merge_only_takes_newer_entries(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.upsert(A, "local", audio_vi="local.mp3", ran_at="2026-05-01 10:00:00")
+    changed = store.merge({
+        A: {"title": "old remote", "ran_at": "2026-04-01 10:00:00", "audio_vi": "old.mp3"},
+        B: {"title": "new remote", "ran_at": "2026-04-01 10:00:00", "audio_vi": "b.mp3"},
+    })
+    assert changed == 1
+    assert store.get(A)["title"] == "local" and store.get(B)["title"] == "new remote"
+    store.merge({A: {"title": "newer remote", "ran_at": "2026-06-01 10:00:00", "audio_vi": "new.mp3"}})
+    assert store.get(A)["audio_vi"] == "new.mp3"
+def test_merge_same_ran_at_only_fills_missing_fingerprint(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.upsert(A, "A", audio_vi="vi.mp3", ran_at="2026-05-01 10:00:00")
+    store.merge({A: {"title": "khác", "ran_at": "2026-05-01 10:00:00", "audio_vi": "vi.mp3", "fp_vi": "f1"}})
+    entry = store.get(A)
+    assert entry["fp_vi"] == "f1" and entry["title"] == "A"
+def test_writes_mark_shard_dirty(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    assert not store.dirty
+    store.upsert(A, "A", audio_vi="vi.mp3")
+    shards = store.dirty_shards()
+    assert len(shards) == 1
+    store.clear_dirty(shards)
+    assert not store.dirty
+    assert store.set_fingerprints(A, fp_vi="f") == 1 and store.dirty
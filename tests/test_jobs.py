@@ -0,0 +1,71 @@
+"""JobQueue: checkpoint chỉ đi tiến, fail → retry_failed chạy tiếp từ tầng tốt gần nhất, claim hết hạn thì worker khác nhận."""
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tatinta.jobs import JobQueue, parse_shard, partition_of
+URLS = [f"https://cms.tatinta.com/destination/{i:024x}" for i in range(4)]
+def new_queue(tmp_path, **kw):
+    q = JobQueue(str(tmp_path / "jobs.db"), **kw)
+    return q, q.create_batch(URLS + URLS[:1])
+def test_create_batch_dedups_and_keeps_order(tmp_path):
+    q, b = new_queue(tmp_path)
+    assert q.remaining_urls(b) == URLS
+    assert q.counts(b)["pending"] == len(URLS)
+def test_checkpoint_only_moves_forward(tmp_path):
+    q, b = new_queue(tmp_path)
+    job = q.claim(b, "w1")
+    assert job["url"] == URLS[0] and job["state"] == "pending"
+    job["t_vi"] = "Tiêu đề"
+    assert q.checkpoint(job, "synthesized", "w1")
+    assert not q.checkpoint(job, "fetched", "w1")
+    assert q.counts(b)["synthesized"] == 1
+    # Dữ liệu đã checkpoint đi cùng bài khi claim lại
+    q.release(job, "w1")
+    again = q.claim(b, "w2")
+    assert again["url"] == URLS[0] and again["state"] == "synthesized" and again["t_vi"] == "Tiêu đề"
+def test_patched_releases_claim_and_is_not_claimed_again(tmp_path):
+    q, b = new_queue(tmp_path)
+    seen = []
+    while True:
+        job = q.claim(b, "w1")
+        if job is None: break
+        seen.append(job["url"])
+        q.checkpoint(job, "patched", "w1")
+    assert seen == URLS
+    assert q.counts(b)["patched"] == len(URLS) and q.remaining_urls(b) == []
+def test_fail_then_retry_resumes_from_last_good_state(tmp_path):
+    q, b = new_queue(tmp_path)
+    job = q.claim(b, "w1")
+    q.checkpoint(job, "uploaded", "w1")
+    q.fail(job, "patch", "HTTP 500", "w1")
+    assert q.counts(b)["failed"] == 1
+    assert q.failures(b) == [{"url": URLS[0], "stage": "patch", "error": "HTTP 500"}]
+    assert URLS[0] not in q.remaining_urls(b)
+    assert q.retry_failed(b) == 1
+    counts = q.counts(b)
+    assert counts["failed"] == 0 and counts["uploaded"] == 1
+    assert q.remaining_urls(b)[0] == URLS[0]
+def test_expired_lease_is_claimed_by_another_worker(tmp_path):
+    q, b = new_queue(tmp_path, lease=0.05)
+    first = q.claim(b, "w1")
+    assert q.claim(b, "w2")["url"] == URLS[1]
+    time.sleep(0.1)
+    stolen = q.claim(b, "w2")
+    assert stolen["url"] == first["url"]
+    # Worker cũ mất lease: không ghi đè được kết quả của worker mới
+    assert not q.checkpoint(first, "fetched", "w1")
+    assert q.checkpoint(stolen, "fetched", "w2")
+def test_heartbeat_keeps_lease(tmp_path):
+    q, b = new_queue(tmp_path, lease=0.2)
+    job = q.claim(b, "w1")
+    for _ in range(3):
+        time.sleep(0.1)
+        q.heartbeat("w1")
+    assert all(q.claim(b, "w2")["url"] != job["url"] for _ in range(len(URLS) - 1))
+def test_shard_prefers_own_partition(tmp_path):
+    q, b = new_queue(tmp_path)
+    i, n = parse_shard("1/2")
+    own = [u for u in URLS if partition_of(u) % n == i]
+    claimed = [q.claim(b, "w", (i, n))["url"] for _ in URLS]
+    assert claimed[:len(own)] == own and sorted(claimed) == sorted(URLS)
@@ -0,0 +1,57 @@
+"""AdaptiveLimiter dùng chung giữa nhiều event loop (mỗi phiên Streamlit = 1 thread chạy asyncio.run riêng)."""
+import os
+import sys
+import time
+import asyncio
+import threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tatinta.limits import AdaptiveLimiter
+def run_sessions(limiter, names, tasks=3, rounds=5, hold=0.02, timeout=5):
+    results, peak, lock = {}, [0], threading.Lock()
+    active = [0]
+    async def task():
+        for _ in range(rounds):
+            async with limiter.slot():
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                await asyncio.sleep(hold)
+                with lock:
+                    active[0] -= 1
+    async def session():
+        # Mỗi phiên có sẵn vài task đang chờ slot khi phiên kia bắt đầu
+        await asyncio.gather(*(task() for _ in range(tasks)))
+    def worker(name):
+        try:
+            asyncio.run(asyncio.wait_for(session(), timeout))
+            results[name] = "ok"
+        except Exception as e:
+            results[name] = repr(e)
+    threads = [threading.Thread(target=worker, args=(n,)) for n in names]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return results, peak[0]
+def test_two_asyncio_run_callers_share_limiter():
+    limiter = AdaptiveLimiter("test", initial=1, min_limit=1, max_limit=1)
+    results, peak = run_sessions(limiter, ["A", "B"])
+    assert results == {"A": "ok", "B": "ok"}
+    assert peak == 1
+    assert limiter.in_flight == 0 and not limiter._waiters
+def test_cancelled_waiter_passes_turn_on():
+    limiter = AdaptiveLimiter("test", initial=1, min_limit=1, max_limit=1)
+    async def main():
+        async def hold():
+            async with limiter.slot():
+                await asyncio.sleep(0.05)
+        holder = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        stuck = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        stuck.cancel()
+        t0 = time.monotonic()
+        await holder
+        async with limiter.slot():
+            pass
+        return time.monotonic() - t0
+    assert asyncio.run(main()) < 1
+    assert limiter.in_flight == 0
@@ -0,0 +1,58 @@
+"""StagedPipeline: thứ tự tầng, bài lỗi không chặn bài khác, PipelineAbort dừng cả batch."""
+import os
+import sys
+import asyncio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tatinta.pipeline import StagedPipeline, Stage, PipelineAbort
+def run(stages, jobs, **kw):
+    events = {"ok": [], "fail": [], "stage": []}
+    pipeline = StagedPipeline(stages, on_ok=events["ok"].append, on_stage=lambda j, s: events["stage"].append((j["id"], s)),
+                              on_fail=lambda j, s, e: events["fail"].append((j["id"], s, type(e).__name__)), **kw)
+    asyncio.run(pipeline.run(jobs))
+    return pipeline, events
+def test_every_job_passes_every_stage_in_order():
+    async def step(job):
+        job["trace"].append(len(job["trace"]))
+        await asyncio.sleep(0.001 * (job["id"] % 3))
+    stages = [Stage("a", step, 3), Stage("b", step, 2), Stage("c", step, 1)]
+    jobs = [{"id": i, "trace": []} for i in range(10)]
+    _, events = run(stages, jobs, queue_size=2)
+    assert sorted(j["id"] for j in events["ok"]) == list(range(10))
+    assert all(j["trace"] == [0, 1, 2] for j in jobs)
+    for i in range(10):
+        assert [s for j, s in events["stage"] if j == i] == ["a", "b", "c"]
+def test_async_generator_source():
+    async def source():
+        for i in range(5):
+            await asyncio.sleep(0)
+            yield {"id": i}
+    async def noop(job): pass
+    _, events = run([Stage("a", noop)], source())
+    assert [j["id"] for j in events["ok"]] == list(range(5))
+def test_failed_job_stops_at_its_stage_only():
+    seen_b = []
+    async def a(job):
+        if job["id"] == 2: raise ValueError("hỏng")
+    async def b(job):
+        seen_b.append(job["id"])
+    _, events = run([Stage("a", a), Stage("b", b)], [{"id": i} for i in range(5)])
+    assert events["fail"] == [(2, "a", "ValueError")]
+    assert sorted(seen_b) == [0, 1, 3, 4]
+    assert len(events["ok"]) == 4
+def test_abort_reports_every_dropped_job():
+    async def a(job):
+        await asyncio.sleep(0.005)
+        if job["id"] == 2: raise PipelineAbort("token hết hạn")
+    async def b(job):
+        await asyncio.sleep(0.005)
+    pipeline, events = run([Stage("a", a), Stage("b", b)], [{"id": i} for i in range(20)], queue_size=2)
+    assert pipeline.aborted
+    assert isinstance(pipeline.abort_error, PipelineAbort)
+    ok = {j["id"] for j in events["ok"]}
+    failed = [j for j, _, _ in events["fail"]]
+    assert 2 in failed and all(kind == "PipelineAbort" for _, _, kind in events["fail"])
+    # Mỗi bài đã vào pipeline có đúng 1 sự kiện kết thúc; bài chưa vào thì không chạy
+    started = {j for j, s in events["stage"] if s == "a"}
+    assert ok.isdisjoint(failed) and len(failed) == len(set(failed))
+    assert started <= ok | set(failed)
+    assert len(ok) + len(failed) < 20
@@ -0,0 +1,40 @@
+"""BatchProgress: sự kiện O(1), bỏ URL trùng, vẽ lại gom theo nhịp."""
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tatinta.progress import BatchProgress
+URLS = [f"https://cms.tatinta.com/destination/{i:024x}" for i in range(30)]
+def test_counts_and_rows_follow_events():
+    prog = BatchProgress(URLS + URLS[:5])
+    assert prog.total == 30 and prog.pending == 30
+    prog.stage(URLS[3], "▶️ Tải")
+    prog.stage(URLS[3], "▶️ TTS")
+    assert prog.running_rows(2)[0] == {"URL": URLS[3], "Trạng thái": "▶️ TTS"}
+    prog.succeed(URLS[3], {"URL": URLS[3]})
+    prog.failed(URLS[0], {"URL": URLS[0]})
+    # Bài lỗi ngay khi còn trong hàng chờ (chưa vào tầng nào) cũng rời hàng chờ
+    assert prog.done == 2 and prog.pending == 28 and prog.done + prog.pending == prog.total
+    assert URLS[0] not in {r["URL"] for r in prog.rows("running")}
+    prog.stage("https://không-có-trong-batch", "▶️ Tải")
+    assert prog.pending == 28
+def test_recent_is_newest_first_and_limited():
+    prog = BatchProgress(URLS)
+    for u in URLS[:25]:
+        prog.succeed(u, {"URL": u})
+    recent = prog.recent("ok", limit=20)
+    assert len(recent) == 20 and recent[0]["URL"] == URLS[24] and recent[-1]["URL"] == URLS[5]
+    assert len(prog.rows("ok")) == 25
+    assert prog.running_rows(10) == [{"URL": u, "Trạng thái": "⏳ Đang chờ"} for u in URLS[25:]]
+def test_due_throttles_until_interval_passes():
+    prog = BatchProgress(URLS, interval=0.05)
+    assert prog.due()          # lần đầu: có thay đổi
+    assert not prog.due()      # không có gì mới
+    prog.stage(URLS[0], "▶️ Tải")
+    assert not prog.due()      # có thay đổi nhưng chưa hết interval
+    time.sleep(0.06)
+    assert prog.due()
+    prog.stage(URLS[0], "▶️ TTS")
+    assert prog.due(force=True)
+    time.sleep(0.06)
+    assert not prog.due()      # force đã vẽ thay đổi đó
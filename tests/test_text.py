@@ -0,0 +1,97 @@
+"""Bảng luật chuẩn hóa (text.py) cho ra đúng kết quả như chuỗi re.sub ban đầu, trên mọi tiêu đề trong processed_urls.json
+(chỉ tiêu đề + bài tổng hợp có số, đơn vị, tiền tệ, thế kỷ, gạch đầu dòng...)."""
+import os
+import re
+import sys
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tatinta.text import HTML_STEPS, apply_rules, fix_plain_text_for_tts, preview_excerpt
+from bench.bench_text import HISTORY_FILE, FILLER, build_articles
+EXTRA = [
+    "Mở cửa 7:30 — 17:00; giá €15 hoặc 20$; XXI thế kỷ XIX; 1.234.567 người",
+    "1. Mục một\n2.1 Mục con\n- gạch đầu dòng\n• chấm tròn\n\n\n\nhết",
+    "Tên “A” & ‘B’ «C» <tag> {x} | y \\ z `code` * # _ ~",
+    "Đi 5 km, cao 3m, rộng 200 m², nặng 4kg, 10 ha, 7cm, tăng 15 %",
+    "UNESCO công nhận DMZ — NASA và CLB",
+]
+def _baseline_rules_html(text):
+    # Chuỗi xử lý ban đầu của fix_text_for_tts (sau bước BeautifulSoup), giữ nguyên để so
+    text = re.sub(r'(\d{1,2}:\d{2})\s*[–—-]\s*(\d{1,2}:\d{2})', r'\1 đến \2', text)
+    ROMAN_CENTURY = {
+        'XXI': 21, 'XXII': 22, 'XX': 20, 'XIX': 19, 'XVIII': 18,
+        'XVII': 17, 'XVI': 16, 'XV': 15, 'XIV': 14, 'XIII': 13,
+        'XII': 12, 'XI': 11, 'X': 10, 'IX': 9, 'VIII': 8,
+        'VII': 7, 'VI': 6, 'V': 5, 'IV': 4, 'III': 3, 'II': 2, 'I': 1
+    }
+    text = re.sub(
+        r'(?:thế kỷ\s+)?(X{0,3}(?:IX|IV|V?I{0,3}))\b',
+        lambda m: f"thế kỷ {ROMAN_CENTURY.get(m.group(1), m.group(1))}" if m.group(1) in ROMAN_CENTURY else m.group(0),
+        text
+    )
+    text = re.sub(r'\$\s*(\d[\d\.]*)', r'\1 đô la', text)
+    text = re.sub(r'€\s*(\d[\d\.]*)', r'\1 euro', text)
+    text = re.sub(r'(\d[\d\.]*)\s*€', r'\1 euro', text)
+    text = re.sub(r'(\d[\d\.]*)\s*\$', r'\1 đô la', text)
+    text = re.sub(r'(\d+)\s*%', r'\1 phần trăm', text)
+    for _ in range(3):
+        text = re.sub(r'(?<=\d)\.(?=\d{3}(?:\D|$))', '', text)
+    text = re.sub(r'(?<=\d)\s*km\b', ' ki-lô-mét', text)
+    text = re.sub(r'(?<=\d)\s*m²\b', ' mét vuông', text)
+    text = re.sub(r'(?<=\d)\s*m\b', ' mét', text)
+    text = re.sub(r'(?<=\d)\s*kg\b', ' ki-lô-gam', text)
+    text = re.sub(r'(?<=\d)\s*ha\b', ' héc-ta', text)
+    text = re.sub(r'(?<=\d)\s*cm\b', ' xen-ti-mét', text)
+    text = re.sub(r'(?m)^\s*\d+(?:\.\d+)*\.?\s+', '', text)
+    text = re.sub(r'\s*[–—]\s*', ', ', text)
+    text = re.sub(r'(?m)^\s*[-•·]\s+', '', text)
+    text = re.sub(r' - ', ', ', text)
+    for q in ['"', '“', '”', '„', '‛', '‚',
+              '«', '»', '‹', '›', "'", '‘', '’', '`']:
+        text = text.replace(q, '')
+    text = re.sub(r'[*#_~`<>{}|\\\\]', '', text)
+    text = re.sub(r'[ \t]+', ' ', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = re.sub(r'\b[A-Z]{2,}\b', lambda m: m.group(0).capitalize(), text)
+    text = text.replace('<', '').replace('>', '').replace('&', ' và ')
+    return text.strip()
+def _baseline_plain(title, plain_text):
+    if not title and not plain_text: return ""
+    text = f"{title}...\n\n{plain_text.strip()}"
+    text = re.sub(r'(\d{1,2}:\d{2})\s*[–—-]\s*(\d{1,2}:\d{2})', r'\1 đến \2', text)
+    text = re.sub(r'\$\s*(\d[\d\.]*)', r'\1 đô la', text)
+    text = re.sub(r'(\d+)\s*%', r'\1 phần trăm', text)
+    for _ in range(3):
+        text = re.sub(r'(?<=\d)\.(?=\d{3}(?:\D|$))', '', text)
+    text = re.sub(r'(?<=\d)\s*km\b', ' ki-lô-mét', text)
+    text = re.sub(r'(?<=\d)\s*m²\b', ' mét vuông', text)
+    text = re.sub(r'(?<=\d)\s*m\b', ' mét', text)
+    text = re.sub(r'(?<=\d)\s*kg\b', ' ki-lô-gam', text)
+    text = re.sub(r'(?<=\d)\s*ha\b', ' héc-ta', text)
+    text = re.sub(r'(?<=\d)\s*cm\b', ' xen-ti-mét', text)
+    text = re.sub(r'\s*[–—]\s*', ', ', text)
+    text = re.sub(r'(?m)^\s*[-•·]\s+', '', text)
+    text = re.sub(r' - ', ', ', text)
+    for q in ['"', '“', '”', "'", '‘', '’', '`', '«', '»']:
+        text = text.replace(q, '')
+    text = re.sub(r'[*#_~`<>{}|\\\\]', '', text)
+    text = re.sub(r'[ \t]+', ' ', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = text.replace('<', '').replace('>', '').replace('&', ' và ')
+    return text.strip()
+def samples():
+    with open(HISTORY_FILE, "r", encoding="utf-8") as f:
+        titles = [v.get("title") or "" for v in json.load(f).values()]
+    return [(t, t) for t in titles] + build_articles(titles, paragraphs=3) + [(t, t) for t in FILLER + EXTRA]
+def test_html_rules_match_baseline():
+    items = samples()
+    assert len(items) > 6000
+    diff = [(t, b) for t, b in items if apply_rules(f"{t}...\n\n{b}", HTML_STEPS) != _baseline_rules_html(f"{t}...\n\n{b}")]
+    assert diff == []
+def test_plain_rules_match_baseline():
+    diff = [(t, b) for t, b in samples() if fix_plain_text_for_tts(t, b) != _baseline_plain(t, b)]
+    assert diff == []
+def test_preview_excerpt_cuts_first_paragraph_at_sentence():
+    para = "Câu một ngắn. " * 40
+    assert preview_excerpt(f"Đoạn đầu.\n\nĐoạn hai.") == "Đoạn đầu."
+    out = preview_excerpt(para, max_chars=100)
+    assert len(out) <= 100 and out.endswith(".")
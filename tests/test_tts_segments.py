@@ -0,0 +1,43 @@
+"""tts.split_segments: ranh giới segment chỉ phụ thuộc đoạn của nó — sửa 1 đoạn không làm đổi segment khác."""
+import os
+import sys
+import asyncio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tatinta import tts
+from tatinta.tts import split_segments, SEGMENT_MIN_CHARS
+LONG = "Câu này dài vừa phải để ghép đoạn. " * 60
+PARAS = ["Vịnh Hạ Long...", "Đoạn một nói về bãi biển đẹp với cát trắng và nắng vàng.", LONG.strip(),
+         "Đoạn cuối cảm ơn bạn đã lắng nghe giới thiệu này."]
+def test_one_segment_per_paragraph_short_lines_join_next():
+    segments = split_segments("\n\n".join(PARAS), max_chars=500)
+    assert segments[0] == f"{PARAS[0]}\n\n{PARAS[1]}"
+    assert segments[-1] == PARAS[3]
+    assert all(len(s) <= 500 for s in segments)
+    # Đoạn dài cắt theo câu, ghép lại đủ nội dung
+    assert " ".join(segments[1:-1]) == PARAS[2]
+    assert all(s.endswith(".") for s in segments[1:-1])
+def test_editing_one_paragraph_keeps_other_segments():
+    before = split_segments("\n\n".join(PARAS), max_chars=500)
+    edited = PARAS[:3] + ["Đoạn cuối đã được sửa lại một chút cho hay hơn."]
+    after = split_segments("\n\n".join(edited), max_chars=500)
+    assert after[:-1] == before[:-1] and after[-1] != before[-1]
+def test_trailing_short_line_and_blank_paragraphs():
+    assert split_segments("\n\n  \n\nChỉ một dòng ngắn") == ["Chỉ một dòng ngắn"]
+    assert len("Chỉ một dòng ngắn") < SEGMENT_MIN_CHARS
+    assert split_segments("") == []
+def test_unchanged_segments_come_from_cache(tmp_path):
+    calls = []
+    async def backend(text, voice, rate, pitch):
+        calls.append(text)
+        yield f"<{text}>".encode()
+    tts.set_tts_backend(backend)
+    try:
+        cache = tts.TtsCache(str(tmp_path / "tts"))
+        first = asyncio.run(tts.synthesize("\n\n".join(PARAS), "v", 0, 0, cache=cache, chunk_chars=500))
+        n = len(calls)
+        edited = PARAS[:3] + ["Đoạn cuối đã được sửa lại một chút cho hay hơn."]
+        second = asyncio.run(tts.synthesize("\n\n".join(edited), "v", 0, 0, cache=cache, chunk_chars=500))
+    finally:
+        tts.set_tts_backend(None)
+    assert calls[n:] == [edited[3]]
+    assert first.startswith(b"<" + PARAS[0].encode()) and second[:-len(edited[3].encode()) - 2] == first[:-len(PARAS[3].encode()) - 2]